@@ -0,0 +1,175 @@
+"""Benchmarks the upload path of upload_csv_to_dataset against a local stand-in for the Domo API
+
+Synthetic CSV files are generated once, then each case runs in a fresh process so its peak RSS is its own:
+
+    reservoir_sample  scans the file for a sample of rows
+    infer_schema      samples the files and infers their Domo schema
+    upload_stream     uploads the files to the fake streams API and commits the execution
+
+For every case the report gives the wall time, rows/s, MB/s of the source files, peak RSS and the spans and
+counters the blueprint records in its metrics registry, with each stage summed over the threads that ran it.
+Example:
+
+    python benchmarks/bench_upload.py --rows 2000000 --columns 30 --latency-ms 50 --bandwidth-mb-per-sec 20 \
+        --upload-workers 8 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pydomo.datasets import Schema
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'domo_blueprints'))
+import upload_csv_to_dataset as upload
+import metrics
+from token_cache import connect_domo
+import synthetic
+from fake_domo import FakeDomoServer
+
+CASES = ['reservoir_sample', 'infer_schema', 'upload_stream']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmarks the upload path against a local fake of the Domo API')
+    parser.add_argument('--rows', dest='rows', type=int, default=1000000, required=False)
+    parser.add_argument('--columns', dest='columns', type=int, default=20, required=False)
+    parser.add_argument('--type-mix', dest='type_mix', default=synthetic.DEFAULT_TYPE_MIX, required=False)
+    parser.add_argument('--string-length', dest='string_length', type=int, default=12, required=False)
+    parser.add_argument('--files', dest='files', type=int, default=1, required=False)
+    parser.add_argument('--latency-ms', dest='latency_ms', type=float, default=0, required=False)
+    parser.add_argument('--bandwidth-mb-per-sec', dest='bandwidth_mb_per_sec', type=float, default=0, required=False)
+    parser.add_argument('--failure-rate', dest='failure_rate', type=float, default=0, required=False)
+    parser.add_argument('--upload-workers', dest='upload_workers', type=int, default=4, required=False)
+    parser.add_argument('--read-workers', dest='read_workers', type=int, default=4, required=False)
+    parser.add_argument('--part-size-mb', dest='part_size_mb', type=int, default=50, required=False)
+    parser.add_argument('--adaptive-part-size', dest='adaptive_part_size', choices={'TRUE', 'FALSE'}, default='TRUE', required=False)
+    parser.add_argument('--upload-mode', dest='upload_mode', choices={'parse', 'raw'}, default='parse', required=False)
+    parser.add_argument('--compression', dest='compression', choices={'none', 'gzip'}, default='none', required=False)
+    parser.add_argument('--compression-level', dest='compression_level', type=int, choices=range(0, 10), default=6, required=False)
+    parser.add_argument('--validation', dest='validation', choices={'off', 'strict', 'reject'}, default='off', required=False)
+    parser.add_argument('--sample-rows', dest='sample_rows', type=int, default=10000, required=False)
+    parser.add_argument('--sampling-mode', dest='sampling_mode', choices={'reservoir', 'seek'}, default='reservoir', required=False)
+    parser.add_argument('--cases', dest='cases', default=','.join(CASES), required=False)
+    parser.add_argument('--repeat', dest='repeat', type=int, default=1, required=False)
+    parser.add_argument('--data-dir', dest='data_dir', default=None, required=False)
+    parser.add_argument('--output', dest='output', default=None, required=False)
+    return parser.parse_args()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(case:str, options:dict, file_paths:list, schema:list, api_host:str) -> dict:
+    """Runs one case and measures it. This runs in its own process, so the metrics registry starts empty"""
+    # collect the metrics of the blueprint without writing its reports when the process exits
+    metrics.REGISTRY.enabled = True
+    # connect the way the blueprints do, so part uploads are retried under the same policy
+    domo = connect_domo('benchmark', 'benchmark', api_host=api_host, use_https=False)
+    start = time.perf_counter()
+    if case == 'reservoir_sample':
+        for file_path in file_paths:
+            records = upload.csv_parts.iter_records(file_path)
+            next(records, None)
+            upload.reservoir_sample(records, options['sample_rows'])
+    elif case == 'infer_schema':
+        file_name = file_paths if len(file_paths) > 1 else file_paths[0]
+        upload.infer_schema(file_name, None, domo, k=options['sample_rows'], sampling_mode=options['sampling_mode'])
+    elif case == 'upload_stream':
+        work_dir = os.path.dirname(file_paths[0])
+        file_name = file_paths if len(file_paths) > 1 else file_paths[0]
+        compression_level = options['compression_level'] if options['compression'] == 'gzip' else None
+        upload.upload_stream(domo, file_name, 'benchmark', 'REPLACE', '', None, None, Schema(schema),
+                             options['upload_workers'], options['upload_mode'], compression_level,
+                             options['part_size_mb'] * 1024 * 1024, options['adaptive_part_size'] == 'TRUE',
+                             os.path.join(work_dir, 'upload_checkpoint.json'), False, None, options['read_workers'],
+                             os.path.join(work_dir, 'upload_progress.json'), options['validation'],
+                             os.path.join(work_dir, 'upload_rejects.csv'), options['sample_rows'],
+                             options['sampling_mode'])
+    else:
+        raise ValueError(f"Unknown case {case}. Choose from {', '.join(CASES)}")
+    seconds = time.perf_counter() - start
+    report = metrics.REGISTRY.report(case)
+    return {'seconds': seconds, 'peak_rss_mb': peak_rss_mb(), 'stages': report['spans'], 'counters': report['counters']}
+
+
+def summarize(case:str, runs:list, rows:int, size:int) -> dict:
+    seconds = statistics.median(run['seconds'] for run in runs)
+    return {
+        'case': case,
+        'runs': len(runs),
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(rows / seconds),
+        'mb_per_sec': round(size / 1024 / 1024 / seconds, 2),
+        'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+        'stages': runs[len(runs) // 2]['stages'],
+        'counters': runs[len(runs) // 2]['counters']
+    }
+
+
+def print_report(results:list):
+    print(f"{'case':<18}{'seconds':>10}{'rows/s':>14}{'MB/s':>10}{'peak RSS MB':>14}")
+    for result in results:
+        print(f"{result['case']:<18}{result['seconds']:>10.3f}{result['rows_per_sec']:>14,}"
+              f"{result['mb_per_sec']:>10.2f}{result['peak_rss_mb']:>14.1f}")
+        for stage, timing in result['stages'].items():
+            print(f"    {stage:<18}{timing['seconds']:>10.3f} s over {timing['count']} runs")
+        for name, value in result['counters'].items():
+            print(f"    {name:<18}{value:>10,}")
+
+
+def main():
+    args = get_args()
+    options = vars(args)
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='domo-benchmark-')
+    os.makedirs(data_dir, exist_ok=True)
+    # keep the caches of the blueprints out of the way of real runs
+    os.environ.setdefault('DOMO_BLUEPRINTS_CACHE_DIR', os.path.join(data_dir, 'cache'))
+
+    schema = synthetic.make_schema(args.columns, args.type_mix)
+    file_paths = []
+    size = 0
+    rows_per_file = -(-args.rows // args.files)
+    print(f"Generating {args.rows} rows of {args.columns} columns in {args.files} files under {data_dir}")
+    for i in range(args.files):
+        file_path = os.path.join(data_dir, f'benchmark_{i}.csv')
+        rows = min(rows_per_file, args.rows - i * rows_per_file)
+        size += synthetic.generate_csv(file_path, rows, schema, args.string_length, seed=i)
+        file_paths.append(file_path)
+    print(f"Generated {size / 1024 / 1024:.1f} MB")
+
+    bandwidth = args.bandwidth_mb_per_sec * 1024 * 1024 or None
+    results = []
+    with FakeDomoServer(latency=args.latency_ms / 1000, bandwidth=bandwidth, failure_rate=args.failure_rate) as server:
+        # pool workers are daemonic and could not start the compression processes of the upload
+        context = multiprocessing.get_context('spawn')
+        for case in cases:
+            runs = []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(run_case, case, options, file_paths, schema, server.api_host).result())
+            results.append(summarize(case, runs, args.rows, size))
+        server_stats = dict(server.stats)
+
+    print_report(results)
+    print(f"Fake server: {server_stats['requests']} requests, {server_stats['parts']} parts, "
+          f"{server_stats['part_bytes'] / 1024 / 1024:.1f} MB and {server_stats['rows']} rows committed, "
+          f"{server_stats['failures']} failures injected")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': options, 'source_mb': round(size / 1024 / 1024, 2), 'results': results,
+                       'server': server_stats}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
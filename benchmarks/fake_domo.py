@@ -0,0 +1,224 @@
+import re
+import gzip
+import json
+import time
+import random
+import threading
+import itertools
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READ_CHUNK_SIZE = 64 * 1024
+
+STREAM_PATH = re.compile(r'^/v1/streams/(\d+)$')
+EXECUTIONS_PATH = re.compile(r'^/v1/streams/(\d+)/executions$')
+EXECUTION_PATH = re.compile(r'^/v1/streams/(\d+)/executions/(\d+)$')
+PART_PATH = re.compile(r'^/v1/streams/(\d+)/executions/(\d+)/part/(\d+)$')
+EXECUTION_ACTION_PATH = re.compile(r'^/v1/streams/(\d+)/executions/(\d+)/(commit|abort)$')
+DATASET_PATH = re.compile(r'^/v1/datasets/([\w-]+)$')
+
+
+class Throttle:
+    """Limits the bytes received by every connection together to a bandwidth, like a shared uplink"""
+
+    def __init__(self, bandwidth:float=None):
+        self.bandwidth = bandwidth
+        self.available_at = 0
+        self.lock = threading.Lock()
+
+    def consume(self, size:int):
+        if not self.bandwidth:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.available_at = max(self.available_at, now) + size / self.bandwidth
+            delay = self.available_at - now
+        time.sleep(delay)
+
+
+class FakeDomoServer(ThreadingHTTPServer):
+    """A local stand-in for the parts of the Domo API used by the upload blueprint
+
+    It implements the OAuth token endpoint, the streams API (create, update, search, executions, parts, commit
+    and abort) and the dataset endpoints used to sync schemas, keeping everything in memory. Part bodies are
+    read and counted but not kept. Every request is delayed by latency seconds, and request bodies are read
+    no faster than bandwidth bytes per second across all connections. A failure_rate between 0 and 1 turns
+    that share of part uploads away with a 503, to exercise the retries of the client.
+
+    Use it as a context manager, which serves requests from a background thread:
+
+        with FakeDomoServer(latency=0.05, bandwidth=10 * 1024 * 1024) as server:
+            domo = server.connect()
+    """
+    daemon_threads = True
+
+    def __init__(self, latency:float=0, bandwidth:float=None, port:int=0, failure_rate:float=0):
+        super().__init__(('127.0.0.1', port), FakeDomoHandler)
+        self.latency = latency
+        self.throttle = Throttle(bandwidth)
+        self.failure_rate = failure_rate
+        self.ids = itertools.count(1)
+        self.streams = {}
+        self.datasets = {}
+        self.executions = {}
+        self.stats = {'requests': 0, 'parts': 0, 'part_bytes': 0, 'rows': 0, 'commits': 0, 'failures': 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def api_host(self) -> str:
+        return f'127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def connect(self):
+        """Returns a pydomo client talking to this server"""
+        from pydomo import Domo
+        return Domo('benchmark', 'benchmark', api_host=self.api_host, use_https=False)
+
+    def create_stream(self, request:dict) -> dict:
+        with self.lock:
+            dataset_id = f'dataset-{next(self.ids)}'
+            stream_id = next(self.ids)
+            dataset = dict(request.get('dataSet', {}), id=dataset_id)
+            self.datasets[dataset_id] = dataset
+            self.streams[stream_id] = {'id': stream_id, 'dataSet': dataset,
+                                       'updateMethod': request.get('updateMethod')}
+            return self.streams[stream_id]
+
+    def create_execution(self, stream_id:int) -> dict:
+        with self.lock:
+            execution = {'id': next(self.ids), 'streamId': stream_id, 'currentState': 'ACTIVE', 'parts': {}}
+            self.executions[execution['id']] = execution
+            return execution
+
+    def receive_part(self, execution_id:int, part_num:int, body:bytes, encoding:str):
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        rows = body.count(b'\n')
+        with self.lock:
+            self.executions[execution_id]['parts'][part_num] = rows
+            self.stats['parts'] += 1
+            self.stats['part_bytes'] += len(body)
+
+    def finish_execution(self, execution_id:int, action:str) -> dict:
+        with self.lock:
+            execution = self.executions[execution_id]
+            if action == 'commit':
+                execution['currentState'] = 'SUCCESS'
+                self.stats['commits'] += 1
+                self.stats['rows'] += sum(execution['parts'].values())
+            else:
+                execution['currentState'] = 'ABORTED'
+            return execution
+
+
+class FakeDomoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        chunks = []
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                self.server.throttle.consume(size)
+            return b''.join(chunks)
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            chunk = self.rfile.read(min(remaining, READ_CHUNK_SIZE))
+            if not chunk:
+                break
+            self.server.throttle.consume(len(chunk))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def respond(self, status:int, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, method:str):
+        body = self.read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+        url = urlparse(self.path)
+        # pydomo posts new streams to /v1/streams/
+        path = url.path.rstrip('/')
+        server = self.server
+        if path == '/oauth/token':
+            return self.respond(200, {'access_token': 'benchmark', 'expires_in': 3600})
+        if method == 'PUT' and PART_PATH.match(path):
+            if random.random() < server.failure_rate:
+                with server.lock:
+                    server.stats['failures'] += 1
+                return self.respond(503, {'message': 'injected failure'})
+            _, execution_id, part_num = PART_PATH.match(path).groups()
+            server.receive_part(int(execution_id), int(part_num), body, self.headers.get('Content-Encoding'))
+            return self.respond(200)
+        if method == 'PUT' and EXECUTION_ACTION_PATH.match(path):
+            _, execution_id, action = EXECUTION_ACTION_PATH.match(path).groups()
+            execution = server.finish_execution(int(execution_id), action)
+            return self.respond(200, {key: value for key, value in execution.items() if key != 'parts'})
+        if method == 'POST' and path == '/v1/streams':
+            return self.respond(201, server.create_stream(json.loads(body)))
+        if method == 'GET' and path == '/v1/streams/search':
+            query = parse_qs(url.query).get('q', [''])[0]
+            field, _, value = query.partition(':')
+            key = field.split('.')[-1]
+            return self.respond(200, [stream for stream in server.streams.values()
+                                      if str(stream['dataSet'].get(key)) == value])
+        if method == 'PATCH' and STREAM_PATH.match(path):
+            stream = server.streams.get(int(STREAM_PATH.match(path).group(1)))
+            if stream is None:
+                return self.respond(404, {'message': 'stream not found'})
+            stream['updateMethod'] = json.loads(body).get('updateMethod', stream['updateMethod'])
+            return self.respond(200, stream)
+        if method == 'POST' and EXECUTIONS_PATH.match(path):
+            execution = server.create_execution(int(EXECUTIONS_PATH.match(path).group(1)))
+            return self.respond(201, {key: value for key, value in execution.items() if key != 'parts'})
+        if method == 'GET' and EXECUTION_PATH.match(path):
+            execution = server.executions.get(int(EXECUTION_PATH.match(path).group(2)))
+            if execution is None:
+                return self.respond(404, {'message': 'execution not found'})
+            return self.respond(200, {key: value for key, value in execution.items() if key != 'parts'})
+        if DATASET_PATH.match(path):
+            dataset = server.datasets.get(DATASET_PATH.match(path).group(1))
+            if dataset is None:
+                return self.respond(404, {'message': 'dataset not found'})
+            if method == 'PUT':
+                dataset.update(json.loads(body))
+            return self.respond(200, dataset)
+        return self.respond(404, {'message': f'{method} {path} is not implemented by the fake server'})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
@@ -0,0 +1,73 @@
+import string
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 100000 # rows generated and written at a time
+STRING_POOL_SIZE = 10000 # distinct values of each string column
+DEFAULT_TYPE_MIX = 'LONG=2,DOUBLE=2,STRING=3,DATE=1,DATETIME=1'
+
+
+def parse_type_mix(type_mix:str) -> dict:
+    """Parses a type mix such as LONG=2,STRING=1 into the relative weight of each Domo type"""
+    weights = {}
+    for item in type_mix.split(','):
+        domo_type, _, weight = item.partition('=')
+        weights[domo_type.strip().upper()] = float(weight or 1)
+    return weights
+
+
+def make_schema(columns:int, type_mix:str=DEFAULT_TYPE_MIX) -> list:
+    """Assigns a Domo type to each column in the proportions of the type mix
+
+    Returns:
+        list: The name and Domo data type of each column, in the same form as utilities.data_schema
+    """
+    weights = parse_type_mix(type_mix)
+    total = sum(weights.values())
+    schema = []
+    for domo_type, weight in weights.items():
+        count = round(columns * weight / total)
+        schema.extend({'type': domo_type, 'name': f'{domo_type.lower()}_{i}'} for i in range(count))
+    # rounding can leave the count off by a few columns
+    while len(schema) < columns:
+        schema.append({'type': 'STRING', 'name': f'string_{len(schema)}'})
+    return schema[:columns]
+
+
+def make_column(domo_type:str, rows:int, rng:np.random.Generator, string_pool:np.ndarray):
+    if domo_type == 'LONG':
+        return rng.integers(-10 ** 9, 10 ** 9, rows)
+    if domo_type in ('DOUBLE', 'DECIMAL'):
+        return np.round(rng.normal(0, 10 ** 4, rows), 4)
+    if domo_type == 'DATE':
+        return (np.datetime64('2015-01-01') + rng.integers(0, 3650, rows)).astype(str)
+    if domo_type == 'DATETIME':
+        seconds = rng.integers(0, 10 * 365 * 86400, rows)
+        return np.char.replace((np.datetime64('2015-01-01T00:00:00') + seconds).astype(str), 'T', ' ')
+    if domo_type == 'BOOLEAN':
+        return rng.integers(0, 2, rows).astype(bool)
+    return string_pool[rng.integers(0, len(string_pool), rows)]
+
+
+def generate_csv(file_path:str, rows:int, schema:list, string_length:int=12, seed:int=0) -> int:
+    """Writes a CSV file with random values of the types of a schema, a chunk of rows at a time
+
+    Strings are drawn from a pool of random words of up to string_length characters, some of which contain
+    commas or quotes so that the CSV has quoted fields.
+
+    Returns:
+        int: The size of the file in bytes
+    """
+    rng = np.random.default_rng(seed)
+    alphabet = np.array(list(string.ascii_letters + string.digits + ' ,"'))
+    string_pool = np.array([''.join(rng.choice(alphabet, rng.integers(1, string_length + 1)))
+                            for _ in range(STRING_POOL_SIZE)], dtype=object)
+    names = [column['name'] for column in schema]
+    with open(file_path, 'w', newline='') as f:
+        f.write(','.join(names) + '\n')
+        for start in range(0, rows, CHUNK_ROWS):
+            chunk_rows = min(CHUNK_ROWS, rows - start)
+            chunk = pd.DataFrame({column['name']: make_column(column['type'], chunk_rows, rng, string_pool)
+                                  for column in schema})
+            chunk.to_csv(f, index=False, header=False)
+        return f.tell()
@@ -0,0 +1,177 @@
+import os
+from io import BytesIO
+
+BATCH_ROWS = 65536 # rows read from the file at a time
+PARQUET_EXTENSIONS = ['.parquet', '.pq']
+ARROW_EXTENSIONS = ['.arrow', '.feather', '.ipc']
+# pyarrow is imported by the functions that read Parquet and Arrow files, so CSV uploads do not need it
+
+
+def get_file_format(file_path:str) -> str:
+    """Returns parquet, arrow or csv depending on the extension of the file"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return 'parquet'
+    if extension in ARROW_EXTENSIONS:
+        return 'arrow'
+    return 'csv'
+
+
+def is_arrow_file(file_path:str) -> bool:
+    return get_file_format(file_path) != 'csv'
+
+
+def pyarrow_installed() -> bool:
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def read_schema(file_path:str):
+    """Reads the Arrow schema from the metadata of a Parquet or Arrow IPC (Feather V2) file without reading any data"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if get_file_format(file_path) == 'parquet':
+        return pq.read_schema(file_path)
+    with pa.memory_map(file_path, 'r') as source:
+        return pa.ipc.open_file(source).schema
+
+
+def get_domo_schema(file_path:str) -> list:
+    """Maps the Arrow schema of a file to Domo column types
+
+    Returns:
+        list: The name and Domo data type of each column, in the same form as utilities.data_schema
+    """
+    import pyarrow as pa
+    columns = []
+    for field in read_schema(file_path):
+        if pa.types.is_integer(field.type):
+            dtype = 'LONG'
+        elif pa.types.is_floating(field.type):
+            dtype = 'DOUBLE'
+        elif pa.types.is_decimal(field.type):
+            dtype = 'DECIMAL'
+        elif pa.types.is_date(field.type):
+            dtype = 'DATE'
+        elif pa.types.is_timestamp(field.type):
+            dtype = 'DATETIME'
+        else:
+            dtype = 'STRING'
+        columns.append({'type': dtype, 'name': field.name})
+    return columns
+
+
+def skip_rows(batches, start:int):
+    """Yields record batches from a row offset, slicing the batch the offset falls in"""
+    position = 0
+    for batch in batches:
+        if position + batch.num_rows <= start:
+            position += batch.num_rows
+            continue
+        if position < start:
+            batch = batch.slice(start - position)
+            position = start
+        position += batch.num_rows
+        yield batch
+
+
+def iter_record_batches(file_path:str, start:int=0):
+    """Yields the record batches of a Parquet or Arrow IPC file, starting from a row offset
+
+    Parquet files are read a batch at a time and Arrow IPC files are memory-mapped, so the whole file is never
+    loaded into memory. The file is closed once the batches are read or the generator is closed.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if get_file_format(file_path) == 'parquet':
+        with pq.ParquetFile(file_path) as parquet_file:
+            yield from skip_rows(parquet_file.iter_batches(batch_size=BATCH_ROWS), start)
+    else:
+        with pa.memory_map(file_path, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            yield from skip_rows((reader.get_batch(i) for i in range(reader.num_record_batches)), start)
+
+
+def iter_column(file_path:str, index:int):
+    """Yields the values of one column of a Parquet or Arrow IPC file a batch at a time, as they are written to parts
+
+    Only that column is read from Parquet files.
+    """
+    import pyarrow.parquet as pq
+    if get_file_format(file_path) == 'parquet':
+        with pq.ParquetFile(file_path) as parquet_file:
+            name = parquet_file.schema_arrow.names[index]
+            for batch in parquet_file.iter_batches(batch_size=BATCH_ROWS, columns=[name]):
+                yield column_values(batch.column(0))
+    else:
+        for batch in iter_record_batches(file_path):
+            yield column_values(batch.column(index))
+
+
+def column_values(column):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if pa.types.is_timestamp(column.type):
+        column = pc.strftime(column, format='%Y-%m-%d %H:%M:%S')
+    return column.to_pandas()
+
+
+def write_batch(batch, sink):
+    """Writes a record batch to a sink as headerless CSV, formatting timestamps the way Domo expects"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_timestamp(column.type):
+            column = pc.strftime(column, format='%Y-%m-%d %H:%M:%S')
+        columns.append(column)
+    batch = pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+    pa_csv.write_csv(batch, sink, pa_csv.WriteOptions(include_header=False))
+
+
+def iter_arrow_parts(file_path:str, part_size, start:int=None):
+    """Converts the record batches of a Parquet or Arrow IPC file into CSV parts
+
+    Batches are appended to the current part until it reaches the target size, so parts are sized in bytes
+    like CSV parts. Offsets and lengths of Arrow parts are counted in rows rather than bytes.
+
+    Args:
+        file_path (str): The path of the Parquet or Arrow IPC file
+        part_size (int | callable): The target size of each part in bytes, or a function returning the target
+            size of the next part
+        start (int, optional): The row to start from. Defaults to the first row.
+
+    Yields:
+        tuple: The starting row, the number of rows and the CSV bytes of each part
+    """
+    part_start = start or 0
+    rows = 0
+    buffer = BytesIO()
+    size = part_size() if callable(part_size) else part_size
+    for batch in iter_record_batches(file_path, part_start):
+        write_batch(batch, buffer)
+        rows += batch.num_rows
+        if buffer.tell() >= size:
+            yield part_start, rows, buffer.getvalue()
+            part_start += rows
+            rows = 0
+            buffer = BytesIO()
+            size = part_size() if callable(part_size) else part_size
+    if rows:
+        yield part_start, rows, buffer.getvalue()
+
+
+def read_rows(file_path:str, offset:int, length:int) -> bytes:
+    """Reads a range of rows from a Parquet or Arrow IPC file as headerless CSV"""
+    buffer = BytesIO()
+    for batch in iter_record_batches(file_path, offset):
+        if batch.num_rows >= length:
+            write_batch(batch.slice(0, length), buffer)
+            break
+        write_batch(batch, buffer)
+        length -= batch.num_rows
+    return buffer.getvalue()
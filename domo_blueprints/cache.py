@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, so runs there only rely on the atomic replace of the file
+    fcntl = None
+
+CACHE_DIR = os.environ.get(
+    'DOMO_BLUEPRINTS_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'domo-blueprints'))
+
+
+class JsonCache:
+    """A small on-disk cache stored as a single JSON file, shared by every run on the same machine
+
+    Entries expire after a time-to-live, and the oldest entries are evicted once there are more than
+    max_entries. Reading an entry never writes the file. Every write takes a lock file, reloads the cache and
+    applies its change to what it finds, so entries written by a concurrent run are kept, and replaces the file
+    atomically, so a reader sees either the old or the new contents, never a partial file. A private cache is
+    only readable by the current user.
+    """
+
+    def __init__(self, name:str, ttl:float, max_entries:int=256, cache_dir:str=CACHE_DIR, private:bool=False):
+        self.path = os.path.join(cache_dir, f'{name}.json')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.private = private
+        self.lock = threading.Lock()
+
+    def get(self, key:str):
+        """Returns the value of an entry, or None if it is missing or has expired"""
+        entry = self._load().get(key)
+        if entry is None:
+            return None
+        if self.is_expired(entry):
+            with self.locked() as entries:
+                # another run may have set the entry again since it was read
+                if key in entries and self.is_expired(entries[key]):
+                    del entries[key]
+            return None
+        return entry['value']
+
+    def set(self, key:str, value):
+        with self.locked() as entries:
+            entries[key] = {'value': value, 'created': time.time()}
+            if len(entries) > self.max_entries:
+                by_age = sorted(entries, key=lambda k: entries[k]['created'])
+                for stale_key in by_age[:len(entries) - self.max_entries]:
+                    del entries[stale_key]
+
+    def delete(self, key:str):
+        with self.locked() as entries:
+            entries.pop(key, None)
+
+    def is_expired(self, entry:dict) -> bool:
+        return time.time() - entry['created'] > self.ttl
+
+    @contextmanager
+    def locked(self):
+        """Yields the entries of the cache to change while holding its lock, and saves them if they changed"""
+        with self.lock, self._file_lock():
+            entries = self._load()
+            before = dict(entries)
+            yield entries
+            if entries != before:
+                self._save(entries)
+
+    @contextmanager
+    def _file_lock(self):
+        """Holds an exclusive lock on a file next to the cache, so runs on the same machine write one at a time"""
+        lock_file = None
+        if fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                lock_file = open(f'{self.path}.lock', 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except OSError as e:
+                print(f"Unable to lock the cache {self.path}: {e}")
+                if lock_file is not None:
+                    lock_file.close()
+                    lock_file = None
+        try:
+            yield
+        finally:
+            if lock_file is not None:
+                # closing the file releases the lock
+                lock_file.close()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # a missing or unreadable cache is treated as empty
+            return {}
+
+    def _save(self, entries:dict):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            mode = 0o600 if self.private else 0o666
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), 'w') as f:
+                json.dump(entries, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Unable to write the cache {self.path}: {e}")
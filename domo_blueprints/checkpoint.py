@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class UploadCheckpoint:
+    """Records the parts of a stream execution in a JSON lines manifest so an interrupted upload can be resumed
+
+    Every part is recorded with the file it was read from, its offset and length, and the MD5 checksum of its
+    bytes before it is uploaded, and is marked as uploaded once Domo has accepted it. Each change is appended
+    to the manifest as a line of its own, so recording a part costs the same however many parts came before
+    it. The manifest is compacted to one line per part when the execution is committed and when it is loaded.
+    A line cut short by the process dying is ignored.
+    """
+
+    def __init__(self, manifest_path:str, stream_id, execution_id, file_paths:list):
+        self.manifest_path = manifest_path
+        self.stream_id = stream_id
+        self.execution_id = execution_id
+        self.files = {file_path: file_signature(file_path) for file_path in file_paths}
+        self.starts = {}
+        self.parts = {}
+        self.committed = False
+        self.journal = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, manifest_path:str):
+        """Loads the manifest written by a previous run, returning None if there is none"""
+        if manifest_path is None or not os.path.exists(manifest_path):
+            return None
+        checkpoint = None
+        with open(manifest_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if checkpoint is None:
+                    checkpoint = cls(manifest_path, record['stream_id'], record['execution_id'], [])
+                    checkpoint.files = record['files']
+                checkpoint.replay(record)
+        if checkpoint is not None:
+            checkpoint.compact()
+        return checkpoint
+
+    def replay(self, record:dict):
+        """Applies a line of the manifest"""
+        kind = record.get('type')
+        if kind == 'part':
+            self.parts[record['part_num']] = record['part']
+        elif kind == 'uploaded':
+            self.parts[record['part_num']]['uploaded'] = True
+        elif kind == 'start':
+            self.starts[record['file']] = record['offset']
+        elif kind == 'committed':
+            self.committed = True
+        elif kind is None:
+            # a manifest written as a single JSON document by an earlier version
+            self.starts = record.get('starts', {})
+            self.parts = {int(part_num): part for part_num, part in record['parts'].items()}
+            self.committed = record['committed']
+
+    def can_resume(self, streams, file_paths:list) -> bool:
+        """Checks that the execution is still open in Domo and that the files have not changed since the manifest was written"""
+        if self.committed:
+            print(f"Execution {self.execution_id} was already committed. Starting a new upload")
+            return False
+        if sorted(self.files) != sorted(file_paths) or any(
+                file_signature(file_path) != self.files[file_path] for file_path in file_paths):
+            print("The files have changed since the last upload. Starting a new upload")
+            return False
+        try:
+            execution = streams.get_execution(self.stream_id, self.execution_id)
+        except Exception as e:
+            print(f"Execution {self.execution_id} of stream {self.stream_id} could not be found. Starting a new upload")
+            print(e)
+            return False
+        if execution['currentState'] != 'ACTIVE':
+            print(f"Execution {self.execution_id} is {execution['currentState']}. Starting a new upload")
+            return False
+        return True
+
+    def discard(self, streams):
+        """Aborts the execution of a failed upload that is not resumed, so it is not left open in Domo"""
+        if self.committed:
+            return
+        print(f"Aborting execution {self.execution_id} of stream {self.stream_id}, left open by the last upload")
+        try:
+            streams.abort_execution(self.stream_id, self.execution_id)
+        except Exception as e:
+            print(f"Error in aborting execution {self.execution_id}: {e}")
+
+    def add_part(self, part_num:int, file_path:str, offset:int, length:int, data:bytes):
+        """Records a part before it is uploaded. Offsets and lengths are in bytes for CSV files and in rows for Arrow files"""
+        part = {
+            'file': file_path,
+            'offset': offset,
+            'length': length,
+            'md5': hashlib.md5(data).hexdigest(),
+            'uploaded': False
+        }
+        with self.lock:
+            self.parts[part_num] = part
+            self.append({'type': 'part', 'part_num': part_num, 'part': part})
+
+    def complete_part(self, part_num:int):
+        with self.lock:
+            self.parts[part_num]['uploaded'] = True
+            self.append({'type': 'uploaded', 'part_num': part_num})
+
+    def commit(self):
+        with self.lock:
+            self.committed = True
+            self.append({'type': 'committed'})
+        self.compact()
+
+    def pending_parts(self) -> list:
+        """Returns the part numbers and records of the parts that were read but never uploaded"""
+        return sorted((part_num, part) for part_num, part in self.parts.items() if not part['uploaded'])
+
+    def last_part_num(self) -> int:
+        return max(self.parts, default=0)
+
+    def skip_to(self, file_path:str, offset:int):
+        """Records that reading a file starts at an offset past its header, skipping the records before it"""
+        with self.lock:
+            self.starts[file_path] = offset
+            self.append({'type': 'start', 'file': file_path, 'offset': offset})
+
+    def file_offset(self, file_path:str):
+        """Returns the offset after the last recorded part of a file, or where reading it starts if no part of it was recorded"""
+        ends = [part['offset'] + part['length'] for part in self.parts.values() if part['file'] == file_path]
+        return max(ends, default=self.starts.get(file_path))
+
+    def append(self, record:dict):
+        """Appends a line to the manifest. The caller holds the lock"""
+        if self.manifest_path is None:
+            return
+        if self.journal is None:
+            if not os.path.exists(self.manifest_path):
+                self.rewrite()
+            self.journal = open(self.manifest_path, 'a')
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+
+    def compact(self):
+        """Rewrites the manifest atomically with one line for the execution and one for each part"""
+        if self.manifest_path is None:
+            return
+        with self.lock:
+            self.rewrite()
+
+    def rewrite(self):
+        """Writes the compacted manifest. The caller holds the lock"""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        records = [{'type': 'execution', 'stream_id': self.stream_id, 'execution_id': self.execution_id,
+                    'files': self.files}]
+        records.extend({'type': 'start', 'file': file_path, 'offset': offset}
+                       for file_path, offset in self.starts.items())
+        records.extend({'type': 'part', 'part_num': part_num, 'part': part}
+                       for part_num, part in sorted(self.parts.items()))
+        if self.committed:
+            records.append({'type': 'committed'})
+        temp_path = f'{self.manifest_path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        os.replace(temp_path, self.manifest_path)
+
+
+def file_signature(file_path:str) -> dict:
+    """Returns the size and modification time of a file, used to detect when it has changed"""
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
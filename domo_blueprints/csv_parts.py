@@ -0,0 +1,209 @@
+import csv
+import mmap
+import random
+from io import StringIO
+from math import ceil
+
+
+def find_record_end(buffer, start:int, target:int) -> int:
+    """Finds the end of the first CSV record that ends at or after the target offset
+
+    Newlines inside of quoted fields are not treated as record boundaries. Escaped quotes ("") do not
+    change whether a field is quoted, so counting the quotes between two offsets is enough to track it.
+
+    Args:
+        buffer (mmap | bytes): The contents of the file
+        start (int): An offset at the start of a record
+        target (int): The offset to search from
+
+    Returns:
+        int: The offset just past the record terminator, or the length of the buffer if there is none
+    """
+    size = len(buffer)
+    if target >= size:
+        return size
+    in_quotes = buffer[start:target].count(b'"') % 2 == 1
+    position = target
+    while True:
+        newline = buffer.find(b'\n', position)
+        if newline == -1:
+            return size
+        if buffer[position:newline].count(b'"') % 2 == 1:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            return newline + 1
+        position = newline + 1
+
+
+def iter_raw_parts(file_path:str, part_size, start:int=None):
+    """Splits a CSV file into parts on record boundaries and yields the offset and raw bytes of each part
+
+    The file is memory-mapped so only the part being yielded is copied into memory. The header row is
+    skipped.
+
+    Args:
+        file_path (str): The path of the CSV file
+        part_size (int | callable): The target size of each part in bytes, or a function returning the target
+            size of the next part. Parts are extended to the end of the record that crosses the target.
+        start (int, optional): The offset of the record to start from. Defaults to the record after the header.
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be memory-mapped and have no records to upload
+            return
+        with buffer:
+            if start is None:
+                start = find_record_end(buffer, 0, 0)
+            while start < len(buffer):
+                size = part_size() if callable(part_size) else part_size
+                end = find_record_end(buffer, start, start + size)
+                yield start, buffer[start:end]
+                start = end
+
+
+def read_range(file_path:str, offset:int, length:int) -> bytes:
+    """Reads a range of bytes from a file"""
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def iter_records(file_path:str):
+    """Yields every record of a CSV file as text, starting with the header
+
+    Unlike iterating over the lines of the file, a record with newlines inside of quoted fields is yielded
+    whole.
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return
+        with buffer:
+            start = 0
+            while start < len(buffer):
+                end = find_record_end(buffer, start, start)
+                yield buffer[start:end].decode('utf-8', errors='replace')
+                start = end
+
+
+def read_records(buffer, start:int, count:int) -> list:
+    """Reads up to count records starting from an offset that is assumed to be the start of a record"""
+    records = []
+    while len(records) < count and start < len(buffer):
+        end = find_record_end(buffer, start, start)
+        records.append(buffer[start:end].decode('utf-8', errors='replace'))
+        start = end
+    return records
+
+
+def is_valid_sample(records:list, n_fields:int) -> bool:
+    """Checks that records parse into the expected number of fields, which fails when they were read from the middle of a quoted field"""
+    rows = list(csv.reader(StringIO(''.join(records))))
+    return len(rows) == len(records) and all(len(row) == n_fields for row in rows)
+
+
+def seek_sample(file_path:str, k:int, probes:int=100, max_resyncs:int=20):
+    """Samples about k records of a CSV file by seeking to random offsets instead of scanning the whole file
+
+    Each probe seeks to a random offset, resynchronizes on the next newline and reads a run of consecutive
+    records from there. A newline inside a quoted field cannot be told apart from a record boundary without
+    scanning from the start, so the run is only kept if it parses into as many fields as the header. Otherwise
+    the probe moves on to the next newline. More probes give a more uniform sample at the cost of more seeks.
+
+    Args:
+        file_path (str): The path of the CSV file
+        k (int): The number of records to sample
+        probes (int, optional): The number of random offsets to read from. Defaults to 100.
+        max_resyncs (int, optional): The number of newlines to try per probe before giving up on it. Defaults to 20.
+
+    Returns:
+        tuple: The header and the sampled records, as text
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return '', []
+        with buffer:
+            header_end = find_record_end(buffer, 0, 0)
+            header = buffer[:header_end].decode('utf-8', errors='replace')
+            n_fields = len(next(csv.reader(StringIO(header)), []))
+            if header_end >= len(buffer):
+                return header, []
+            records_per_probe = max(ceil(k / probes), 1)
+            records = []
+            for _ in range(probes):
+                position = random.randrange(header_end, len(buffer))
+                for _ in range(max_resyncs):
+                    newline = buffer.find(b'\n', position)
+                    if newline == -1:
+                        break
+                    position = newline + 1
+                    run = read_records(buffer, position, records_per_probe)
+                    if run and is_valid_sample(run, n_fields):
+                        records.extend(run)
+                        break
+    return header, records[:k]
+
+
+def resync(buffer, position:int, limit:int, n_fields:int, max_resyncs:int=20, run_length:int=3):
+    """Returns the start of the first record found after an offset that is not the start of a record
+
+    As in seek_sample, a newline is only taken as a record boundary if the run of records after it parses into
+    as many fields as the header. Returns None if no boundary is found before the limit.
+    """
+    for _ in range(max_resyncs):
+        newline = buffer.find(b'\n', position, limit)
+        if newline == -1:
+            return None
+        position = newline + 1
+        run = read_records(buffer, position, run_length)
+        if run and is_valid_sample(run, n_fields):
+            return position
+    return None
+
+
+def parse_record(buffer, start:int) -> list:
+    end = find_record_end(buffer, start, start)
+    return next(csv.reader(StringIO(buffer[start:end].decode('utf-8', errors='replace'))), [])
+
+
+def find_first_record(file_path:str, is_after, scan_window:int=1024 * 1024):
+    """Binary searches a CSV file sorted on a key for the first record past a point
+
+    is_after is called with the fields of a record and must be false for every record before the point and
+    true for every record from it on. The search seeks to the middle of the range left, resynchronizes on the
+    next record and halves the range, so only a few records are read however large the file is. Once the
+    range is smaller than scan_window, or no record boundary can be found in it, the rest is scanned record
+    by record from a known record start.
+
+    Returns:
+        int: The offset of the first record past the point, or the size of the file if there is none
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return 0
+        with buffer:
+            header_end = find_record_end(buffer, 0, 0)
+            header = buffer[:header_end].decode('utf-8', errors='replace')
+            n_fields = len(next(csv.reader(StringIO(header)), []))
+            # the first record past the point starts at or after low and at or before high
+            low, high = header_end, len(buffer)
+            while high - low > scan_window:
+                start = resync(buffer, (low + high) // 2, high, n_fields)
+                if start is None:
+                    break
+                if is_after(parse_record(buffer, start)):
+                    high = start
+                else:
+                    low = find_record_end(buffer, start, start)
+            while low < high:
+                if is_after(parse_record(buffer, low)):
+                    return low
+                low = find_record_end(buffer, low, low)
+            return high
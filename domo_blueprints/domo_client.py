@@ -0,0 +1,292 @@
+import sys
+import json
+import asyncio
+import aiohttp
+try:
+    import errors
+    import metrics
+    from retry import RetryPolicy, CircuitBreaker, MAX_RETRIES
+    from token_cache import TokenCache, SESSION_TOKEN_TTL
+except BaseException:
+    from . import errors
+    from . import metrics
+    from .retry import RetryPolicy, CircuitBreaker, MAX_RETRIES
+    from .token_cache import TokenCache, SESSION_TOKEN_TTL
+
+MAX_CONCURRENCY = 8 # requests in flight at once
+REQUEST_TIMEOUT = 300
+KEEPALIVE_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+REAUTHENTICATE_STATUSES = {401, 403} # statuses with which an expired or revoked session token is rejected
+METADATA_BATCH_SIZE = 100 # cards whose metadata is fetched in one request
+
+
+class AsyncDomoClient:
+    """An asyncio HTTP client for the Domo content APIs shared by every request of a blueprint
+
+    All requests go through one aiohttp session, so connections to the instance are pooled and kept alive
+    between requests. A semaphore caps how many requests are in flight. Responses with status 429 or a
+    transient 5xx and connection errors are retried under a retry policy, after the delay given by their
+    Retry-After header, or with capped exponential backoff and jitter when there is none. The content API
+    requests of the blueprints only read, the card export included, so every one of them can be retried.
+    A 429 pauses every request of the client until the delay has passed, since the rate limit applies to
+    the whole account rather than to one request. After repeated failures the circuit breaker of the policy
+    stops the client from sending more requests for a while.
+
+    Use it as an async context manager:
+
+        async with AsyncDomoClient(domo_instance, auth_headers) as client:
+            response = await client.request('GET', '/api/content/v1/cards', params=params)
+            cards = await response.json()
+    """
+
+    def __init__(self, domo_instance:str, headers:dict=None, max_concurrency:int=MAX_CONCURRENCY,
+                 max_retries:int=MAX_RETRIES, retry_policy:RetryPolicy=None):
+        self.base_url = f"https://{domo_instance}.domo.com"
+        self.headers = dict(headers or {})
+        self.max_concurrency = max_concurrency
+        self.retry_policy = retry_policy or RetryPolicy(max_retries, breaker=CircuitBreaker())
+        self.session = None
+        self.semaphore = None
+        self.paused_until = 0
+        self.reauthenticate = None
+        self.reauthenticate_statuses = set(REAUTHENTICATE_STATUSES)
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def url(self, path:str) -> str:
+        return path if path.startswith('http') else self.base_url + path
+
+    def set_headers(self, headers:dict):
+        """Adds headers to every following request, for example once a session token has been obtained"""
+        self.headers.update(headers)
+        self.session.headers.update(headers)
+
+    async def request(self, method:str, path:str, **kwargs) -> aiohttp.ClientResponse:
+        """Sends a request and reads its whole body
+
+        Keyword arguments are passed to aiohttp. Params with list values are sent as repeated query
+        parameters, as requests does.
+
+        Returns:
+            aiohttp.ClientResponse: The response, whose body can still be read with json(), text() or read()
+        """
+        async def read(response):
+            await response.read()
+            return response
+        return await self.send(method, path, read, **kwargs)
+
+    async def download(self, method:str, path:str, file_path:str, chunk_size:int=CHUNK_SIZE,
+                       buffer_size:int=-1, **kwargs) -> aiohttp.ClientResponse:
+        """Streams the body of a successful response to a file a chunk at a time
+
+        Nothing is written if the response is not successful, and its body is read so it can be reported.
+        buffer_size sets the write buffer of the file, defaulting to the buffer size of the platform.
+
+        Returns:
+            aiohttp.ClientResponse: The response
+        """
+        async def write(response):
+            if response.status != 200:
+                await response.read()
+                return response
+            with open(file_path, 'wb', buffering=buffer_size) as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+            return response
+        return await self.send(method, path, write, **kwargs)
+
+    async def send(self, method:str, path:str, handle, **kwargs):
+        """Sends a request, retrying on rate limits and transient errors, and passes the response to handle
+
+        If the request is rejected with one of reauthenticate_statuses and the client has a reauthenticate
+        coroutine, for example because a cached session token has expired or been revoked, it is awaited and
+        the request is sent once more.
+
+        Raises:
+            CircuitOpenError: if the circuit breaker of the retry policy is open
+        """
+        if isinstance(kwargs.get('params'), dict):
+            kwargs['params'] = encode_params(kwargs['params'])
+        url = self.url(path)
+        policy = self.retry_policy
+        attempt = 0
+        reauthenticated = False
+        while True:
+            await self.wait_for_rate_limit()
+            policy.before_request()
+            metrics.count('http.requests')
+            unauthorized = False
+            async with self.semaphore:
+                try:
+                    async with self.session.request(method, url, **kwargs) as response:
+                        policy.record(response.status)
+                        if (response.status in self.reauthenticate_statuses and self.reauthenticate is not None
+                                and not reauthenticated):
+                            unauthorized = True
+                        elif not policy.can_retry(attempt, True, response.status):
+                            return await handle(response)
+                        else:
+                            delay = policy.delay(attempt, response.headers.get('Retry-After'))
+                            if response.status == 429:
+                                metrics.count('http.rate_limited')
+                                loop = asyncio.get_running_loop()
+                                self.paused_until = max(self.paused_until, loop.time() + delay)
+                            reason = f"status code {response.status}"
+                # a download cut off part way is started again, which rewrites its file from the start
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                    policy.record()
+                    if not policy.can_retry(attempt, True):
+                        raise
+                    delay = policy.delay(attempt)
+                    reason = repr(e)
+            if unauthorized:
+                print("The request was not authorized. Authenticating again")
+                reauthenticated = True
+                await self.reauthenticate()
+                continue
+            attempt += 1
+            metrics.count('http.retries')
+            print(f"Request to {url} failed with {reason}. Retrying in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+
+    async def wait_for_rate_limit(self):
+        delay = self.paused_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            with metrics.span('http.rate_limit_wait'):
+                await asyncio.sleep(delay)
+
+
+def encode_params(params:dict) -> list:
+    """Expands list values into repeated query parameters, which aiohttp does not do by itself"""
+    encoded = []
+    for key, value in params.items():
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            encoded.append((key, str(item)))
+    return encoded
+
+
+
+@metrics.timed('auth.session')
+async def get_access_token(email:str, password:str, domo_instance:str, client:AsyncDomoClient,
+                           token_cache:TokenCache=None, refresh:bool=False) -> str:
+    """Logs in to the content APIs with an email and password and returns the session token
+
+    The token is reused from the token cache unless refresh is set, in which case the cached token was
+    rejected and is dropped before logging in again. Failed logins exit with the matching exit code.
+
+    Args:
+        client (AsyncDomoClient): The client connected to the instance
+        token_cache (TokenCache, optional): The cache of session tokens, off when not given
+        refresh (bool, optional): Whether to ignore the cached token. Defaults to False.
+    """
+    token_cache = token_cache or TokenCache()
+    if refresh:
+        token_cache.delete('session', domo_instance, email)
+    else:
+        domo_token = token_cache.get('session', domo_instance, email, password)
+        if domo_token is not None:
+            return domo_token
+
+    auth_body = json.dumps({
+        "method": "password",
+        "emailAddress": email,
+        "password": password
+    })
+    try:
+        auth_response = await client.request('POST', '/api/content/v2/authentication', data=auth_body,
+                                             headers={'Content-Type': 'application/json'})
+        auth_response_json = await auth_response.json(content_type=None)
+    except Exception as e:
+        print(f"Request error: {e}")
+        sys.exit(errors.EXIT_CODE_BAD_REQUEST)
+
+    try:
+        if auth_response_json["success"] is False:  # Failed to login
+            print(f"Authentication failed due to reason: {auth_response_json['reason']}")
+            sys.exit(errors.EXIT_CODE_INVALID_CREDENTIALS)
+    except Exception as e:
+        if auth_response_json["status"] == 403:  # Failed to login
+            print(f"Authentication failed due to domo instance {domo_instance} being invalid.")
+            sys.exit(errors.EXIT_CODE_INVALID_ACCOUNT)
+        else:
+            print(f"Request error: {e}")
+            sys.exit(errors.EXIT_CODE_BAD_REQUEST)
+
+    # else if the authentication succeeded
+    try:
+        domo_token = auth_response_json['sessionToken']
+    except BaseException:
+        print('Username/Password authentication is not accepted for your organization. Please use an access token instead.')
+        sys.exit(errors.EXIT_CODE_USERNAME_PASSWORD_NOT_ACCEPTED)
+    token_cache.set('session', domo_instance, email, password, domo_token, SESSION_TOKEN_TTL)
+    return domo_token
+
+
+def create_pass_token_header(access_token:str) -> dict:
+    """Returns the headers authenticating content API requests with a session token"""
+    return {
+        'Content-Type': 'application/json',
+        'x-domo-authentication': access_token
+    }
+
+
+def create_dev_token_header(developer_token:str) -> dict:
+    """Returns the headers authenticating content API requests with a developer access token
+
+    Developer tokens are found at https://<domo-instance>.domo.com/admin/security/accesstokens
+    """
+    return {
+        'Content-Type': 'application/json',
+        'x-domo-developer-token': developer_token
+    }
+
+
+async def authenticate(client:AsyncDomoClient, email:str, password:str, domo_instance:str,
+                       token_cache:TokenCache=None):
+    """Authenticates every request of a client with a session token, logging in again when it is rejected
+
+    A cached session token may have expired or been revoked, so a request rejected with one of the
+    reauthenticate_statuses of the client drops it and logs in again. A fresh token that is still forbidden
+    lacks permissions rather than having expired, so from then on only a 401 logs in again, and a rejected
+    login never tries to log in again.
+    """
+    access_token = await get_access_token(email, password, domo_instance, client, token_cache)
+    client.set_headers(create_pass_token_header(access_token))
+
+    async def reauthenticate():
+        client.reauthenticate = None
+        access_token = await get_access_token(email, password, domo_instance, client, token_cache, refresh=True)
+        client.set_headers(create_pass_token_header(access_token))
+        client.reauthenticate_statuses = {401}
+        client.reauthenticate = reauthenticate
+    client.reauthenticate = reauthenticate
+
+
+@metrics.timed('card.metadata')
+async def get_card_data(card_id:str, client:AsyncDomoClient) -> list:
+    """Returns the metadata and properties of a card, or of several cards given as comma separated ids"""
+    params = {
+        'urns': card_id,
+        'parts': ['metadata', 'properties'],
+        'includeFiltered': 'true'
+    }
+    card_response = await client.request('GET', '/api/content/v1/cards', params=params)
+    return await card_response.json(content_type=None)
+
+
+async def get_cards_data(card_ids:list, client:AsyncDomoClient) -> dict:
+    """Returns the metadata and properties of many cards by card id, asking for METADATA_BATCH_SIZE cards in each request"""
+    batches = [card_ids[i:i + METADATA_BATCH_SIZE] for i in range(0, len(card_ids), METADATA_BATCH_SIZE)]
+    responses = await asyncio.gather(*[get_card_data(','.join(batch), client) for batch in batches])
+    return {str(card['id']): card for cards in responses for card in cards}
@@ -1,14 +1,28 @@
 import sys
 import os
+import csv
+import gzip
+import shutil
 import argparse
+import itertools
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from pydomo import Domo
 import shipyard_utils as shipyard
-import pandas as pd
 try:
     import errors as ec
+    import metrics
+    from token_cache import connect_domo
 except BaseException:
     from . import errors as ec
+    from . import metrics
+    from .token_cache import connect_domo
 
+CHUNK_SIZE = 1024 * 1024 # bytes written to disk at a time
+PAGE_ROWS = 100000 # rows fetched by each query of a partitioned download
+ROW_GROUP_SIZE = 64 * 1024 * 1024 # bytes of CSV read into each row group of a columnar file
+NUMERIC_TYPES = ['LONG', 'DOUBLE', 'DECIMAL']
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet', 'feather': '.feather'}
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -17,52 +31,362 @@ def get_args():
     parser.add_argument('--dataset-id', dest= 'dataset_id',required = True)
     parser.add_argument('--destination-file-name',dest = 'dest_file_name',required = True)
     parser.add_argument('--destination-folder-name',dest = 'dest_folder_name', required = False)
+    parser.add_argument('--partitions', dest = 'partitions', type = int, default = 1, required = False)
+    parser.add_argument('--partition-column', dest = 'partition_column', default = None, required = False)
+    parser.add_argument('--partition-output', dest = 'partition_output', choices = {'single', 'separate'}, default = 'single', required = False)
+    parser.add_argument('--download-workers', dest = 'download_workers', type = int, default = 4, required = False)
+    parser.add_argument('--output-format', dest = 'output_format', choices = {'csv', 'csv.gz', 'parquet', 'feather'}, default = 'csv', required = False)
+    parser.add_argument('--metrics', dest = 'metrics', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
+    parser.add_argument('--metrics-textfile', dest = 'metrics_textfile', default = None, required = False)
+    parser.add_argument('--metrics-format', dest = 'metrics_format', choices = set(metrics.METRICS_FORMATS), default = 'prometheus', required = False)
+    parser.add_argument('--token-cache', dest = 'token_cache', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
     args = parser.parse_args()
     return args
 
 
-def get_dataset(ds_id,domo_instance):
+def get_full_path(file_name:str, folder_path:str):
+    if folder_path is None:
+        ## should just be put in the home directory 
+        cwd = os.getcwd()
+        # full_path = combine_folder_and_file_name(cwd,file_name=file_name)
+        full_path = shipyard.files.combine_folder_and_file_name(cwd,file_name)
+    else:
+        # full_path = combine_folder_and_file_name(folder_path,file_name=file_name)
+        full_path = shipyard.files.combine_folder_and_file_name(folder_path,file_name)
+    return full_path
+
+
+@metrics.timed('export.request')
+def get_dataset_export(ds_id, domo_instance):
     """
-    Wrapper function around the Domo `ds_get` function with some logic to gracefully exit
+    Starts the CSV export of a dataset, returning the streamed response without reading its body
     """
+    url = f'/v1/datasets/{ds_id}/data'
     try:
-        df = domo_instance.ds_get(ds_id)
-        return df
+        response = domo_instance.transport.get_csv(url, {'includeHeader': 'true'})
     except Exception as e:
+        print(f"Error in downloading the dataset {ds_id}.")
+        print(e)
+        sys.exit(ec.EXIT_CODE_DATASET_NOT_FOUND)
+    if response.status_code != 200:
         print(f"Error in downloading the dataset {ds_id}. Please ensure that is the correct one and that the given API client and secret have the appropriate permissions to download datasets")
+        print(response.text)
         sys.exit(ec.EXIT_CODE_DATASET_NOT_FOUND)
+    return response
 
 
-def write_file(df:pd.DataFrame, file_name:str, folder_path:str):
-    if folder_path is None:
-        ## should just be put in the home directory 
-        cwd = os.getcwd()
-        # full_path = combine_folder_and_file_name(cwd,file_name=file_name)
-        full_path = shipyard.files.combine_folder_and_file_name(cwd,file_name)
+def open_output(full_path:str, output_format:str):
+    """
+    Opens a CSV output file for binary writing, gzip-compressed if the output format is csv.gz
+    """
+    if output_format == 'csv.gz':
+        return gzip.open(full_path, 'wb')
+    return open(full_path, 'wb')
+
+
+def write_file(response, file_name:str, folder_path:str, chunk_size:int=CHUNK_SIZE, output_format:str='csv'):
+    """
+    Writes the body of a streamed export response to disk in fixed-size chunks, so memory use does not grow with the dataset
+    """
+    full_path = get_full_path(file_name, folder_path)
+    try:
+        with metrics.span('export.write'), open_output(full_path, output_format) as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+                metrics.count('bytes.downloaded', len(chunk))
+        print(f"Successfully wrote {file_name} to {full_path}")
+    except Exception as e:
+        print(f"Error in writing {file_name} to {full_path}.")
+        print(e)
+        sys.exit(ec.EXIT_CODE_FILE_NOT_FOUND)
+
+
+def get_arrow_schema(domo_columns:list):
+    """
+    Maps the Domo schema of a dataset to an Arrow schema
+    """
+    import pyarrow as pa
+    arrow_types = {
+        'STRING': pa.string(),
+        'LONG': pa.int64(),
+        'DOUBLE': pa.float64(),
+        'DECIMAL': pa.float64(),
+        'DATE': pa.date32(),
+        'DATETIME': pa.timestamp('ms'),
+        'BOOLEAN': pa.bool_()
+    }
+    return pa.schema([(column['name'], arrow_types.get(column['type'], pa.string()))
+                      for column in domo_columns])
+
+
+def write_columnar(sources:list, full_path:str, output_format:str, domo_columns:list, include_header:bool=True):
+    """
+    Converts CSV streams into a single Parquet or Feather file, one record batch at a time. Each batch is
+    written as its own row group, so only one batch is held in memory regardless of the size of the dataset.
+
+    Args:
+        sources (list): The file paths or file-like objects of the CSV data, in order
+        full_path (str): The path of the file to write
+        output_format (str): parquet or feather
+        domo_columns (list): The Domo schema of the dataset, used to type the columns
+        include_header (bool, optional): Whether each source starts with a header row. Defaults to True.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        print(f"pyarrow is required to write {output_format} files. Please install it and try again")
+        sys.exit(ec.EXIT_CODE_DOWNLOAD_ERROR)
+    schema = get_arrow_schema(domo_columns)
+    read_options = pa_csv.ReadOptions(block_size=ROW_GROUP_SIZE,
+                                      column_names=None if include_header else schema.names)
+    convert_options = pa_csv.ConvertOptions(column_types=schema, strings_can_be_null=True)
+    if output_format == 'parquet':
+        writer = pq.ParquetWriter(full_path, schema)
+        write_batch = lambda batch: writer.write_table(pa.Table.from_batches([batch], schema))
     else:
-        # full_path = combine_folder_and_file_name(folder_path,file_name=file_name)
-        full_path = shipyard.files.combine_folder_and_file_name(folder_path,file_name)
+        # Feather V2 is the Arrow IPC file format
+        writer = pa.ipc.new_file(full_path, schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+        write_batch = writer.write_batch
+    with writer:
+        for source in sources:
+            for batch in pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options):
+                write_batch(batch)
+
 
+def download_dataset(ds_id, domo_instance, file_name:str, folder_path:str, output_format:str='csv'):
+    """
+    Streams the export of a dataset to disk in the requested output format
+    """
+    if output_format in ['csv', 'csv.gz']:
+        response = get_dataset_export(ds_id, domo_instance)
+        write_file(response, file_name, folder_path, output_format=output_format)
+        return
+    domo_columns = domo_instance.utilities.domo_schema(ds_id)
+    response = get_dataset_export(ds_id, domo_instance)
+    # let urllib3 undo any transfer compression as pyarrow reads the body
+    response.raw.decode_content = True
+    full_path = get_full_path(file_name, folder_path)
     try:
-        df.to_csv(full_path,index = False)
+        with metrics.span('export.convert'):
+            write_columnar([response.raw], full_path, output_format, domo_columns)
         print(f"Successfully wrote {file_name} to {full_path}")
     except Exception as e:
         print(f"Error in writing {file_name} to {full_path}.")
         print(e)
         sys.exit(ec.EXIT_CODE_FILE_NOT_FOUND)
 
+
+def save_output(part_paths:list, full_path:str, output_format:str, domo_columns:list):
+    """
+    Writes headerless CSV part files, in order, to a single output file with one header row
+    """
+    if output_format in ['parquet', 'feather']:
+        write_columnar(part_paths, full_path, output_format, domo_columns, include_header=False)
+        return
+    with open_output(full_path, output_format) as f:
+        header = StringIO()
+        csv.writer(header).writerow([column['name'] for column in domo_columns])
+        f.write(header.getvalue().encode())
+        for part_path in part_paths:
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, f, CHUNK_SIZE)
+
+
+def quote_column(column:str) -> str:
+    return '`' + column.replace('`', '``') + '`'
+
+
+def quote_value(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def query_rows(ds_id, domo_instance, sql:str) -> list:
+    with metrics.span('partition.query'):
+        return domo_instance.datasets.query(ds_id, sql)['rows']
+
+
+def write_rows(writer, rows:list):
+    with metrics.span('partition.write'):
+        writer.writerows(rows)
+    metrics.count('rows.downloaded', len(rows))
+
+
+@metrics.timed('partition.plan')
+def plan_partitions(ds_id, domo_instance, metadata:dict, partitions:int, partition_column:str) -> list:
+    """
+    Splits a dataset into ranges of its partition column that can be queried independently. Each partition is
+    a dict with the SQL condition that selects its rows.
+
+    Numeric columns are split into ranges of equal width between their minimum and maximum. Other columns are
+    split at their quantiles, each read as a single value, so planning never reads the distinct values of the
+    column. Null values of the partition column get a partition of their own.
+    """
+    column_types = {column['name']: column['type'] for column in metadata['schema']['columns']}
+    if partition_column not in column_types:
+        print(f"The partition column {partition_column} is not a column of the dataset {ds_id}")
+        sys.exit(ec.EXIT_CODE_COLUMN_MISMATCH)
+    column = quote_column(partition_column)
+    plans = []
+    if column_types[partition_column] in NUMERIC_TYPES:
+        low, high = query_rows(ds_id, domo_instance, f"SELECT MIN({column}), MAX({column}) FROM table")[0]
+        if low is not None:
+            width = (high - low) / partitions
+            for i in range(partitions):
+                lower = low + i * width
+                if i == partitions - 1:
+                    where = f"{column} >= {lower!r} AND {column} <= {high!r}"
+                else:
+                    where = f"{column} >= {lower!r} AND {column} < {low + (i + 1) * width!r}"
+                plans.append({'where': where, 'keyset': True})
+    else:
+        count = query_rows(ds_id, domo_instance, f"SELECT COUNT({column}) FROM table")[0][0]
+        boundaries = []
+        for i in range(1, partitions):
+            rows = query_rows(ds_id, domo_instance, f"SELECT {column} FROM table WHERE {column} IS NOT NULL "
+                                                    f"ORDER BY {column} LIMIT 1 OFFSET {count * i // partitions}")
+            # a value that fills more than one quantile bounds a single partition
+            if rows and (not boundaries or rows[0][0] != boundaries[-1]):
+                boundaries.append(rows[0][0])
+        if count:
+            lowers = [None] + boundaries
+            uppers = boundaries + [None]
+            for lower, upper in zip(lowers, uppers):
+                conditions = [f"{column} IS NOT NULL"]
+                if lower is not None:
+                    conditions.append(f"{column} >= {quote_value(lower)}")
+                if upper is not None:
+                    conditions.append(f"{column} < {quote_value(upper)}")
+                plans.append({'where': ' AND '.join(conditions), 'keyset': True})
+    # null values cannot be compared, so their partition is paged by offset
+    plans.append({'where': f"{column} IS NULL", 'keyset': False})
+    return plans
+
+
+def download_partition(ds_id, domo_instance, columns:list, plan:dict, part_path:str, partition_column:str):
+    """
+    Queries the rows of a partition a page at a time and appends them to a headerless CSV file. The rows are
+    ordered by the partition column and then by every column, so pages never overlap or skip rows and every
+    run produces them in the same order.
+
+    Pages are read by keyset: each page starts after the last value of the partition column of the page
+    before, so no query skips rows with a deep OFFSET. A page that ends part way through the rows of a value
+    is completed by paging through the rows of that value alone.
+    """
+    key = quote_column(partition_column)
+    key_index = columns.index(partition_column)
+    order = ', '.join(quote_column(column) for column in [partition_column] + columns)
+
+    def read_run(writer, where:str, offset:int=0):
+        # pages through rows that all have the same value of the partition column
+        while True:
+            rows = query_rows(ds_id, domo_instance,
+                              f"SELECT * FROM table WHERE {where} ORDER BY {order} LIMIT {PAGE_ROWS} OFFSET {offset}")
+            write_rows(writer, rows)
+            offset += len(rows)
+            if len(rows) < PAGE_ROWS:
+                return
+
+    with open(part_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if not plan['keyset']:
+            read_run(writer, plan['where'])
+            return
+        where = plan['where']
+        while True:
+            rows = query_rows(ds_id, domo_instance,
+                              f"SELECT * FROM table WHERE {where} ORDER BY {order} LIMIT {PAGE_ROWS}")
+            write_rows(writer, rows)
+            if len(rows) < PAGE_ROWS:
+                return
+            last = rows[-1][key_index]
+            # the rows of the last value that are already written are the first ones of its run
+            written = sum(1 for _ in itertools.takewhile(lambda row: row[key_index] == last, reversed(rows)))
+            read_run(writer, f"{plan['where']} AND {key} = {quote_value(last)}", written)
+            where = f"{plan['where']} AND {key} > {quote_value(last)}"
+
+
+def get_part_root(full_path:str) -> str:
+    """
+    Returns the path of the output file without its extension, so that it can be given to part files
+    """
+    for extension in sorted(OUTPUT_EXTENSIONS.values(), key=len, reverse=True):
+        if full_path.lower().endswith(extension):
+            return full_path[:-len(extension)]
+    return os.path.splitext(full_path)[0]
+
+
+def download_partitioned(ds_id, domo_instance, file_name:str, folder_path:str, partitions:int,
+                         partition_column:str=None, separate_files:bool=False, download_workers:int=4,
+                         output_format:str='csv'):
+    """
+    Downloads the partitions of a dataset concurrently. The partitions are either stitched together in order
+    under a single header row, or written as separate part files that each have a header row. Part files are
+    named after the output file with the extension of the output format.
+    """
+    full_path = get_full_path(file_name, folder_path)
+    root = get_part_root(full_path)
+    extension = OUTPUT_EXTENSIONS[output_format]
+    try:
+        metadata = domo_instance.datasets.get(ds_id)
+    except Exception as e:
+        print(f"Error in downloading the dataset {ds_id}. Please ensure that is the correct one and that the given API client and secret have the appropriate permissions to download datasets")
+        print(e)
+        sys.exit(ec.EXIT_CODE_DATASET_NOT_FOUND)
+    domo_columns = metadata['schema']['columns']
+    columns = [column['name'] for column in domo_columns]
+    # ordering by the first column first keeps the order of a download without a partition column
+    partition_column = partition_column or columns[0]
+    plans = plan_partitions(ds_id, domo_instance, metadata, partitions, partition_column)
+    part_paths = [f'{full_path}.part{i}' for i in range(1, len(plans) + 1)]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(download_workers, 1)) as executor:
+            futures = [executor.submit(download_partition, ds_id, domo_instance, columns, plan, part_path,
+                                       partition_column)
+                       for plan, part_path in zip(plans, part_paths)]
+            for future in futures:
+                future.result()
+        with metrics.span('partition.merge'):
+            if separate_files:
+                for i, part_path in enumerate(part_paths, start=1):
+                    save_output([part_path], f'{root}_part{i:04d}{extension}', output_format, domo_columns)
+            else:
+                save_output(part_paths, full_path, output_format, domo_columns)
+    except Exception as e:
+        print(f"Error in downloading the partitions of dataset {ds_id}.")
+        print(e)
+        sys.exit(ec.EXIT_CODE_DOWNLOAD_ERROR)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    if separate_files:
+        print(f"Successfully wrote {len(part_paths)} partitions of {file_name} to {root}_part*{extension}")
+    else:
+        print(f"Successfully wrote {file_name} to {full_path} from {len(part_paths)} partitions")
+
+
 def main():
     args = get_args()
+    if args.metrics == 'TRUE' or args.metrics_textfile:
+        metrics.enable('download_dataset_as_csv', args.metrics_textfile, args.metrics_format)
     client_id = args.client_id
     secret_key = args.secret_key
     dataset_id = args.dataset_id
     dest_file_name = args.dest_file_name
     dest_folder_path = args.dest_folder_name
+    partitions = args.partitions
+    partition_column = args.partition_column
     try:
-        domo = Domo(
+        domo = connect_domo(
             client_id,
             secret_key,
-            api_host='api.domo.com'
+            api_host='api.domo.com',
+            token_cache=args.token_cache == 'TRUE'
         )
     except Exception as e:
         print(
@@ -70,8 +394,12 @@ def main():
         print(e)
         sys.exit(ec.EXIT_CODE_INVALID_CREDENTIALS)
 
-    df = get_dataset(dataset_id,domo)
-    write_file(df, dest_file_name, dest_folder_path)
+    if partitions > 1 or partition_column is not None:
+        download_partitioned(dataset_id, domo, dest_file_name, dest_folder_path, partitions,
+                             partition_column, args.partition_output == 'separate', args.download_workers,
+                             args.output_format)
+    else:
+        download_dataset(dataset_id, domo, dest_file_name, dest_folder_path, args.output_format)
 
 if __name__ == "__main__":
     main()
@@ -1,22 +1,38 @@
-import json
+import os
 import sys
+import asyncio
 import argparse
-import requests
 import shipyard_utils as shipyard
 
+try:
+    import metrics
+    from domo_client import (AsyncDomoClient, authenticate,
+                             create_dev_token_header, get_card_data,
+                             get_cards_data)
+    from download_ledger import DownloadLedger
+    from token_cache import TokenCache
+except BaseException:
+    from . import metrics
+    from .domo_client import (AsyncDomoClient, authenticate,
+                              create_dev_token_header, get_card_data,
+                              get_cards_data)
+    from .download_ledger import DownloadLedger
+    from .token_cache import TokenCache
+
 
-EXIT_CODE_INVALID_CREDENTIALS = 200
-EXIT_CODE_INVALID_ACCOUNT = 201
 EXIT_CODE_BAD_REQUEST = 202
 EXIT_CODE_INCORRECT_CARD_TYPE = 203
 
+BUFFER_SIZE = 1024 * 1024  # bytes read from the response and written at a time
+
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--email', dest='email', required=True)
     parser.add_argument('--password', dest='password', required=True)
     parser.add_argument('--domo-instance', dest='domo_instance', required=True)
-    parser.add_argument('--card-id', dest='card_id', required=True)
+    parser.add_argument('--card-id', dest='card_id', required=False)
+    parser.add_argument('--card-ids', dest='card_ids', required=False)
     parser.add_argument('--dest-folder-path',
                         dest='dest_folder_path',
                         default='',
@@ -24,6 +40,39 @@ def get_args():
     parser.add_argument('--developer-token',
                         dest='developer_token',
                         required=False)
+    parser.add_argument('--max-concurrent',
+                        dest='max_concurrent',
+                        type=int,
+                        default=4,
+                        required=False)
+    parser.add_argument('--incremental',
+                        dest='incremental',
+                        choices={'TRUE', 'FALSE'},
+                        default='TRUE',
+                        required=False)
+    parser.add_argument('--buffer-size',
+                        dest='buffer_size',
+                        type=int,
+                        default=BUFFER_SIZE,
+                        required=False)
+    parser.add_argument('--metrics',
+                        dest='metrics',
+                        choices={'TRUE', 'FALSE'},
+                        default='FALSE',
+                        required=False)
+    parser.add_argument('--metrics-textfile',
+                        dest='metrics_textfile',
+                        required=False)
+    parser.add_argument('--metrics-format',
+                        dest='metrics_format',
+                        choices=set(metrics.METRICS_FORMATS),
+                        default='prometheus',
+                        required=False)
+    parser.add_argument('--token-cache',
+                        dest='token_cache',
+                        choices={'TRUE', 'FALSE'},
+                        default='FALSE',
+                        required=False)
     args = parser.parse_args()
 
     if not args.developer_token and not (
@@ -36,157 +85,252 @@ def get_args():
         parser.error('Please provide a password with your email.')
     if args.password and not args.email:
         parser.error('Please provide an email with your password.')
+    if not (args.card_id or args.card_ids):
+        parser.error('Please provide a --card-id or a list of --card-ids.')
+    if args.buffer_size < 1:
+        parser.error('The --buffer-size must be a positive number of bytes.')
     return args
 
 
-def get_access_token(email, password, domo_instance):
-    """
-    Generate Access Token for use with internal content APIs.
+def get_document_download_api(card):
+    # the document id is in the card metadata
+    document_id = card['metadata']['revisionId']
+    return f"/api/data/v1/data-files/{document_id}/revisions/{document_id}"
 
-    email (str): email address of the user on domo.com
-    password (str): login password of the user domo.com
-    """
-    auth_api = f"https://{domo_instance}.domo.com/api/content/v2/authentication"
 
-    auth_body = json.dumps({
-        "method": "password",
-        "emailAddress": email,
-        "password": password
-    })
+@metrics.timed('document.download')
+async def fetch_document(card, client, destination_full_path,
+                         buffer_size=BUFFER_SIZE, ledger=None):
+    """
+    Streams the document of a card to destination_full_path, unless the
+    ledger shows the file already holds the current revision of the card.
+    Otherwise the request is made conditional on the ETag and Last-Modified
+    recorded for the file, so the server can answer 304 when nothing changed.
+    The document is written to a temporary file that only replaces the
+    destination once it is complete, so a failed download never leaves a
+    truncated file behind.
 
-    auth_headers = {'Content-Type': 'application/json'}
+    Returns:
+    status -> 'downloaded', 'unchanged' or None if the request failed
+    file_response -> the response, or None if no request was needed
+    """
+    card_id = str(card['id'])
+    revision_id = card['metadata'].get('revisionId')
+    headers = {}
+    # the ledger hashes files, so it runs off the event loop
+    loop = asyncio.get_running_loop()
+    if ledger is not None:
+        if await loop.run_in_executor(None, ledger.is_current, card_id,
+                                      destination_full_path, revision_id):
+            metrics.count('documents.unchanged')
+            return 'unchanged', None
+        headers = await loop.run_in_executor(
+            None, ledger.conditional_headers, card_id, destination_full_path)
+    # the blob is streamed to the file buffer_size bytes at a time
+    temp_path = f"{destination_full_path}.download"
     try:
-        auth_response = requests.post(auth_api, data=auth_body,
-                                      headers=auth_headers)
-    except Exception as e:
-        print(f"Request error: {e}")
-        sys.exit(EXIT_CODE_BAD_REQUEST)
+        file_response = await client.download(
+            'GET', get_document_download_api(card), temp_path,
+            chunk_size=buffer_size, buffer_size=buffer_size,
+            params={'fileName': card['title']}, headers=headers)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if file_response.status not in (200, 304):
+        return None, file_response
+    if file_response.status == 304:
+        if ledger is not None:
+            await loop.run_in_executor(
+                None, ledger.refresh, card_id, destination_full_path,
+                revision_id)
+        metrics.count('documents.unchanged')
+        return 'unchanged', file_response
+    os.replace(temp_path, destination_full_path)
+    if ledger is not None:
+        await loop.run_in_executor(
+            None, ledger.record, card_id, destination_full_path, revision_id,
+            file_response.headers)
+    metrics.count('documents.downloaded')
+    metrics.count('bytes.downloaded', os.path.getsize(destination_full_path))
+    return 'downloaded', file_response
 
-    auth_response_json = auth_response.json()
-    if auth_response_json["success"] is False:  # Failed to login
-        print(
-            f"Authentication failed due to reason: {auth_response_json['reason']}")
-        sys.exit(EXIT_CODE_INVALID_CREDENTIALS)
 
-    # else if the authentication succeeded
-    try:
-        domo_token = auth_response_json['sessionToken']
-        return domo_token
-    except BaseException as e:
-        print(f'Username/Password authentication is not accepted for your organization. Please use an access token instead.')
-        sys.exit(errors.EXIT_CODE_USERNAME_PASSWORD_NOT_ACCEPTED)
+async def export_document_to_file(
+        card,
+        client,
+        folder_path='',
+        buffer_size=BUFFER_SIZE,
+        ledger=None):
+    document_name = card['title']
+    destination_folder_name = shipyard.files.clean_folder_name(
+        folder_path)
+    destination_full_path = shipyard.files.combine_folder_and_file_name(
+        folder_name=destination_folder_name, file_name=document_name)
+    status, file_response = await fetch_document(
+        card, client, destination_full_path, buffer_size, ledger)
+    if status == 'downloaded':
+        print(f" file:{destination_full_path} saved successfully!")
+    elif status == 'unchanged':
+        print(f" file:{destination_full_path} is already up to date")
+    else:
+        print(f"Request failed with status code {file_response.status}")
+        sys.exit(EXIT_CODE_BAD_REQUEST)
 
 
-def create_pass_token_header(access_token):
+async def download_document_for_manifest(card_id, card, file_name, client,
+                                         destination_folder_name,
+                                         buffer_size=BUFFER_SIZE,
+                                         ledger=None):
     """
-    Generate Auth headers for DOMO private API using email/password
-    authentication.
+    Downloads the document of a single card of a bulk download without
+    exiting on errors, so one card cannot stop the others.
 
     Returns:
-    auth_header -> dict with the authentication headers for use in
-    domo api requests.
+    result -> dict with the outcome of the download, for the manifest.
     """
-    auth_headers = {
-        'Content-Type': 'application/json',
-        'x-domo-authentication': access_token
+    result = {
+        'card_id': card_id,
+        'title': card.get('title') if card else None,
+        'revision_id': card['metadata'].get('revisionId') if card else None,
+        'status': None,
+        'file': None,
+        'bytes': None,
+        'error': None
     }
-    return auth_headers
+    if card is None:
+        result['status'] = 'failed'
+        result['error'] = 'card not found'
+        print(f"card {card_id} not found")
+        return result
+    if card['type'] != "document":
+        result['status'] = 'skipped'
+        result['error'] = f"card type {card['type']} not supported by function"
+        print(f"card type {card_id} not supported by function")
+        return result
+    destination_full_path = shipyard.files.combine_folder_and_file_name(
+        folder_name=destination_folder_name, file_name=file_name)
+    try:
+        status, file_response = await fetch_document(
+            card, client, destination_full_path, buffer_size, ledger)
+    except Exception as e:
+        status, file_response = None, None
+        result['error'] = str(e)
+    if status is not None:
+        result['status'] = status
+        result['file'] = destination_full_path
+        result['bytes'] = os.path.getsize(destination_full_path)
+        if status == 'downloaded':
+            print(f" file:{destination_full_path} saved successfully!")
+        else:
+            print(f" file:{destination_full_path} is already up to date")
+    else:
+        result['status'] = 'failed'
+        if file_response is not None:
+            result['error'] = f"Request failed with status code {file_response.status}"
+        print(f"card {card_id}: {result['error']}")
+    return result
 
 
-def create_dev_token_header(developer_token):
+async def download_documents(card_ids, client, folder_path='',
+                             buffer_size=BUFFER_SIZE, ledger=None):
     """
-    Generate Auth headers for DOMO private API using developer
-    access tokens found at the following url:
-    https://<domo-instance>.domo.com/admin/security/accesstokens
+    Downloads the documents of many cards concurrently. The metadata of
+    every card is fetched up front in batches and reused for the downloads,
+    and at most as many downloads as the client allows run at once.
+    Documents sharing a title are prefixed with their card id. With a
+    ledger, documents whose revision is already on disk are skipped.
 
     Returns:
-    auth_header -> dict with the authentication headers for use in
-    domo api requests.
+    manifest -> list with the outcome of each card, in the order given.
     """
-    auth_headers = {
-        'Content-Type': 'application/json',
-        'x-domo-developer-token': developer_token
-    }
-    return auth_headers
+    destination_folder_name = shipyard.files.clean_folder_name(folder_path)
+    shipyard.files.create_folder_if_dne(destination_folder_name)
+    cards = await get_cards_data(card_ids, client)
+    titles = [card['title'] for card in cards.values()]
+    file_names = {
+        card_id: card['title'] if titles.count(card['title']) == 1
+        else f"{card_id}_{card['title']}"
+        for card_id, card in cards.items()}
+    print(f"Downloading {len(card_ids)} documents")
+    return await asyncio.gather(*[
+        download_document_for_manifest(card_id, cards.get(card_id),
+                                       file_names.get(card_id), client,
+                                       destination_folder_name, buffer_size,
+                                       ledger)
+        for card_id in card_ids])
 
 
-def get_card_data(card_id, auth_headers, domo_instance):
-    """
-    Get metadata and property information of a single card
+def write_download_manifest(manifest):
+    # create artifacts folder to save the manifest
+    base_folder_name = shipyard.logs.determine_base_artifact_folder('domo')
+    artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(
+        base_folder_name)
+    shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
+    manifest_path = shipyard.files.combine_folder_and_file_name(
+        artifact_subfolder_paths['responses'],
+        'document_download_manifest.json')
+    shipyard.files.write_json_to_file(manifest, manifest_path)
+    downloaded = sum(result['status'] == 'downloaded' for result in manifest)
+    unchanged = sum(result['status'] == 'unchanged' for result in manifest)
+    print(f"{downloaded} of {len(manifest)} documents downloaded, {unchanged} already up to date. Manifest saved to {manifest_path}")
 
-    card_id (str): The unique ID of the card
-    access_token: client access token. Use the get_access_token() function to retrieve the token.
 
-    Returns:
-    card_response -> dict with the metadata and details of the card.
-    """
-    card_info_api = f"https://{domo_instance}.domo.com/api/content/v1/cards"
-    params = {
-        'urns': card_id,
-        'parts': ['metadata', 'properties'],
-        'includeFiltered': 'true'
-    }
-    card_response = requests.get(
-        url=card_info_api,
-        params=params,
-        headers=auth_headers)
-    return card_response.json()
-
-
-def export_document_to_file(
-        card_id,
-        auth_headers,
-        domo_instance,
-        folder_path=''):
-    # grab the document id from card metadata
-    card = get_card_data(card_id, auth_headers, domo_instance)[0]
-    document_id = card['metadata']['revisionId']
-    document_name = card['title']
-    file_download_api = f"https://{domo_instance}.domo.com/api/data/v1/data-files/{document_id}/revisions/{document_id}"
-    params = {
-        'fileName': document_name
-    }
-    file_response = requests.get(url=file_download_api, params=params,
-                                 headers=auth_headers, stream=True)
-    if file_response.status_code == 200:
-        destination_folder_name = shipyard.files.clean_folder_name(
-            folder_path)
-        destination_full_path = shipyard.files.combine_folder_and_file_name(
-            folder_name=destination_folder_name, file_name=document_name)
-        with open(destination_full_path, 'wb') as fd:
-            # iterate through the blob 1MB at a time
-            for chunk in file_response.iter_content(1024 * 1024):
-                fd.write(chunk)
-        print(f" file:{destination_full_path} saved successfully!")
-    else:
-        print(f"Request failed with status code {file_response.status_code}")
-        sys.exit(EXIT_CODE_BAD_REQUEST)
+def determine_bulk_exit_code(manifest):
+    statuses = {result['status'] for result in manifest}
+    if 'failed' in statuses:
+        return EXIT_CODE_BAD_REQUEST
+    if 'skipped' in statuses:
+        return EXIT_CODE_INCORRECT_CARD_TYPE
+    return 0
 
 
-def main():
-    args = get_args()
+async def download_file_card(args):
     email = args.email
     password = args.password
     card_id = args.card_id
     folder_path = args.dest_folder_path
     domo_instance = args.domo_instance
-    # create auth headers for sending requests
-    if args.developer_token:
-        auth_headers = create_dev_token_header(args.developer_token)
-    else:
-        access_token = get_access_token(email, password, domo_instance)
-        auth_headers = create_pass_token_header(access_token)
-
-    card = get_card_data(card_id, auth_headers, domo_instance)[0]
-    # export if card type is 'document'
-    if card['type'] == "document":
-        export_document_to_file(card_id,
-                                auth_headers, domo_instance,
-                                folder_path=folder_path)
-    else:
-        print(f"card type {card_id} not supported by function")
-        sys.exit(EXIT_CODE_INCORRECT_CARD_TYPE)
+    async with AsyncDomoClient(domo_instance,
+                               max_concurrency=args.max_concurrent) as client:
+        # create auth headers for sending requests
+        if args.developer_token:
+            client.set_headers(create_dev_token_header(args.developer_token))
+        else:
+            await authenticate(
+                client, email, password, domo_instance,
+                TokenCache(enabled=args.token_cache == 'TRUE'))
 
+        ledger = DownloadLedger(domo_instance) if args.incremental == 'TRUE' else None
+        if args.card_ids:
+            card_ids = [card_id] if card_id else []
+            card_ids.extend(args.card_ids.split(','))
+            card_ids = list(dict.fromkeys(
+                card_id.strip() for card_id in card_ids if card_id.strip()))
+            manifest = await download_documents(
+                card_ids, client, folder_path=folder_path,
+                buffer_size=args.buffer_size, ledger=ledger)
+            write_download_manifest(manifest)
+            sys.exit(determine_bulk_exit_code(manifest))
+
+        card = (await get_card_data(card_id, client))[0]
+        # export if card type is 'document'
+        if card['type'] == "document":
+            await export_document_to_file(card, client,
+                                          folder_path=folder_path,
+                                          buffer_size=args.buffer_size,
+                                          ledger=ledger)
+        else:
+            print(f"card type {card_id} not supported by function")
+            sys.exit(EXIT_CODE_INCORRECT_CARD_TYPE)
+
+
+def main():
+    args = get_args()
+    if args.metrics == 'TRUE' or args.metrics_textfile:
+        metrics.enable('download_file_card', args.metrics_textfile,
+                       args.metrics_format)
+    asyncio.run(download_file_card(args))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,100 @@
+import os
+import hashlib
+try:
+    from cache import JsonCache
+except BaseException:
+    from .cache import JsonCache
+
+LEDGER_TTL = 90 * 24 * 3600 # entries of cards that are no longer downloaded are forgotten after this long
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path:str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_BUFFER_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class DownloadLedger:
+    """Records what was last downloaded for each card so unchanged files are not downloaded again
+
+    Every entry holds the revision id of the card, the ETag and Last-Modified headers of the response and
+    the size, modification time and SHA-256 of the file that was written. An entry only counts while the file
+    on disk still has that size and hash, so a file that was deleted or modified since is always downloaded
+    again. A file that still has the recorded size and modification time is trusted without hashing it again.
+    """
+
+    def __init__(self, domo_instance:str, cache:JsonCache=None):
+        self.domo_instance = domo_instance
+        self.cache = cache if cache is not None else JsonCache('download_ledger', LEDGER_TTL, max_entries=4096)
+
+    def key(self, card_id, file_path:str) -> str:
+        return f'{self.domo_instance}\n{card_id}\n{os.path.abspath(file_path)}'
+
+    def get(self, card_id, file_path:str):
+        """Returns the entry of a card if the file it describes is still intact on disk, otherwise None"""
+        entry = self.cache.get(self.key(card_id, file_path))
+        if entry is None or not os.path.exists(file_path):
+            return None
+        stat = os.stat(file_path)
+        if stat.st_size != entry['size']:
+            return None
+        if entry.get('mtime_ns') == stat.st_mtime_ns:
+            return entry
+        if file_sha256(file_path) != entry['sha256']:
+            return None
+        # the file was touched without being changed, so the next check can trust it again
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self.cache.set(self.key(card_id, file_path), entry)
+        return entry
+
+    def is_current(self, card_id, file_path:str, revision_id) -> bool:
+        """Checks whether the file of a card was downloaded from the given revision and is still intact"""
+        if revision_id is None:
+            return False
+        entry = self.get(card_id, file_path)
+        return entry is not None and entry['revision_id'] == revision_id
+
+    def conditional_headers(self, card_id, file_path:str) -> dict:
+        """Returns the If-None-Match and If-Modified-Since headers that make the server answer 304 when nothing changed"""
+        entry = self.get(card_id, file_path)
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_unchanged_content(self, card_id, file_path:str, sha256:str) -> bool:
+        """Checks whether the file of a card already holds content with the given hash"""
+        entry = self.get(card_id, file_path)
+        return entry is not None and entry['sha256'] == sha256
+
+    def record(self, card_id, file_path:str, revision_id=None, response_headers=None, sha256:str=None):
+        """Records the file written for a card, hashing it unless the hash is already known"""
+        response_headers = response_headers or {}
+        sha256 = sha256 or file_sha256(file_path)
+        stat = os.stat(file_path)
+        self.cache.set(self.key(card_id, file_path), {
+            'revision_id': revision_id,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256
+        })
+
+    def refresh(self, card_id, file_path:str, revision_id=None):
+        """Renews the entry of a card whose server answered 304, keeping the validators recorded with the file
+
+        A 304 response carries no content, so its headers are not recorded in place of those of the download
+        that wrote the file.
+        """
+        entry = self.get(card_id, file_path)
+        if entry is None:
+            return
+        if revision_id is not None:
+            entry['revision_id'] = revision_id
+        self.cache.set(self.key(card_id, file_path), entry)
@@ -22,4 +22,8 @@ EXIT_CODE_DUPLICATE_DATASET = 216
 EXIT_CODE_NON_API_DATASET = 217
 
 EXIT_CODE_INVALID_DATA_TYPE = 218
-EXIT_CODE_COLUMN_MISMATCH = 219
\ No newline at end of file
+EXIT_CODE_COLUMN_MISMATCH = 219
+
+EXIT_CODE_UPLOAD_ERROR = 220
+EXIT_CODE_DOWNLOAD_ERROR = 221
+EXIT_CODE_BATCH_FAILURE = 222
@@ -1,14 +1,30 @@
-import json
+import os
+import re
 import sys
+import asyncio
 import argparse
-import requests
 import urllib.parse
 import shipyard_utils as shipyard
 
 try:
     import errors
+    import metrics
+    from domo_client import (AsyncDomoClient, authenticate,
+                             create_dev_token_header, get_card_data,
+                             get_cards_data)
+    from download_ledger import DownloadLedger, file_sha256
+    from token_cache import TokenCache
 except BaseException:
     from . import errors
+    from . import metrics
+    from .domo_client import (AsyncDomoClient, authenticate,
+                              create_dev_token_header, get_card_data,
+                              get_cards_data)
+    from .download_ledger import DownloadLedger, file_sha256
+    from .token_cache import TokenCache
+
+FILE_EXTENSIONS = {'csv': 'csv', 'excel': 'xlsx', 'ppt': 'ppt'}
+DEFAULT_FILE_NAME_TEMPLATE = '{card_id}_{title}.{extension}'
 
 
 def get_args():
@@ -16,11 +32,13 @@ def get_args():
     parser.add_argument('--email', dest='email', required=False)
     parser.add_argument('--password', dest='password', required=False)
     parser.add_argument('--domo-instance', dest='domo_instance', required=True)
-    parser.add_argument('--card-id', dest='card_id', required=True)
+    parser.add_argument('--card-id', dest='card_id', required=False)
+    parser.add_argument('--card-ids', dest='card_ids', required=False)
+    parser.add_argument('--page-id', dest='page_id', required=False)
     parser.add_argument(
         '--destination-file-name',
         dest='destination_file_name',
-        required=True)
+        required=False)
     parser.add_argument('--destination-folder-name',
                         dest='destination_folder_name',
                         default='',
@@ -32,6 +50,34 @@ def get_args():
     parser.add_argument('--developer-token',
                         dest='developer_token',
                         required=False)
+    parser.add_argument('--incremental',
+                        dest='incremental',
+                        choices={'TRUE', 'FALSE'},
+                        default='TRUE',
+                        required=False)
+    parser.add_argument('--max-concurrent',
+                        dest='max_concurrent',
+                        type=int,
+                        default=4,
+                        required=False)
+    parser.add_argument('--metrics',
+                        dest='metrics',
+                        choices={'TRUE', 'FALSE'},
+                        default='FALSE',
+                        required=False)
+    parser.add_argument('--metrics-textfile',
+                        dest='metrics_textfile',
+                        required=False)
+    parser.add_argument('--metrics-format',
+                        dest='metrics_format',
+                        choices=set(metrics.METRICS_FORMATS),
+                        default='prometheus',
+                        required=False)
+    parser.add_argument('--token-cache',
+                        dest='token_cache',
+                        choices={'TRUE', 'FALSE'},
+                        default='FALSE',
+                        required=False)
     args = parser.parse_args()
 
     if not args.developer_token and not (
@@ -44,122 +90,31 @@ def get_args():
         parser.error('Please provide a password with your email.')
     if args.password and not args.email:
         parser.error('Please provide an email with your password.')
+    if not (args.card_id or args.card_ids or args.page_id):
+        parser.error(
+            'Please provide a --card-id, a list of --card-ids or a --page-id.')
+    if not (args.card_ids or args.page_id) and not args.destination_file_name:
+        parser.error('Please provide a --destination-file-name.')
 
     return args
 
 
-def get_access_token(email, password, domo_instance):
-    """
-    Generate Access Token for use with internal content APIs.
-
-    email (str): email address of the user on domo.com
-    password (str): login password of the user domo.com
-    """
-    auth_api = f"https://{domo_instance}.domo.com/api/content/v2/authentication"
-
-    auth_body = json.dumps({
-        "method": "password",
-        "emailAddress": email,
-        "password": password
-    })
-
-    auth_headers = {'Content-Type': 'application/json'}
-    try:
-        auth_response = requests.post(auth_api, data=auth_body,
-                                      headers=auth_headers)
-    except Exception as e:
-        print(f"Request error: {e}")
-        sys.exit(errors.EXIT_CODE_BAD_REQUEST)
-
-    auth_response_json = auth_response.json()
-    try:
-        if auth_response_json["success"] is False:  # Failed to login
-            print(
-                f"Authentication failed due to reason: {auth_response_json['reason']}")
-            sys.exit(errors.EXIT_CODE_INVALID_CREDENTIALS)
-    except Exception as e:
-        if auth_response_json["status"] == 403:  # Failed to login
-            print(
-                f"Authentication failed due to domo instance {domo_instance} being invalid.")
-            sys.exit(errors.EXIT_CODE_INVALID_ACCOUNT)
-        else:
-            print(f"Request error: {e}")
-            sys.exit(errors.EXIT_CODE_BAD_REQUEST)
-
-    # else if the authentication succeeded
-    try:
-        domo_token = auth_response_json['sessionToken']
-        return domo_token
-    except BaseException as e:
-        print(f'Username/Password authentication is not accepted for your organization. Please use an access token instead.')
-        sys.exit(errors.EXIT_CODE_USERNAME_PASSWORD_NOT_ACCEPTED)
-
-
-def create_pass_token_header(access_token):
+@metrics.timed('card.export')
+async def request_card_export(card_id, file_name, file_type, client,
+                              destination_full_path):
     """
-    Generate Auth headers for DOMO private API using email/password
-    authentication.
+    Requests the export of a card to one of the given file types: csv, ppt,
+    excel and streams it to destination_full_path.
 
     Returns:
-    auth_header -> dict with the authentication headers for use in
-    domo api requests.
+    export_response -> the response of the export request
     """
-    auth_headers = {
-        'Content-Type': 'application/json',
-        'x-domo-authentication': access_token
-    }
-    return auth_headers
-
-
-def create_dev_token_header(developer_token):
-    """
-    Generate Auth headers for DOMO private API using developer
-    access tokens found at the following url:
-    https://<domo-instance>.domo.com/admin/security/accesstokens
-
-    Returns:
-    auth_header -> dict with the authentication headers for use in
-    domo api requests.
-    """
-    auth_headers = {
-        'Content-Type': 'application/json',
-        'x-domo-developer-token': developer_token
-    }
-    return auth_headers
-
-
-def get_card_data(card_id, auth_headers, domo_instance):
-    """
-    Get metadata and property information of a single card
-
-    card_id (str): The unique ID of the card
-    access_token: client access token. Use the get_access_token() function to retrieve the token.
-
-    Returns:
-    card_response -> dict with the metadata and details of the card.
-    """
-    card_info_api = f"https://{domo_instance}.domo.com/api/content/v1/cards"
-    params = {
-        'urns': card_id,
-        'parts': ['metadata', 'properties'],
-        'includeFiltered': 'true'
-    }
-    card_response = requests.get(
-        url=card_info_api,
-        params=params,
-        headers=auth_headers)
-    return card_response.json()
-
-
-def export_graph_to_file(card_id, file_name, file_type,
-                         auth_headers, domo_instance, folder_path=""):
-    """
-    Exports a file to one of the given file types: csv, ppt, excel
-    """
-    export_api = f"https://{domo_instance}.domo.com/api/content/v1/cards/{card_id}/export"
+    export_api = f"/api/content/v1/cards/{card_id}/export"
     # add additional export header data
-    auth_headers['Content-Type'] = 'application/x-www-form-urlencoded'
-    auth_headers['accept'] = 'application/json, text/plain, */*'
+    export_headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'accept': 'application/json, text/plain, */*'
+    }
 
     # make a dictionary to map user file_type with requested mimetype
     filetype_map = {
@@ -192,26 +147,218 @@ def export_graph_to_file(card_id, file_name, file_type,
     encoded_body = encoded_body.replace("%27", "%22")  # changing " to '
     payload = f"request={encoded_body}"
 
-    export_response = requests.post(url=export_api, data=payload,
-                                    headers=auth_headers, stream=True)
-    if export_response.status_code == 200:
-        destination_folder_name = shipyard.files.clean_folder_name(
-            folder_path)
-        shipyard.files.create_folder_if_dne(destination_folder_name)
-        destination_full_path = shipyard.files.combine_folder_and_file_name(
-            folder_name=destination_folder_name, file_name=file_name)
-        with open(destination_full_path, 'wb') as fd:
-            # iterate through the blob 1MB at a time
-            for chunk in export_response.iter_content(1024 * 1024):
-                fd.write(chunk)
+    # the blob is streamed to the file 1MB at a time
+    return await client.download(
+        'POST', export_api, destination_full_path,
+        data=payload, headers=export_headers)
+
+
+def count_export(destination_full_path):
+    metrics.count('cards.exported')
+    metrics.count('bytes.exported', os.path.getsize(destination_full_path))
+
+
+async def fetch_card_export(card_id, file_name, file_type, client,
+                            destination_full_path, ledger=None):
+    """
+    Exports a card to destination_full_path. With a ledger, the export is
+    written to a temporary file first and the existing file is kept as it
+    is when the export has the same content hash, so its modification time
+    only changes when the data does. Exports are generated on request, so
+    they cannot be made conditional like document downloads, and the
+    export is always transferred in full.
+
+    Returns:
+    status -> 'exported', 'unchanged' or None if the request failed
+    export_response -> the response of the export request
+    """
+    if ledger is None:
+        export_response = await request_card_export(
+            card_id, file_name, file_type, client, destination_full_path)
+        if export_response.status != 200:
+            return None, export_response
+        count_export(destination_full_path)
+        return 'exported', export_response
+    temp_path = f"{destination_full_path}.download"
+    try:
+        export_response = await request_card_export(
+            card_id, file_name, file_type, client, temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if export_response.status != 200:
+        return None, export_response
+    # the ledger hashes files, so it runs off the event loop
+    loop = asyncio.get_running_loop()
+    sha256 = await loop.run_in_executor(None, file_sha256, temp_path)
+    if await loop.run_in_executor(None, ledger.is_unchanged_content, card_id,
+                                  destination_full_path, sha256):
+        os.remove(temp_path)
+        metrics.count('cards.unchanged')
+        return 'unchanged', export_response
+    os.replace(temp_path, destination_full_path)
+    count_export(destination_full_path)
+    await loop.run_in_executor(
+        None, ledger.record, card_id, destination_full_path, None,
+        export_response.headers, sha256)
+    return 'exported', export_response
+
+
+async def export_graph_to_file(card_id, file_name, file_type,
+                               client, folder_path="", ledger=None):
+    """
+    Exports a file to one of the given file types: csv, ppt, excel
+    """
+    destination_folder_name = shipyard.files.clean_folder_name(
+        folder_path)
+    shipyard.files.create_folder_if_dne(destination_folder_name)
+    destination_full_path = shipyard.files.combine_folder_and_file_name(
+        folder_name=destination_folder_name, file_name=file_name)
+    status, export_response = await fetch_card_export(
+        card_id, file_name, file_type, client, destination_full_path, ledger)
+    if status == 'exported':
         print(f"{file_type} file:{destination_full_path} saved successfully!")
+    elif status == 'unchanged':
+        print(f"{file_type} file:{destination_full_path} is already up to date")
     else:
-        print(f"Request failed with status code {export_response.status_code}")
+        print(f"Request failed with status code {export_response.status}")
         sys.exit(errors.EXIT_CODE_BAD_REQUEST)
 
 
-def main():
-    args = get_args()
+async def get_page_card_ids(page_id, client):
+    """
+    Get the ids of the cards on a page (dashboard)
+
+    Returns:
+    card_ids -> list with the id of every card on the page.
+    """
+    page_cards_api = f"/api/content/v3/stacks/{page_id}/cards"
+    page_response = await client.request('GET', page_cards_api)
+    if page_response.status != 200:
+        print(
+            f"Unable to get the cards of page {page_id}. Request failed with status code {page_response.status}")
+        sys.exit(errors.EXIT_CODE_BAD_REQUEST)
+    page = await page_response.json(content_type=None)
+    return [str(card['id']) for card in page['cards']]
+
+
+def get_bulk_file_name(file_name_template, card_id, card, file_type):
+    """
+    Names the file of a card exported in bulk. The template can use the
+    {card_id}, {title} and {extension} placeholders, and is prefixed with
+    the card id when it does not use {card_id}.
+    """
+    title = re.sub(r'[^\w\-. ]', '_', card.get('title') or '').strip()
+    if '{card_id}' not in file_name_template:
+        # every card would otherwise be written to the same file
+        file_name_template = '{card_id}_' + file_name_template
+    return file_name_template.format(
+        card_id=card_id,
+        title=title or card_id,
+        extension=FILE_EXTENSIONS[file_type])
+
+
+async def export_card_for_manifest(card_id, card, file_name_template,
+                                   file_type, client, destination_folder_name,
+                                   ledger=None):
+    """
+    Exports a single card of a bulk export without exiting on errors, so one
+    card cannot stop the others.
+
+    Returns:
+    result -> dict with the outcome of the export, for the manifest.
+    """
+    result = {
+        'card_id': card_id,
+        'title': card.get('title') if card else None,
+        'type': card.get('type') if card else None,
+        'status': None,
+        'file': None,
+        'bytes': None,
+        'error': None
+    }
+    if card is None:
+        result['status'] = 'failed'
+        result['error'] = 'card not found'
+        print(f"card {card_id} not found")
+        return result
+    if card['type'] != "kpi":
+        result['status'] = 'skipped'
+        result['error'] = f"card type {card['type']} not supported by system"
+        print(f"card type {card_id} not supported by system")
+        return result
+    file_name = get_bulk_file_name(file_name_template, card_id, card, file_type)
+    destination_full_path = shipyard.files.combine_folder_and_file_name(
+        folder_name=destination_folder_name, file_name=file_name)
+    try:
+        status, export_response = await fetch_card_export(
+            card_id, file_name, file_type, client, destination_full_path,
+            ledger)
+    except Exception as e:
+        status, export_response = None, None
+        result['error'] = str(e)
+    if status is not None:
+        result['status'] = status
+        result['file'] = destination_full_path
+        result['bytes'] = os.path.getsize(destination_full_path)
+        if status == 'exported':
+            print(f"{file_type} file:{destination_full_path} saved successfully!")
+        else:
+            print(f"{file_type} file:{destination_full_path} is already up to date")
+    else:
+        result['status'] = 'failed'
+        if export_response is not None:
+            result['error'] = f"Request failed with status code {export_response.status}"
+        print(f"card {card_id}: {result['error']}")
+    return result
+
+
+async def export_cards(card_ids, file_name_template, file_type, client,
+                       folder_path="", ledger=None):
+    """
+    Exports many cards concurrently. The metadata of every card is fetched
+    up front in batches, and at most as many exports as the client allows
+    run at once.
+
+    Returns:
+    manifest -> list with the outcome of each card, in the order given.
+    """
+    destination_folder_name = shipyard.files.clean_folder_name(folder_path)
+    shipyard.files.create_folder_if_dne(destination_folder_name)
+    cards = await get_cards_data(card_ids, client)
+    print(f"Exporting {len(card_ids)} cards")
+    return await asyncio.gather(*[
+        export_card_for_manifest(card_id, cards.get(card_id),
+                                 file_name_template, file_type, client,
+                                 destination_folder_name, ledger)
+        for card_id in card_ids])
+
+
+def write_export_manifest(manifest):
+    # create artifacts folder to save the manifest
+    base_folder_name = shipyard.logs.determine_base_artifact_folder('domo')
+    artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(
+        base_folder_name)
+    shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
+    manifest_path = shipyard.files.combine_folder_and_file_name(
+        artifact_subfolder_paths['responses'], 'card_export_manifest.json')
+    shipyard.files.write_json_to_file(manifest, manifest_path)
+    exported = sum(result['status'] == 'exported' for result in manifest)
+    unchanged = sum(result['status'] == 'unchanged' for result in manifest)
+    print(f"{exported} of {len(manifest)} cards exported, {unchanged} already up to date. Manifest saved to {manifest_path}")
+
+
+def determine_bulk_exit_code(manifest):
+    statuses = {result['status'] for result in manifest}
+    if 'failed' in statuses:
+        return errors.EXIT_CODE_BAD_REQUEST
+    if 'skipped' in statuses:
+        return errors.EXIT_CODE_INCORRECT_CARD_TYPE
+    return errors.EXIT_CODE_FINAL_STATUS_SUCCESS
+
+
+async def export_card(args):
     email = args.email
     password = args.password
     card_id = args.card_id
@@ -219,23 +366,49 @@ def main():
     folder_path = args.destination_folder_name
     file_type = args.file_type
     domo_instance = args.domo_instance
-    # create auth headers for sending requests
-    if args.developer_token:
-        auth_headers = create_dev_token_header(args.developer_token)
-    else:
-        access_token = get_access_token(email, password, domo_instance)
-        auth_headers = create_pass_token_header(access_token)
-
-    # check if the card is of the 'dataset/graph' type
-    card = get_card_data(card_id, auth_headers, domo_instance)[0]
-    # export if card type is 'graph'
-    if card['type'] == "kpi":
-        export_graph_to_file(card_id, file_name, file_type,
-                             auth_headers, domo_instance,
-                             folder_path=folder_path)
-    else:
-        print(f"card type {card_id} not supported by system")
-        sys.exit(errors.EXIT_CODE_INCORRECT_CARD_TYPE)
+    async with AsyncDomoClient(domo_instance,
+                               max_concurrency=args.max_concurrent) as client:
+        # create auth headers for sending requests
+        if args.developer_token:
+            client.set_headers(create_dev_token_header(args.developer_token))
+        else:
+            await authenticate(
+                client, email, password, domo_instance,
+                TokenCache(enabled=args.token_cache == 'TRUE'))
+
+        ledger = DownloadLedger(domo_instance) if args.incremental == 'TRUE' else None
+        if args.card_ids or args.page_id:
+            card_ids = [card_id] if card_id else []
+            if args.card_ids:
+                card_ids.extend(args.card_ids.split(','))
+            if args.page_id:
+                card_ids.extend(await get_page_card_ids(args.page_id, client))
+            card_ids = list(dict.fromkeys(
+                card_id.strip() for card_id in card_ids if card_id.strip()))
+            manifest = await export_cards(
+                card_ids, file_name or DEFAULT_FILE_NAME_TEMPLATE, file_type,
+                client, folder_path=folder_path, ledger=ledger)
+            write_export_manifest(manifest)
+            sys.exit(determine_bulk_exit_code(manifest))
+
+        # check if the card is of the 'dataset/graph' type
+        card = (await get_card_data(card_id, client))[0]
+        # export if card type is 'graph'
+        if card['type'] == "kpi":
+            await export_graph_to_file(card_id, file_name, file_type,
+                                       client, folder_path=folder_path,
+                                       ledger=ledger)
+        else:
+            print(f"card type {card_id} not supported by system")
+            sys.exit(errors.EXIT_CODE_INCORRECT_CARD_TYPE)
+
+
+def main():
+    args = get_args()
+    if args.metrics == 'TRUE' or args.metrics_textfile:
+        metrics.enable('export_card_to_file', args.metrics_textfile,
+                       args.metrics_format)
+    asyncio.run(export_card(args))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+import os
+import time
+import atexit
+import inspect
+import threading
+from contextlib import nullcontext
+from functools import wraps
+import shipyard_utils as shipyard
+
+METRICS_FORMATS = ['prometheus', 'openmetrics']
+METRIC_PREFIX = 'domo_blueprint'
+
+NULL_SPAN = nullcontext()
+
+
+class Span:
+    """Times a block of code and records it under the name of a stage"""
+
+    def __init__(self, registry, name:str):
+        self.registry = registry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+
+
+class Registry:
+    """Collects the spans and counters of a blueprint run
+
+    Spans add up the seconds spent in each stage along with how often the stage ran and its shortest and
+    longest run. Stages run by several threads or tasks at once are added up over all of them, so a stage can
+    take longer in total than the run itself. Counters add up quantities such as parts or bytes.
+
+    While the registry is disabled, which is the default, span returns a shared no-op context manager and
+    every other call returns at once, so instrumented code costs about one attribute check per call.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = {}
+        self.counters = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def span(self, name:str):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def observe(self, name:str, seconds:float):
+        """Records a stage timed elsewhere, for example in another process"""
+        if not self.enabled:
+            return
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = {'count': 1, 'seconds': seconds, 'min_seconds': seconds, 'max_seconds': seconds}
+            else:
+                span['count'] += 1
+                span['seconds'] += seconds
+                span['min_seconds'] = min(span['min_seconds'], seconds)
+                span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def count(self, name:str, value:float=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self, blueprint:str) -> dict:
+        with self.lock:
+            return {
+                'blueprint': blueprint,
+                'started': self.started,
+                'seconds': time.time() - self.started,
+                'spans': {name: dict(span) for name, span in sorted(self.spans.items())},
+                'counters': dict(sorted(self.counters.items()))
+            }
+
+
+REGISTRY = Registry()
+
+
+def enable(blueprint:str, textfile_path:str=None, textfile_format:str='prometheus'):
+    """Starts collecting metrics and writes them when the process exits, however it exits
+
+    The JSON report is written to the responses folder of the artifacts as <blueprint>_metrics.json. With a
+    textfile path, the metrics are also written there in the Prometheus text format, for the node exporter
+    textfile collector, or in the OpenMetrics format.
+    """
+    REGISTRY.enabled = True
+    REGISTRY.started = time.time()
+    atexit.register(write_reports, blueprint, textfile_path, textfile_format)
+
+
+def span(name:str):
+    """Returns a context manager timing the block it wraps as the given stage"""
+    return REGISTRY.span(name)
+
+
+def observe(name:str, seconds:float):
+    REGISTRY.observe(name, seconds)
+
+
+def count(name:str, value:float=1):
+    REGISTRY.count(name, value)
+
+
+def timed(name:str):
+    """Decorates a function or coroutine function so every call is timed as the given stage"""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def timed_coroutine(*args, **kwargs):
+                if not REGISTRY.enabled:
+                    return await function(*args, **kwargs)
+                with Span(REGISTRY, name):
+                    return await function(*args, **kwargs)
+            return timed_coroutine
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return function(*args, **kwargs)
+            with Span(REGISTRY, name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
+
+
+def iterate(name:str, iterable):
+    """Yields the items of an iterable, timing how long each one takes to produce as the given stage"""
+    if not REGISTRY.enabled:
+        return iterable
+    return _timed_iterator(name, iterable)
+
+
+def _timed_iterator(name:str, iterable):
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            REGISTRY.observe(name, time.perf_counter() - start)
+        yield item
+
+
+def write_reports(blueprint:str, textfile_path:str=None, textfile_format:str='prometheus'):
+    report = REGISTRY.report(blueprint)
+    try:
+        base_folder_name = shipyard.logs.determine_base_artifact_folder('domo')
+        artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(base_folder_name)
+        shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
+        report_path = shipyard.files.combine_folder_and_file_name(
+            artifact_subfolder_paths['responses'], f'{blueprint}_metrics.json')
+        shipyard.files.write_json_to_file(report, report_path)
+        print(f"Timing report saved to {report_path}")
+        if textfile_path:
+            write_textfile(report, textfile_path, textfile_format)
+            print(f"Metrics saved to {textfile_path}")
+    except Exception as e:
+        # metrics must never change the outcome of a run
+        print(f"Unable to save the metrics: {e}")
+
+
+def escape_label(value:str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_textfile(report:dict, textfile_format:str='prometheus') -> str:
+    """Formats a report in the Prometheus text format or in the OpenMetrics format"""
+    blueprint = escape_label(report['blueprint'])
+    families = [
+        ('span_seconds', 'counter', 'Seconds spent in each stage, added up over threads',
+         [({'stage': name}, span['seconds']) for name, span in report['spans'].items()]),
+        ('span_runs', 'counter', 'Number of times each stage ran',
+         [({'stage': name}, span['count']) for name, span in report['spans'].items()]),
+        ('span_max_seconds', 'gauge', 'Longest run of each stage',
+         [({'stage': name}, span['max_seconds']) for name, span in report['spans'].items()]),
+        ('events', 'counter', 'Counted quantities such as parts, bytes and retries',
+         [({'name': name}, value) for name, value in report['counters'].items()]),
+        ('run_seconds', 'gauge', 'Wall time of the run', [({}, report['seconds'])]),
+        ('last_run_timestamp_seconds', 'gauge', 'When the run started', [({}, report['started'])])
+    ]
+    lines = []
+    for family, metric_type, description, samples in families:
+        name = f'{METRIC_PREFIX}_{family}'
+        suffix = '_total' if metric_type == 'counter' else ''
+        # OpenMetrics names a counter family without the _total suffix of its samples
+        family_name = name if textfile_format == 'openmetrics' else name + suffix
+        lines.append(f'# HELP {family_name} {description}')
+        lines.append(f'# TYPE {family_name} {metric_type}')
+        for labels, value in samples:
+            label_text = ','.join([f'blueprint="{blueprint}"'] +
+                                  [f'{key}="{escape_label(label)}"' for key, label in labels.items()])
+            lines.append(f'{name}{suffix}{{{label_text}}} {value!r}')
+    if textfile_format == 'openmetrics':
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(report:dict, textfile_path:str, textfile_format:str='prometheus'):
+    """Writes the metrics atomically, so a collector never reads a partial file"""
+    temp_path = f'{textfile_path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(format_textfile(report, textfile_format))
+    os.replace(temp_path, textfile_path)
@@ -0,0 +1,226 @@
+import time
+import heapq
+import random
+import itertools
+from functools import lru_cache
+from datetime import datetime, timezone
+from statistics import median
+try:
+    import metrics
+except BaseException:
+    from . import metrics
+
+MIN_DELAY = 2 # seconds before the first check when nothing is known about the dataset
+MAX_DELAY = 120 # longest wait between two checks
+BACKOFF = 2.0
+JITTER = 0.25
+HISTORY_LIMIT = 20 # past executions used to estimate how long a refresh takes
+HISTORY_PAGE_SIZE = 100 # executions listed per request when reading the history
+HISTORY_MAX_PAGES = 3 # the most pages read from the newest end of the history
+
+
+def parse_timestamp(value:str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def count_executions(streams, stream_id) -> int:
+    """Returns how many executions a stream has had. Their ids count up from 1, so this is the id of the last one"""
+    last_execution = streams.get(stream_id).get('lastExecution') or {}
+    return int(last_execution.get('id') or 0)
+
+
+def iter_recent_executions(streams, stream_id, page_size:int=HISTORY_PAGE_SIZE, max_pages:int=HISTORY_MAX_PAGES):
+    """Yields the pages of the executions of a stream, newest page first
+
+    The API lists executions oldest first, so the listing starts at the offset of the last page and steps back
+    from there. At most max_pages pages are read, however long the stream has been running.
+    """
+    offset = count_executions(streams, stream_id)
+    for _ in range(max_pages):
+        if offset <= 0:
+            return
+        offset = max(offset - page_size, 0)
+        yield streams.list_executions(stream_id, page_size, offset)
+
+
+@metrics.timed('poll.history')
+@lru_cache(maxsize=None)
+def get_historical_durations(streams, stream_id, limit:int=HISTORY_LIMIT) -> tuple:
+    """Returns the durations in seconds of the most recent successful executions of a stream
+
+    Pages are read from the newest end of the history until limit successful executions are found. The result
+    is kept for the rest of the run, so polling the stream again does not read the history again. Any error is
+    treated as having no history, since the history only tunes the polling.
+    """
+    latest = []
+    try:
+        for page in iter_recent_executions(streams, stream_id):
+            for execution in page:
+                if execution.get('currentState') != 'SUCCESS' or not execution.get('startedAt') or not execution.get('endedAt'):
+                    continue
+                try:
+                    started_at = parse_timestamp(execution['startedAt'])
+                    duration = (parse_timestamp(execution['endedAt']) - started_at).total_seconds()
+                except ValueError:
+                    continue
+                if duration < 0:
+                    continue
+                if len(latest) < limit:
+                    heapq.heappush(latest, (started_at, duration))
+                else:
+                    heapq.heappushpop(latest, (started_at, duration))
+            if len(latest) >= limit:
+                # the pages before this one only hold older executions
+                break
+    except Exception as e:
+        print(f"Unable to read the past executions of stream {stream_id}: {e}")
+        return ()
+    return tuple(duration for _, duration in latest)
+
+
+class AdaptivePoller:
+    """Decides when to check on a running execution
+
+    Checks start fast and back off exponentially, with jitter so that many pollers do not check in lockstep.
+    When the usual duration of the refresh is known, the first check waits until most of it has passed and
+    the backoff starts from a tenth of it, so short refreshes are noticed quickly and long ones are not checked
+    needlessly. The time the execution has already been running counts towards the first wait. An optional
+    timeout sets a deadline after which no more checks are made.
+    """
+
+    def __init__(self, expected_duration:float=None, timeout:float=None, elapsed:float=0, min_delay:float=MIN_DELAY,
+                 max_delay:float=MAX_DELAY, backoff:float=BACKOFF, jitter:float=JITTER):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.deadline = time.monotonic() + timeout if timeout else None
+        if expected_duration:
+            self.first_delay = min(max(expected_duration * 0.8 - elapsed, min_delay), max_delay)
+            self.delay = min(max(expected_duration / 10, min_delay), max_delay)
+        else:
+            self.first_delay = None
+            self.delay = min_delay
+
+    @classmethod
+    def from_history(cls, streams, stream_id, timeout:float=None, started_at:str=None, **kwargs):
+        """Creates a poller seeded with the median duration of the past executions of a stream
+
+        Args:
+            started_at (str, optional): When the execution being polled started, as returned by the API
+        """
+        durations = get_historical_durations(streams, stream_id)
+        expected_duration = median(durations) if durations else None
+        if expected_duration is not None:
+            print(f"Past refreshes typically took {expected_duration:.0f} seconds")
+        elapsed = 0
+        if started_at:
+            try:
+                elapsed = (datetime.now(timezone.utc) - parse_timestamp(started_at)).total_seconds()
+            except ValueError:
+                pass
+        return cls(expected_duration, timeout, elapsed, **kwargs)
+
+    def next_delay(self) -> float:
+        """Returns how long to wait before the next check, never past the deadline"""
+        if self.first_delay is not None:
+            delay, self.first_delay = self.first_delay, None
+        else:
+            delay = self.delay
+            self.delay = min(self.delay * self.backoff, self.max_delay)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.deadline is not None:
+            delay = min(delay, max(self.deadline - time.monotonic(), 0))
+        return delay
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def poll(self, check, is_done):
+        """Calls check until is_done returns True for its result or the deadline passes, waiting between calls
+
+        Returns:
+            The last result of check
+        """
+        while True:
+            delay = self.next_delay()
+            print(f"Waiting for {delay:.0f} seconds before checking again")
+            with metrics.span('poll.wait'):
+                time.sleep(delay)
+            with metrics.span('poll.check'):
+                result = check()
+            if is_done(result):
+                return result
+            if self.expired():
+                print("The timeout was reached before the refresh completed")
+                return result
+
+
+class PollScheduler:
+    """Polls many executions from a single loop
+
+    Each execution keeps its own AdaptivePoller, and the loop sleeps until the next check that is due, so
+    the number of requests depends on how long each refresh takes rather than on how many are running.
+    """
+
+    def __init__(self):
+        self.due = []
+        self.order = itertools.count()
+
+    def add(self, key, poller:AdaptivePoller, check, is_done):
+        """Schedules the first check of an execution
+
+        Args:
+            key: Identifies the execution in the results
+            poller (AdaptivePoller): Decides when to check the execution
+            check (callable): Returns the current state of the execution
+            is_done (callable): Returns True when a result of check is final
+        """
+        heapq.heappush(self.due, (time.monotonic() + poller.next_delay(), next(self.order), key, poller, check, is_done))
+
+    def run(self) -> dict:
+        """Checks the executions until every one is done or past its deadline
+
+        Returns:
+            dict: The last result of check for every key
+        """
+        results = {}
+        while self.due:
+            due, _, key, poller, check, is_done = heapq.heappop(self.due)
+            with metrics.span('poll.wait'):
+                time.sleep(max(due - time.monotonic(), 0))
+            with metrics.span('poll.check'):
+                result = check()
+            if is_done(result) or poller.expired():
+                results[key] = result
+                continue
+            heapq.heappush(self.due, (time.monotonic() + poller.next_delay(), next(self.order), key, poller, check, is_done))
+        return results
+
+
+def is_running(execution:dict) -> bool:
+    return execution['currentState'] == 'ACTIVE'
+
+
+def wait_for_completion(check, resolver, dataset_id, timeout:float=None) -> dict:
+    """Checks an execution of the stream of a dataSet and polls it until it finishes or the timeout passes
+
+    Polling backs off between checks based on how long past refreshes of the dataSet took. An execution that
+    has already finished is returned after the first check, without reading the history.
+
+    Args:
+        check (callable): Returns the current details of the execution
+        resolver (StreamResolver): Resolves the stream of the dataSet, whose history seeds the poller
+        dataset_id (str): The id of the dataSet
+        timeout (float, optional): The most seconds to wait for
+
+    Returns:
+        dict: The last details of the execution
+    """
+    execution = check()
+    if not is_running(execution):
+        return execution
+    print("Waiting for Domo Refresh to complete")
+    poller = AdaptivePoller.from_history(
+        resolver.domo.streams, resolver.resolve(dataset_id), timeout, execution.get('startedAt'))
+    return poller.poll(check, lambda execution: not is_running(execution))
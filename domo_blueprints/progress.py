@@ -0,0 +1,62 @@
+import os
+import json
+import time
+import threading
+
+
+class FileProgress:
+    """Tracks the parts read and uploaded from each file of an upload and writes a summary to a JSON file
+
+    The summary records, for every file, how many parts and bytes were read and uploaded, when reading
+    started and finished, and whether the file was fully read.
+    """
+
+    def __init__(self, summary_path:str, file_paths:list):
+        self.summary_path = summary_path
+        self.files = {
+            file_path: {
+                'status': 'pending',
+                'parts_read': 0,
+                'bytes_read': 0,
+                'parts_uploaded': 0,
+                'bytes_uploaded': 0,
+                'started': None,
+                'finished': None
+            } for file_path in file_paths
+        }
+        self.part_sizes = {}
+        self.lock = threading.Lock()
+
+    def start_file(self, file_path:str):
+        with self.lock:
+            self.files[file_path]['status'] = 'reading'
+            self.files[file_path]['started'] = time.time()
+
+    def read_part(self, part_num:int, file_path:str, size:int):
+        with self.lock:
+            self.part_sizes[part_num] = (file_path, size)
+            self.files[file_path]['parts_read'] += 1
+            self.files[file_path]['bytes_read'] += size
+
+    def finish_file(self, file_path:str):
+        with self.lock:
+            self.files[file_path]['status'] = 'read'
+            self.files[file_path]['finished'] = time.time()
+
+    def complete_part(self, part_num:int):
+        with self.lock:
+            if part_num not in self.part_sizes:
+                return
+            file_path, size = self.part_sizes.pop(part_num)
+            self.files[file_path]['parts_uploaded'] += 1
+            self.files[file_path]['bytes_uploaded'] += size
+
+    def save(self):
+        if self.summary_path is None:
+            return
+        with self.lock:
+            summary = {'files': self.files}
+            temp_path = f'{self.summary_path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(summary, f, indent=2)
+            os.replace(temp_path, self.summary_path)
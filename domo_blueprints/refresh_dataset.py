@@ -1,28 +1,65 @@
 import sys
-import time
 import json
-import pydomo
 import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import shipyard_utils as shipyard
 
 try:
     import errors
+    import metrics
+    from stream_resolver import StreamResolver
+    from poller import AdaptivePoller, PollScheduler, wait_for_completion
+    from token_cache import connect_domo
 except BaseException:
     from . import errors
+    from . import metrics
+    from .stream_resolver import StreamResolver
+    from .poller import AdaptivePoller, PollScheduler, wait_for_completion
+    from .token_cache import connect_domo
 
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--client-id", dest="client_id", required=True)
     parser.add_argument("--secret-key", dest="secret_key", required=True)
-    parser.add_argument("--dataset-id", dest="dataset_id", required=True)
+    parser.add_argument("--dataset-id", dest="dataset_id", required=False)
+    parser.add_argument("--dataset-ids", dest="dataset_ids", required=False)
+    parser.add_argument("--dataset-ids-file", dest="dataset_ids_file", required=False)
+    parser.add_argument(
+        "--max-concurrent", dest="max_concurrent", type=int, default=8, required=False
+    )
     parser.add_argument(
         "--wait-for-completion",
         dest="wait_for_completion",
         required=False,
         default="FALSE",
     )
+    parser.add_argument("--timeout", dest="timeout", type=float, required=False)
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        choices={"TRUE", "FALSE"},
+        default="FALSE",
+        required=False,
+    )
+    parser.add_argument(
+        "--metrics-textfile", dest="metrics_textfile", default=None, required=False
+    )
+    parser.add_argument(
+        "--metrics-format",
+        dest="metrics_format",
+        choices=set(metrics.METRICS_FORMATS),
+        default="prometheus",
+        required=False,
+    )
+    parser.add_argument(
+        "--token-cache",
+        dest="token_cache",
+        choices={"TRUE", "FALSE"},
+        default="FALSE",
+        required=False,
+    )
     args = parser.parse_args()
 
     return args
@@ -48,29 +85,21 @@ def determine_execution_status(execution_data):
         return errors.EXIT_CODE_UNKNOWN_STATUS
 
 
-def get_execution_details(dataset_id, execution_id, domo):
+def get_execution_details(dataset_id, execution_id, resolver):
     """
-    Gets the Stream ID of a particular stream using the dataSet id.
+    Gets the details of an execution of the stream of a dataSet.
 
     Returns:
-        stream_id (int): the Id of the found stream
+        execution_data (dict): the details of the execution
     """
-    streams = domo.streams
-    limit = 1000
-    offset = 0
-    # get all streams
-    stream_list = streams.list(limit, offset)
-    # return stream with matching dataset id
-    for stream in stream_list:
-        if stream["dataSet"]["id"] == dataset_id:
-            # get execution details from id
-            try:
-                return streams.get_execution(stream["id"], execution_id)
-            except Exception as e:
-                print(f"Error occurred - {e}")
-                sys.exit(errors.EXIT_CODE_EXECUTION_ID_NOT_FOUND)
-    print(f"stream with dataSet id:{dataset_id} not found!")
-    sys.exit(errors.EXIT_CODE_DATASET_NOT_FOUND)
+    try:
+        return resolver.get_execution(dataset_id, execution_id)
+    except LookupError as e:
+        print(e)
+        sys.exit(errors.EXIT_CODE_DATASET_NOT_FOUND)
+    except Exception as e:
+        print(f"Error occurred - {e}")
+        sys.exit(errors.EXIT_CODE_EXECUTION_ID_NOT_FOUND)
 
 
 def create_pickle_file(execution_id):
@@ -118,7 +147,7 @@ def create_dev_token_header(developer_token):
     }
 
 
-def get_stream_from_dataset_id(dataset_id, domo):
+def get_stream_from_dataset_id(dataset_id, resolver):
     """
     Gets the Stream ID of a particular stream using the dataSet id.
 
@@ -126,7 +155,7 @@ def get_stream_from_dataset_id(dataset_id, domo):
         stream_id (int): the Id of the found stream
     """
     try:
-        stream_id = domo.utilities.get_stream_id(ds_id=dataset_id)
+        stream_id = resolver.resolve(dataset_id)
     except Exception as e:
         print(
             f"stream with dataSet ID:{dataset_id} not found. Ensure that a valid dataset ID is provided and is the ID of an outputted dataset from a dataflow"
@@ -136,13 +165,13 @@ def get_stream_from_dataset_id(dataset_id, domo):
         return stream_id
 
 
-def run_stream_refresh(stream_id: str, domo_instance: pydomo.Domo):
+@metrics.timed("refresh.start")
+def run_stream_refresh(dataset_id: str, resolver: StreamResolver):
     """
-    Executes/starts a stream
+    Executes/starts the stream of a dataSet
     """
-    streams = domo_instance.streams
     try:
-        execution = streams.create_execution(stream_id)
+        execution = resolver.create_execution(dataset_id)
     except Exception as e:
         print("Error in starting stream execution")
         print(e)
@@ -152,11 +181,183 @@ def run_stream_refresh(stream_id: str, domo_instance: pydomo.Domo):
         return execution
 
 
+def read_dataset_ids(dataset_ids, dataset_ids_file):
+    """
+    Collects the dataSet ids of a batch refresh from a comma separated
+    list and from a file with one id per line. Blank lines and lines
+    starting with # are ignored, and duplicates are only refreshed once.
+
+    Returns:
+        dataset_ids (list): the ids in the order they were given
+    """
+    ids = []
+    if dataset_ids:
+        ids.extend(dataset_ids.split(","))
+    if dataset_ids_file:
+        try:
+            with open(dataset_ids_file, "r") as f:
+                ids.extend(f.read().splitlines())
+        except OSError as e:
+            print(f"Unable to read the dataset ids file {dataset_ids_file}: {e}")
+            sys.exit(errors.EXIT_CODE_FILE_NOT_FOUND)
+    ids = [dataset_id.strip() for dataset_id in ids]
+    return list(
+        dict.fromkeys(
+            dataset_id
+            for dataset_id in ids
+            if dataset_id and not dataset_id.startswith("#")
+        )
+    )
+
+
+@metrics.timed("refresh.start")
+def start_batch_refresh(dataset_id, resolver):
+    """
+    Resolves the stream of a dataSet and starts an execution on it without
+    exiting on errors, so one dataSet cannot stop the rest of the batch.
+
+    Returns:
+        result (dict): the dataSet, stream and execution ids, the status
+        and the exit code of the refresh
+    """
+    result = {
+        "dataset_id": dataset_id,
+        "stream_id": None,
+        "execution_id": None,
+        "status": None,
+        "exit_code": None,
+        "error": None,
+    }
+    try:
+        result["stream_id"] = resolver.resolve(dataset_id)
+    except Exception as e:
+        print(f"{dataset_id}: stream with dataSet ID:{dataset_id} not found")
+        result["error"] = str(e)
+        result["exit_code"] = errors.EXIT_CODE_DATASET_NOT_FOUND
+        return result
+    try:
+        execution = resolver.create_execution(dataset_id)
+    except Exception as e:
+        print(f"{dataset_id}: Error in starting stream execution")
+        result["error"] = str(e)
+        result["exit_code"] = errors.EXIT_CODE_REFRESH_ERROR
+        return result
+    print(f"{dataset_id}: Refresh started successfully")
+    result["execution_id"] = execution["id"]
+    result["status"] = execution.get("currentState")
+    result["exit_code"] = errors.EXIT_CODE_FINAL_STATUS_SUCCESS
+    return result
+
+
+def check_batch_refresh(result, resolver):
+    """
+    Checks the status of a refresh started by start_batch_refresh.
+
+    Returns:
+        result (dict): a copy of the result with the current status
+    """
+    result = dict(result)
+    try:
+        execution_data = resolver.get_execution(
+            result["dataset_id"], result["execution_id"]
+        )
+    except Exception as e:
+        print(f"{result['dataset_id']}: Error occurred - {e}")
+        result["error"] = str(e)
+        result["exit_code"] = errors.EXIT_CODE_EXECUTION_ID_NOT_FOUND
+        return result
+    print(f"{result['dataset_id']}: ", end="")
+    result["status"] = execution_data["currentState"]
+    result["exit_code"] = determine_execution_status(execution_data)
+    return result
+
+
+def run_batch_refresh(dataset_ids, resolver, max_concurrent=8,
+                      wait_for_completion=False, timeout=None):
+    """
+    Refreshes many dataSets from a single process. Streams are resolved
+    and executions started by a pool of at most max_concurrent threads,
+    then every running execution is polled from one scheduler.
+
+    Returns:
+        report (list): the result of each dataSet, in the order given
+    """
+    def start(dataset_id):
+        result = start_batch_refresh(dataset_id, resolver)
+        poller = None
+        if wait_for_completion and result["execution_id"] is not None:
+            poller = AdaptivePoller.from_history(
+                resolver.domo.streams, result["stream_id"], timeout
+            )
+        return result, poller
+
+    with ThreadPoolExecutor(max_workers=max(max_concurrent, 1)) as executor:
+        started = list(executor.map(start, dataset_ids))
+
+    report = {result["dataset_id"]: result for result, _ in started}
+    if wait_for_completion:
+        print("Waiting for Domo Refreshes to complete")
+        scheduler = PollScheduler()
+        for result, poller in started:
+            if poller is not None:
+                scheduler.add(
+                    result["dataset_id"],
+                    poller,
+                    lambda result=result: check_batch_refresh(result, resolver),
+                    lambda result: result["exit_code"]
+                    != errors.EXIT_CODE_STATUS_INCOMPLETE,
+                )
+        report.update(scheduler.run())
+    return [report[dataset_id] for dataset_id in dataset_ids]
+
+
+def determine_batch_exit_code(report):
+    """
+    Combines the exit codes of a batch refresh. The batch succeeds when
+    every dataSet succeeded, exits with the shared code when every failure
+    has the same one, and with EXIT_CODE_BATCH_FAILURE otherwise.
+    """
+    failures = {
+        result["exit_code"]
+        for result in report
+        if result["exit_code"] != errors.EXIT_CODE_FINAL_STATUS_SUCCESS
+    }
+    if not failures:
+        return errors.EXIT_CODE_FINAL_STATUS_SUCCESS
+    if len(failures) == 1:
+        return failures.pop()
+    return errors.EXIT_CODE_BATCH_FAILURE
+
+
+def write_batch_report(report):
+    # create artifacts folder to save the report
+    base_folder_name = shipyard.logs.determine_base_artifact_folder("domo")
+    artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(
+        base_folder_name
+    )
+    shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
+    report_path = shipyard.files.combine_folder_and_file_name(
+        artifact_subfolder_paths["responses"], "batch_refresh_report.json"
+    )
+    shipyard.files.write_json_to_file(report, report_path)
+    for result in report:
+        print(
+            f"{result['dataset_id']}: {result['status'] or 'NOT STARTED'} (exit code {result['exit_code']})"
+        )
+
+
 def main():
     args = get_args()
+    if args.metrics == "TRUE" or args.metrics_textfile:
+        metrics.enable("refresh_dataset", args.metrics_textfile, args.metrics_format)
     # initialize domo with auth credentials
     try:
-        domo = pydomo.Domo(args.client_id, args.secret_key, api_host="api.domo.com")
+        domo = connect_domo(
+            args.client_id,
+            args.secret_key,
+            api_host="api.domo.com",
+            token_cache=args.token_cache == "TRUE",
+        )
     except Exception as e:
         print(
             "The client_id or secret_key you provided were invalid. Please check for typos and try again."
@@ -164,23 +365,42 @@ def main():
         print(e)
         sys.exit(errors.EXIT_CODE_INVALID_CREDENTIALS)
 
+    resolver = StreamResolver(domo)
+    if args.dataset_ids or args.dataset_ids_file:
+        dataset_ids = read_dataset_ids(args.dataset_ids, args.dataset_ids_file)
+        if args.dataset_id:
+            dataset_ids = list(dict.fromkeys([args.dataset_id] + dataset_ids))
+        print(f"Refreshing {len(dataset_ids)} datasets")
+        report = run_batch_refresh(
+            dataset_ids,
+            resolver,
+            args.max_concurrent,
+            args.wait_for_completion == "TRUE",
+            args.timeout,
+        )
+        write_batch_report(report)
+        sys.exit(determine_batch_exit_code(report))
+    if not args.dataset_id:
+        print("Provide a dataset id with --dataset-id, --dataset-ids or --dataset-ids-file")
+        sys.exit(errors.EXIT_CODE_BAD_REQUEST)
+
     # execute dataset refresh
     dataset_id = args.dataset_id
-    stream_id = get_stream_from_dataset_id(dataset_id, domo)
-    refresh_data = run_stream_refresh(stream_id, domo_instance=domo)
+    # a dataSet without a stream exits as not found before anything is started.
+    # The resolver caches the stream for the refresh and the polling
+    get_stream_from_dataset_id(dataset_id, resolver)
+    refresh_data = run_stream_refresh(dataset_id, resolver)
     execution_id = refresh_data["id"]
 
     create_pickle_file(execution_id)  # needed for backwards compatibility
     if args.wait_for_completion == "TRUE":
-        execution_data = get_execution_details(dataset_id, execution_id, domo)
-        exit_code_status = determine_execution_status(execution_data)
-        print("Waiting for Domo Refresh to complete")
-        while exit_code_status == errors.EXIT_CODE_STATUS_INCOMPLETE:
-            print("Waiting for 60 seconds before checking again")
-            time.sleep(60)
-            execution_data = get_execution_details(dataset_id, execution_id, domo)
-            exit_code_status = determine_execution_status(execution_data)
-        sys.exit(exit_code_status)
+        execution_data = wait_for_completion(
+            lambda: get_execution_details(dataset_id, execution_id, resolver),
+            resolver,
+            dataset_id,
+            args.timeout,
+        )
+        sys.exit(determine_execution_status(execution_data))
 
 
 if __name__ == "__main__":
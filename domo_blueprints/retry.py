@@ -0,0 +1,210 @@
+import time
+import math
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+import pydomo
+try:
+    import metrics
+except BaseException:
+    from . import metrics
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1 # seconds before the first retry when the server does not say how long to wait
+BACKOFF_MAX = 60
+RETRY_AFTER_MAX = 300 # longest wait a Retry-After header is followed for, so a bad header cannot stall a run
+RETRY_STATUSES = {429, 502, 503, 504}
+UNPROCESSED_STATUSES = {429, 503} # the server turned the request away without acting on it
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+FAILURE_THRESHOLD = 10 # consecutive transient failures that open the circuit
+RESET_TIMEOUT = 30 # seconds the circuit stays open before a trial request is let through
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open"""
+
+
+def retry_delay(retry_after:str, attempt:int, backoff_base:float=BACKOFF_BASE, backoff_max:float=BACKOFF_MAX,
+                retry_after_max:float=RETRY_AFTER_MAX) -> float:
+    """Returns the seconds to wait before retrying, from a Retry-After header if there is one
+
+    Retry-After can either be a number of seconds or an HTTP date, and is capped at retry_after_max. Without
+    it, the delay grows exponentially with the attempt up to backoff_max, with full jitter.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+            if not math.isnan(delay):
+                return min(max(delay, 0), retry_after_max)
+        except ValueError:
+            pass
+        try:
+            delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            return min(max(delay, 0), retry_after_max)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return random.uniform(0, min(backoff_base * 2 ** attempt, backoff_max))
+
+
+def is_idempotent(method:str, url:str) -> bool:
+    """Whether sending a request a second time has the same effect as sending it once
+
+    Uploading a part is a PUT to the index of the part, so a part sent again replaces itself. Committing an
+    execution is also a PUT, but a second commit after a lost response fails instead of doing nothing. SQL
+    queries are POSTed but only read.
+    """
+    path = url.split('?')[0].rstrip('/')
+    if path.endswith('/commit'):
+        return False
+    return method.upper() in IDEMPOTENT_METHODS or '/query/execute/' in path
+
+
+class CircuitBreaker:
+    """Stops sending requests to a service that keeps failing, so every caller fails fast instead of retrying
+
+    After failure_threshold transient failures in a row the circuit opens and requests raise CircuitOpenError
+    at once. Once reset_timeout seconds have passed, a single trial request is let through: the circuit closes
+    again if it succeeds and stays open for another reset_timeout if it fails. Rate limiting is not a failure
+    of the service, so 429 responses are left out of the count.
+    """
+
+    def __init__(self, failure_threshold:int=FAILURE_THRESHOLD, reset_timeout:float=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                metrics.count('http.circuit_rejected')
+                raise CircuitOpenError(f"{self.failures} requests in a row failed. Not sending more requests "
+                                       f"for {self.reset_timeout} seconds")
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    metrics.count('http.circuit_opened')
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+
+
+class RetryPolicy:
+    """Decides which failed requests are sent again and how long to wait before each retry
+
+    Responses with status 429 or a transient 5xx and connection errors are retried up to max_retries times,
+    after the delay given by their Retry-After header, up to retry_after_max, or with capped exponential backoff
+    and jitter. Requests that are not idempotent are only retried when the server turned them away unprocessed,
+    with a 429 or 503.
+    An optional circuit breaker is shared by every request sent under the policy.
+    """
+
+    def __init__(self, max_retries:int=MAX_RETRIES, backoff_base:float=BACKOFF_BASE, backoff_max:float=BACKOFF_MAX,
+                 retry_statuses:set=RETRY_STATUSES, breaker:CircuitBreaker=None, retry_after_max:float=RETRY_AFTER_MAX):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.retry_statuses = retry_statuses
+        self.breaker = breaker
+
+    def delay(self, attempt:int, retry_after:str=None) -> float:
+        return retry_delay(retry_after, attempt, self.backoff_base, self.backoff_max, self.retry_after_max)
+
+    def before_request(self):
+        if self.breaker is not None:
+            self.breaker.before_request()
+
+    def record(self, status:int=None):
+        """Records the outcome of a request with the circuit breaker. Without a status, the request failed to connect"""
+        if self.breaker is None or status == 429:
+            return
+        if status is None or status in self.retry_statuses:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def can_retry(self, attempt:int, idempotent:bool, status:int=None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if status is not None and status not in self.retry_statuses:
+            return False
+        return idempotent or status in UNPROCESSED_STATUSES
+
+    def send(self, send, method:str, url:str, body=None) -> requests.Response:
+        """Calls send, which sends the request and returns its response, until it succeeds or cannot be retried
+
+        A body read from a file-like object is rewound before it is sent again, and a body that cannot be
+        rewound is never sent twice.
+
+        Raises:
+            CircuitOpenError: if the circuit breaker is open
+        """
+        idempotent = is_idempotent(method, url)
+        rewindable = True
+        position = None
+        if hasattr(body, 'read'):
+            try:
+                position = body.tell()
+            except (AttributeError, OSError):
+                rewindable = False
+        attempt = 0
+        while True:
+            self.before_request()
+            if position is not None:
+                body.seek(position)
+            try:
+                response = send()
+            except TRANSIENT_ERRORS as e:
+                self.record()
+                # the request may have reached the server before the connection failed
+                if not rewindable or not self.can_retry(attempt, idempotent):
+                    raise
+                reason = repr(e)
+                delay = self.delay(attempt)
+            else:
+                self.record(response.status_code)
+                if not rewindable or not self.can_retry(attempt, idempotent, response.status_code):
+                    return response
+                reason = f"status code {response.status_code}"
+                delay = self.delay(attempt, response.headers.get('Retry-After'))
+                # let the connection go back to the pool
+                response.close()
+            attempt += 1
+            metrics.count('http.retries')
+            print(f"{method} {url} failed with {reason}. Retrying in {delay:.1f} seconds")
+            time.sleep(delay)
+
+
+DEFAULT_POLICY = RetryPolicy(breaker=CircuitBreaker())
+
+
+class RetryingTransport(pydomo.DomoAPITransport):
+    """A pydomo transport that sends requests under a retry policy
+
+    Every call of a pydomo client goes through request, so part uploads, commits, exports and queries are all
+    retried on transient failures. Clients share the policy, and so its circuit breaker, unless retry_policy
+    is set.
+    """
+    retry_policy = None
+
+    def request(self, url, method, headers, params=None, body=None):
+        policy = self.retry_policy or DEFAULT_POLICY
+        send = super().request
+        return policy.send(lambda: send(url, method, headers, params, body), method, url, body)
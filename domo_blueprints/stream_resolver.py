@@ -0,0 +1,94 @@
+import re
+try:
+    import metrics
+    from cache import JsonCache
+except BaseException:
+    from . import metrics
+    from .cache import JsonCache
+
+STREAM_CACHE_TTL = 7 * 24 * 3600 # the stream of a dataset rarely changes
+# pydomo raises a plain Exception with the response body, which holds the status of a missing stream
+NOT_FOUND_PATTERN = re.compile(r'"status"\s*:\s*404|not found', re.IGNORECASE)
+
+
+def is_not_found(error:Exception) -> bool:
+    """Returns whether a streams API call failed because the stream does not exist"""
+    return bool(NOT_FOUND_PATTERN.search(str(error)))
+
+
+class StreamResolver:
+    """Finds the stream of a dataset with the indexed stream search instead of listing every stream
+
+    Resolved streams are kept in an on-disk cache shared by every blueprint, so checking the status of an
+    execution usually takes a single request. Entries are keyed by the API host and the client id as well as
+    the dataset, so instances and credentials never share them. A cached stream that Domo no longer knows is
+    dropped from the cache and resolved again.
+    """
+
+    def __init__(self, domo, cache:JsonCache=None):
+        self.domo = domo
+        self.cache = cache if cache is not None else JsonCache('streams', STREAM_CACHE_TTL, max_entries=1024)
+
+    def key(self, dataset_id:str) -> str:
+        return f'{self.domo.transport.apiHost} {self.domo.transport.clientId} {dataset_id}'
+
+    def resolve(self, dataset_id:str, refresh:bool=False):
+        """Returns the id of the stream of a dataset
+
+        Args:
+            dataset_id (str): The id of the dataset
+            refresh (bool, optional): Whether to skip the cache and search for the stream again. Defaults to False.
+
+        Raises:
+            LookupError: if no stream feeds the dataset
+        """
+        if not refresh:
+            stream_id = self.cache.get(self.key(dataset_id))
+            if stream_id is not None:
+                metrics.count('stream_cache.hits')
+                return stream_id
+        metrics.count('stream_cache.misses')
+        try:
+            with metrics.span('stream.search'):
+                stream_id = self.domo.utilities.get_stream_id(ds_id=dataset_id)
+        except IndexError:
+            self.invalidate(dataset_id)
+            raise LookupError(f"stream with dataSet id:{dataset_id} not found!")
+        self.cache.set(self.key(dataset_id), stream_id)
+        return stream_id
+
+    def invalidate(self, dataset_id:str):
+        self.cache.delete(self.key(dataset_id))
+
+    def with_stream(self, dataset_id:str, function, *args, replay:bool=True):
+        """Calls a streams API function with the stream of a dataset as its first argument
+
+        If the stream is not found, it is resolved again in case the dataset is now fed by a different one, and
+        the call is retried once on the new stream. Other failures, such as timeouts and server errors, are
+        raised as they are.
+
+        Args:
+            replay (bool, optional): Whether the call may be retried on the new stream. Calls that are not
+                idempotent, such as creating or committing an execution, are never sent twice. The new stream is
+                still cached, so the next call uses it.
+        """
+        stream_id = self.resolve(dataset_id)
+        try:
+            return function(stream_id, *args)
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            fresh_stream_id = self.resolve(dataset_id, refresh=True)
+            if fresh_stream_id == stream_id or not replay:
+                raise
+            return function(fresh_stream_id, *args)
+
+    def get_execution(self, dataset_id:str, execution_id):
+        """Returns the details of an execution of the stream of a dataset"""
+        with metrics.span('execution.get'):
+            return self.with_stream(dataset_id, self.domo.streams.get_execution, execution_id)
+
+    def create_execution(self, dataset_id:str):
+        """Starts a new execution of the stream of a dataset"""
+        with metrics.span('execution.create'):
+            return self.with_stream(dataset_id, self.domo.streams.create_execution, replay=False)
@@ -0,0 +1,140 @@
+import os
+import time
+import base64
+import hashlib
+from functools import lru_cache
+import pydomo
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+try:
+    import metrics
+    from cache import JsonCache
+    from retry import RetryingTransport
+except BaseException:
+    from . import metrics
+    from .cache import JsonCache
+    from .retry import RetryingTransport
+
+OAUTH_TOKEN_TTL = 3600 # Domo issues OAuth tokens for an hour, and pydomo does not keep the expiry it reports
+# content API session tokens do not report their expiry. A token rejected before then is dropped and replaced
+SESSION_TOKEN_TTL = 3600
+REFRESH_MARGIN = 300 # tokens this close to expiring are renewed instead of reused
+KDF_ITERATIONS = 100000
+
+
+@lru_cache(maxsize=32)
+def derive_key(secret:str, salt:bytes) -> bytes:
+    """Derives the key of a cache entry, only once per run for each secret and salt"""
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS)
+    return base64.urlsafe_b64encode(kdf.derive(secret.encode()))
+
+
+class TokenCache:
+    """Keeps access tokens on disk so short blueprint runs do not have to authenticate every time
+
+    Tokens are encrypted with a key derived from the secret they were obtained with (the client secret or
+    the password), so the cache file is useless without the credential. Entries are keyed by a hash of the
+    kind of token, the instance and the client id or email, and are renewed once they come within a few
+    minutes of expiring. A renewed token keeps the salt of the entry it replaces, so reading and renewing
+    a token in the same run derive its key only once. The cache is off unless it is enabled, which the
+    blueprints do with --token-cache TRUE.
+    """
+
+    def __init__(self, cache:JsonCache=None, enabled:bool=False):
+        self.enabled = enabled
+        self.cache = cache if cache is not None else JsonCache('tokens', 24 * 3600, private=True)
+
+    @staticmethod
+    def key(kind:str, instance:str, identity:str) -> str:
+        return hashlib.sha256(f'{kind}\n{instance}\n{identity}'.encode()).hexdigest()
+
+    def get(self, kind:str, instance:str, identity:str, secret:str):
+        """Returns the cached token, or None if there is none, it expires soon or the secret has changed"""
+        if not self.enabled:
+            return None
+        entry = self.cache.get(self.key(kind, instance, identity))
+        if entry is None or entry['expires'] - REFRESH_MARGIN <= time.time():
+            return None
+        try:
+            fernet = Fernet(derive_key(secret, base64.b64decode(entry['salt'])))
+            return fernet.decrypt(entry['token'].encode()).decode()
+        except (InvalidToken, ValueError):
+            return None
+
+    def set(self, kind:str, instance:str, identity:str, secret:str, token:str, expires_in:float):
+        if not self.enabled:
+            return
+        entry = self.cache.get(self.key(kind, instance, identity))
+        salt = base64.b64decode(entry['salt']) if entry is not None else os.urandom(16)
+        fernet = Fernet(derive_key(secret, salt))
+        self.cache.set(self.key(kind, instance, identity), {
+            'salt': base64.b64encode(salt).decode(),
+            'token': fernet.encrypt(token.encode()).decode(),
+            'expires': time.time() + expires_in
+        })
+
+    def delete(self, kind:str, instance:str, identity:str):
+        if self.enabled:
+            self.cache.delete(self.key(kind, instance, identity))
+
+
+class CachedTokenTransport(RetryingTransport):
+    """A pydomo transport that reuses a cached OAuth token when it is created
+
+    The first token comes from the cache when there is a valid one. Any later renewal, such as the one pydomo
+    makes when a request is rejected with a 401, requests a new token the way pydomo does and replaces the
+    cached one.
+    """
+
+    def __init__(self, *args, token_cache:TokenCache=None, **kwargs):
+        self.token_cache = token_cache if token_cache is not None else TokenCache(enabled=True)
+        self.token_renewed = False
+        super().__init__(*args, **kwargs)
+
+    def _renew_access_token(self):
+        if not self.token_renewed:
+            self.token_renewed = True
+            access_token = self.token_cache.get('oauth', self.apiHost, self.clientId, self.clientSecret)
+            if access_token is not None:
+                self.logger.debug("Using cached Access Token")
+                metrics.count('auth.cached_tokens')
+                self.access_token = access_token
+                return
+        metrics.count('auth.token_requests')
+        super()._renew_access_token()
+        self.token_cache.set('oauth', self.apiHost, self.clientId, self.clientSecret, self.access_token,
+                             OAUTH_TOKEN_TTL)
+
+
+@metrics.timed('auth')
+def connect_domo(client_id:str, client_secret:str, api_host:str='api.domo.com', token_cache:bool=False,
+                 **kwargs) -> pydomo.Domo:
+    """Creates a pydomo client like pydomo.Domo, optionally reusing a cached access token
+
+    Requests of the client are retried on transient failures under the shared retry policy. pydomo.Domo
+    requests a token from its own transport as soon as it is created, so the client is put together here
+    around a transport created explicitly. Nothing global is changed, so clients can be created from many
+    threads at once.
+
+    Args:
+        token_cache (bool, optional): whether to reuse and keep the access token in the encrypted token cache
+    """
+    domo = pydomo.Domo.__new__(pydomo.Domo)
+    if 'logger_name' in kwargs:
+        domo.logger = pydomo.parent_logger.getChild(kwargs['logger_name'])
+    else:
+        domo.logger = pydomo.parent_logger
+    if kwargs.get('log_level'):
+        domo.logger.setLevel(kwargs['log_level'])
+    transport = CachedTokenTransport if token_cache else RetryingTransport
+    domo.transport = transport(client_id, client_secret, api_host, kwargs.get('use_https', True), domo.logger,
+                               request_timeout=kwargs.get('request_timeout'))
+    domo.datasets = pydomo.DataSetClient(domo.transport, domo.logger)
+    domo.groups = pydomo.GroupClient(domo.transport, domo.logger)
+    domo.pages = pydomo.PageClient(domo.transport, domo.logger)
+    domo.streams = pydomo.StreamClient(domo.transport, domo.logger)
+    domo.users = pydomo.UserClient(domo.transport, domo.logger)
+    domo.accounts = pydomo.AccountClient(domo.transport, domo.logger)
+    domo.utilities = pydomo.UtilitiesClient(domo.transport, domo.logger)
+    return domo
@@ -9,16 +9,48 @@ import os
 import ast
 import re
 import typing
+import gzip
+import time
+import requests
+import threading
+import hashlib
+import json
+import queue
 from random import random, randrange
 from itertools import islice
-from io import StringIO
+from functools import partial, lru_cache
+from io import StringIO, BytesIO
 from math import exp, log, floor, ceil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 try:
     import errors as ec
+    import csv_parts
+    import arrow_parts
+    import validation
+    import metrics
+    from checkpoint import UploadCheckpoint
+    from cache import JsonCache
+    from progress import FileProgress
+    from token_cache import connect_domo
+    from watermark import Watermark, WATERMARK_TYPES
 except BaseException:
     from . import errors as ec
+    from . import csv_parts
+    from . import arrow_parts
+    from . import validation
+    from . import metrics
+    from .checkpoint import UploadCheckpoint
+    from .cache import JsonCache
+    from .progress import FileProgress
+    from .token_cache import connect_domo
+    from .watermark import Watermark, WATERMARK_TYPES
 
-CHUNKSIZE= 50000
+PART_SIZE = 50 * 1024 * 1024 # default target bytes per part
+SAMPLE_PROBES = 100 # random offsets read from when sampling by seeking
+SAMPLE_WORKERS = 8 # files sampled at the same time
+SEEK_SAMPLE_MIN_SIZE = 16 * 1024 * 1024 # smaller files are cheap enough to scan in full
+HEADER_READ_SIZE = 1024 * 1024 # bytes read to find the header of a file
+SAMPLE_CACHE_SIZE = 256 # files whose samples are kept for the rest of the run
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -32,8 +64,41 @@ def get_args():
     parser.add_argument("--insert-method", dest = 'insert_method' ,default = 'REPLACE',choices={"REPLACE","APPEND"},required=True)
     parser.add_argument("--dataset-id", required=False, default='',dest='dataset_id')
     parser.add_argument("--source-file-match-type", dest = "source_file_match_type", choices= {'regex_match', 'exact_match'}, default = 'exact_match', required = False)
+    parser.add_argument("--upload-workers", dest = 'upload_workers', type = int, default = 1, required = False)
+    parser.add_argument("--read-workers", dest = 'read_workers', type = int, default = 4, required = False)
+    parser.add_argument("--upload-mode", dest = 'upload_mode', choices = {'parse', 'raw'}, default = 'parse', required = False)
+    parser.add_argument("--part-size-mb", dest = 'part_size_mb', type = int, default = 50, required = False)
+    parser.add_argument("--adaptive-part-size", dest = 'adaptive_part_size', choices = {'TRUE', 'FALSE'}, default = 'TRUE', required = False)
+    parser.add_argument("--compression", dest = 'compression', choices = {'none', 'gzip'}, default = 'none', required = False)
+    parser.add_argument("--compression-level", dest = 'compression_level', type = int, choices = range(0, 10), default = 6, required = False)
+    parser.add_argument("--sampling-mode", dest = 'sampling_mode', choices = {'reservoir', 'seek'}, default = 'reservoir', required = False)
+    parser.add_argument("--sample-rows", dest = 'sample_rows', type = int, default = 10000, required = False)
+    parser.add_argument("--sample-probes", dest = 'sample_probes', type = int, default = SAMPLE_PROBES, required = False)
+    parser.add_argument("--schema-cache", dest = 'schema_cache', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
+    parser.add_argument("--schema-cache-ttl-hours", dest = 'schema_cache_ttl_hours', type = float, default = 24, required = False)
+    parser.add_argument("--validation", dest = 'validation', choices = set(validation.VALIDATION_MODES), default = 'off', required = False)
+    parser.add_argument("--resume", dest = 'resume', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
+    parser.add_argument("--watermark-column", dest = 'watermark_column', default = None, required = False)
+    parser.add_argument("--watermark-sorted", dest = 'watermark_sorted', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
+    parser.add_argument("--metrics", dest = 'metrics', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
+    parser.add_argument("--metrics-textfile", dest = 'metrics_textfile', default = None, required = False)
+    parser.add_argument("--metrics-format", dest = 'metrics_format', choices = set(metrics.METRICS_FORMATS), default = 'prometheus', required = False)
+    parser.add_argument("--token-cache", dest = 'token_cache', choices = {'TRUE', 'FALSE'}, default = 'FALSE', required = False)
     args = parser.parse_args()
 
+    # a part size of 0 would upload every record as a part of its own
+    for flag, value in [('--part-size-mb', args.part_size_mb), ('--upload-workers', args.upload_workers),
+                        ('--read-workers', args.read_workers), ('--sample-rows', args.sample_rows),
+                        ('--sample-probes', args.sample_probes)]:
+        if value < 1:
+            parser.error(f'Please provide a {flag} of at least 1.')
+    if args.schema_cache_ttl_hours <= 0:
+        parser.error('Please provide a --schema-cache-ttl-hours greater than 0.')
+    if args.watermark_column and args.insert_method != 'APPEND':
+        parser.error('--watermark-column only applies to --insert-method APPEND.')
+    if args.watermark_column and not args.dataset_id:
+        parser.error('Please provide the --dataset-id the watermark is recorded for.')
+
     return args
 
 def map_domo_to_pandas(domo_schema) -> dict:
@@ -80,46 +145,127 @@ def reservoir_sample(iterable, k=1):
         else:
             return values
 
-def infer_schema(file_name:str, folder_name, domo_instance:Domo, k=10000):
+@metrics.timed('sample')
+@lru_cache(maxsize=SAMPLE_CACHE_SIZE)
+def sample_records(file_path:str, k:int, sampling_mode:str='reservoir', probes:int=SAMPLE_PROBES) -> str:
+    """Samples k records of a CSV file and returns them as CSV text after the header
+
+    Records are sampled whole, so a record with newlines inside of quoted fields is never split. The sample is
+    kept for the rest of the run, so the schema inference and the preflight validation read each file once.
+    """
+    if sampling_mode == 'seek' and os.path.getsize(file_path) >= SEEK_SAMPLE_MIN_SIZE:
+        header, result = csv_parts.seek_sample(file_path, k, probes)
+        return header + ''.join(result)
+    records = csv_parts.iter_records(file_path)
+    header = next(records, '')
+    return header + ''.join(reservoir_sample(records, k))
+
+def sample_file(file_path:str, k:int, sampling_mode:str='reservoir', probes:int=SAMPLE_PROBES, as_text:bool=False) -> pd.DataFrame:
+    """Reads a random sample of k rows of a CSV file into a dataframe
+
+    Args:
+        file_path (str): the path of the file to sample
+        k (int): the number of random rows to sample
+        sampling_mode (str, optional): 'reservoir' scans every record of the file, 'seek' reads runs of rows from
+            random offsets. Files smaller than SEEK_SAMPLE_MIN_SIZE are always scanned.
+        probes (int, optional): the number of random offsets to read from in seek mode
+        as_text (bool, optional): whether to read every value as text instead of inferring the data types
+
+    Returns:
+        pd.DataFrame: the sampled rows
+    """
+    read_options = {'dtype': str, 'keep_default_na': False, 'na_filter': False} if as_text else {}
+    return pd.read_csv(StringIO(sample_records(file_path, k, sampling_mode, probes)), **read_options)
+
+def file_fingerprint(file_path:str) -> str:
+    """Fingerprints the layout of a file from its format and its header
+
+    The exact bytes of a CSV header are used, so a change to the columns, the delimiter, the quoting or the
+    line terminator changes the fingerprint. Parquet and Arrow files use their Arrow schema.
+    """
+    file_format = arrow_parts.get_file_format(file_path)
+    if file_format == 'csv':
+        with open(file_path, 'rb') as f:
+            head = f.read(HEADER_READ_SIZE)
+        layout = head[:csv_parts.find_record_end(head, 0, 0)]
+    else:
+        layout = str(arrow_parts.read_schema(file_path)).encode()
+    return hashlib.sha256(file_format.encode() + b'\n' + layout).hexdigest()
+
+def schema_cache_key(file_paths:list, dataset_id:str) -> str:
+    """Returns the schema cache key of the files uploaded to a dataset"""
+    fingerprints = sorted(set(file_fingerprint(file_path) for file_path in file_paths))
+    return hashlib.sha256(json.dumps(['inferred', dataset_id, fingerprints]).encode()).hexdigest()
+
+def infer_schema(file_name:str, folder_name, domo_instance:Domo, k=10000, sampling_mode:str='reservoir', probes:int=SAMPLE_PROBES,
+                 schema_cache:JsonCache=None, dataset_id:str=''):
     """ Will return the Domo schema and datatypes of a sampled pandas dataframe
 
     Args:
         filepath (str): the filepath of the file to read
         k (int): the number of random rows to sample
         domo_instance (Domo): the connection to Domo
+        sampling_mode (str): 'reservoir' or 'seek'. Seek sampling does not scan the whole file, trading some uniformity for speed
+        probes (int): the number of random offsets seek sampling reads from. More probes give a more uniform sample
+        schema_cache (JsonCache): when provided, a schema previously inferred for files with the same layout going to the same dataset is reused
+        dataset_id (str): the id of the dataset the files are uploaded to, if any
 
     Returns:
         Schema: Schema object of the dataset
     """
+    file_paths = [get_file_path(file, folder_name) for file in (file_name if isinstance(file_name, list) else [file_name])]
+    if schema_cache is not None:
+        cache_key = schema_cache_key(file_paths, dataset_id)
+        cached_schema = schema_cache.get(cache_key)
+        if cached_schema is not None:
+            print("Using the cached schema of files with the same layout")
+            return Schema(cached_schema)
+        schema = infer_schema(file_name, folder_name, domo_instance, k, sampling_mode, probes)
+        schema_cache.set(cache_key, schema['columns'])
+        return schema
+
+    if any(arrow_parts.is_arrow_file(file_path) for file_path in file_paths):
+        # Parquet and Arrow files carry their schema in their metadata, so nothing has to be sampled
+        return read_file_schema(file_paths)
+
     if isinstance(file_name, list):
-        dataframes = []
         n_files = len(file_name)
         rows_per_file = ceil(k/n_files)
-        for file in file_name:
-            file_path = file
-            if folder_name is not None:
-                file_path = os.path.normpath(os.path.join(os.getcwd(),folder_name,file)) 
-            with open(file_path, 'r') as f:
-                header = next(f)
-                result  = [header] + reservoir_sample(f, rows_per_file)
-            df = pd.read_csv(StringIO(''.join(result)))
-            dataframes.append(df)
+        probes_per_file = max(ceil(probes/n_files), 1)
+        # the files are sampled in parallel
+        with ThreadPoolExecutor(max_workers=min(n_files, SAMPLE_WORKERS)) as executor:
+            dataframes = list(executor.map(
+                lambda file_path: sample_file(file_path, rows_per_file, sampling_mode, probes_per_file), file_paths))
         merged = pd.concat(dataframes, axis = 0, ignore_index=True)
         schema = domo_instance.utilities.data_schema(merged)
         return Schema(schema)
 
     else:
-        file_path = file_name
-        if folder_name is not None:
-            file_path = os.path.normpath(os.path.join(os.getcwd(),folder_name,file_name))
-        with open(file_path, 'r') as f:
-            header = next(f)
-            result = [header] + reservoir_sample(f, k)
-        df = pd.read_csv(StringIO(''.join(result)))
+        df = sample_file(file_paths[0], k, sampling_mode, probes)
         schema = domo_instance.utilities.data_schema(df)
         return Schema(schema)
 
 
+def read_file_schema(file_paths:list):
+    """Reads the Domo schema of Parquet or Arrow IPC files from their metadata
+
+    Returns:
+        Schema: Schema object of the dataset
+    """
+    schemas = [arrow_parts.get_domo_schema(file_path) for file_path in file_paths]
+    if any(schema != schemas[0] for schema in schemas):
+        print("Error: The matched files do not all have the same columns and data types")
+        sys.exit(ec.EXIT_CODE_COLUMN_MISMATCH)
+    return Schema(schemas[0])
+
+
+def read_columns(file_path:str) -> list:
+    """Returns the column names of a CSV, Parquet or Arrow IPC file"""
+    if arrow_parts.is_arrow_file(file_path):
+        return arrow_parts.read_schema(file_path).names
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
 def make_schema(data_types:list, file_name:str, folder_name:str):
     """Constructs a domo schema which is required for the stream upload
 
@@ -137,8 +283,7 @@ def make_schema(data_types:list, file_name:str, folder_name:str):
             file_path = file
             if folder_name is not None:
                 file_path = os.path.normpath(os.path.join(os.getcwd(),folder_name,file))
-            df = pd.read_csv(file_path,nrows=1)
-            cols = list(df.columns)
+            cols = read_columns(file_path)
             if len(cols) != len(data_types):
                 print("Error: The number data types does not equal the number of columns. Please number of domo data types provided matches the number of columns")
                 sys.exit(ec.EXIT_CODE_COLUMN_MISMATCH)
@@ -160,8 +305,7 @@ def make_schema(data_types:list, file_name:str, folder_name:str):
         file_path = file_name
         if folder_name is not None:
             file_path = os.path.normpath(os.path.join(os.getcwd(),folder_name,file_name))
-        df = pd.read_csv(file_path,nrows=1)
-        cols = list(df.columns)
+        cols = read_columns(file_path)
         if len(cols) != len(data_types):
             print("Error: The number data types does not equal the number of columns. Please number of domo data types provided matches the number of columns")
             sys.exit(ec.EXIT_CODE_COLUMN_MISMATCH)
@@ -179,10 +323,471 @@ def make_schema(data_types:list, file_name:str, folder_name:str):
         return Schema(domo_schema)
 
 
+def require_pyarrow(file_names:list, folder_name:str=None):
+    """Exits if a Parquet or Arrow file is to be uploaded but pyarrow, which reads them, is not installed"""
+    arrow_files = [file_name for file_name in file_names if arrow_parts.is_arrow_file(file_name)]
+    if arrow_files and not arrow_parts.pyarrow_installed():
+        print(f"pyarrow is required to upload {get_file_path(arrow_files[0], folder_name)}. Please install it and try again")
+        sys.exit(ec.EXIT_CODE_UPLOAD_ERROR)
+
 def dataset_exists(datasets, dataset_name):
     return datasets.name.str.contains(dataset_name).any()
 
-def upload_stream(domo_instance:Domo, file_name:str, dataset_name:str, update_method:str, dataset_id:str, folder_name=None, dataset_description:str=None, domo_schema=None):
+def get_file_path(file_name:str, folder_name:str=None):
+    """Returns the path of a file relative to the working directory, joining the folder name if one is provided"""
+    if folder_name is not None:
+        return os.path.normpath(os.path.join(os.getcwd(),folder_name,file_name))
+    return file_name
+
+class PartSizer:
+    """Chooses the target size in bytes of each part
+
+    Starting from the target size, the size is tuned by hill climbing on the observed upload throughput of
+    each part: it keeps moving in the same direction while throughput improves and reverses when it drops.
+    The size always stays between a quarter and twice the target, so peak memory stays predictable
+    regardless of how wide the rows are.
+    """
+    STEP = 1.25
+
+    def __init__(self, target_size:int, adaptive:bool=True):
+        self.size = target_size
+        self.min_size = max(target_size // 4, 1024 * 1024)
+        self.max_size = max(target_size * 2, self.min_size)
+        self.adaptive = adaptive
+        self.direction = 1
+        self.last_throughput = None
+        self.lock = threading.Lock()
+
+    def __call__(self) -> int:
+        with self.lock:
+            return int(self.size)
+
+    def record(self, size:int, seconds:float):
+        """Records the upload of a part of the given size and adjusts the size of the next parts"""
+        if not self.adaptive or seconds <= 0:
+            return
+        throughput = size / seconds
+        with self.lock:
+            if self.last_throughput is not None and throughput < self.last_throughput:
+                self.direction = -self.direction
+            self.last_throughput = throughput
+            factor = self.STEP if self.direction > 0 else 1 / self.STEP
+            self.size = min(max(self.size * factor, self.min_size), self.max_size)
+
+def iter_source_parts(file_path:str, part_size, start:int=None):
+    """Splits a CSV, Parquet or Arrow IPC file into parts and yields the offset, length and CSV bytes of each part
+
+    CSV files are split on record boundaries and their offsets and lengths are in bytes. Parquet and Arrow
+    files are converted from their record batches and their offsets and lengths are in rows.
+    """
+    if arrow_parts.is_arrow_file(file_path):
+        yield from arrow_parts.iter_arrow_parts(file_path, part_size, start)
+    else:
+        for offset, data in csv_parts.iter_raw_parts(file_path, part_size, start):
+            yield offset, len(data), data
+
+def read_source_part(file_path:str, offset:int, length:int) -> bytes:
+    """Reads a part of a file previously yielded by iter_source_parts"""
+    if arrow_parts.is_arrow_file(file_path):
+        return arrow_parts.read_rows(file_path, offset, length)
+    return csv_parts.read_range(file_path, offset, length)
+
+def iter_file_parts(file_paths:list, part_size=PART_SIZE, checkpoint:UploadCheckpoint=None, read_workers:int=1,
+                    convert=None, progress:FileProgress=None):
+    """Splits the files into parts and yields the part number, file path and contents of each part
+
+    With a checkpoint, every part is recorded before it is yielded. When resuming, the recorded parts that
+    were never uploaded are yielded first with their original part numbers, then each file continues after
+    its last recorded part.
+
+    Args:
+        file_paths (list): The paths of the files to read
+        part_size (int | PartSizer, optional): The target size of each part in bytes
+        checkpoint (UploadCheckpoint, optional): The checkpoint to record the parts in and resume from
+        read_workers (int, optional): The number of files to read at the same time. Defaults to 1.
+        convert (callable, optional): Converts the file path and raw bytes of a part into the contents to upload
+        progress (FileProgress, optional): Records the parts read from each file
+    """
+    part_num = 0
+    if checkpoint is not None:
+        for part_num, part in checkpoint.pending_parts():
+            data = read_source_part(part['file'], part['offset'], part['length'])
+            if hashlib.md5(data).hexdigest() != part['md5']:
+                raise Exception(f"Part {part_num} read from {part['file']} does not match its checksum")
+            if progress is not None:
+                progress.read_part(part_num, part['file'], len(data))
+            yield part_num, part['file'], convert(part['file'], data) if convert is not None else data
+        part_num = checkpoint.last_part_num()
+    part_nums = PartCounter(part_num)
+    if read_workers > 1 and len(file_paths) > 1:
+        yield from iter_concurrent_file_parts(file_paths, part_size, part_nums, checkpoint, read_workers, convert, progress)
+        return
+    for file_path in file_paths:
+        for file_part in read_file_parts(file_path, part_size, part_nums, checkpoint, convert, progress):
+            yield file_part
+
+class PartCounter:
+    """Hands out consecutive part numbers to the threads reading the files"""
+
+    def __init__(self, last_part_num:int=0):
+        self.last_part_num = last_part_num
+        self.lock = threading.Lock()
+
+    def next(self, file_path:str, offset:int, length:int, data:bytes, checkpoint:UploadCheckpoint=None) -> int:
+        """Returns the next part number, recording the part in the checkpoint under the same lock so part numbers are never skipped"""
+        with self.lock:
+            self.last_part_num += 1
+            if checkpoint is not None:
+                checkpoint.add_part(self.last_part_num, file_path, offset, length, data)
+            return self.last_part_num
+
+def read_file_parts(file_path:str, part_size, part_nums:PartCounter, checkpoint:UploadCheckpoint=None, convert=None,
+                    progress:FileProgress=None):
+    """Splits a single file into parts and yields the part number, file path and contents of each part"""
+    start = checkpoint.file_offset(file_path) if checkpoint is not None else None
+    if progress is not None:
+        progress.start_file(file_path)
+    for offset, length, data in metrics.iterate('part.read', iter_source_parts(file_path, part_size, start)):
+        part_num = part_nums.next(file_path, offset, length, data, checkpoint)
+        if progress is not None:
+            progress.read_part(part_num, file_path, len(data))
+        yield part_num, file_path, convert(file_path, data) if convert is not None else data
+    if progress is not None:
+        progress.finish_file(file_path)
+
+def iter_concurrent_file_parts(file_paths:list, part_size, part_nums:PartCounter, checkpoint:UploadCheckpoint=None,
+                               read_workers:int=1, convert=None, progress:FileProgress=None):
+    """Reads several files at the same time and yields their parts as they become ready
+
+    Each reader thread takes the next file from a shared queue and reads it part by part, converting the
+    parts as it goes. Parts are handed over through a queue holding at most one part per reader, so no more
+    than twice as many parts as there are readers are in memory at once, however many files are matched.
+    If a reader fails, the other readers are stopped and the error is raised.
+    """
+    file_queue = queue.Queue()
+    for file_path in file_paths:
+        file_queue.put(file_path)
+    part_queue = queue.Queue(maxsize=read_workers)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                part_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read_files():
+        try:
+            while not stop.is_set():
+                try:
+                    file_path = file_queue.get_nowait()
+                except queue.Empty:
+                    break
+                for file_part in read_file_parts(file_path, part_size, part_nums, checkpoint, convert, progress):
+                    put(file_part)
+                    if stop.is_set():
+                        break
+        except Exception as e:
+            put(e)
+        put(finished)
+
+    readers = [threading.Thread(target=read_files, daemon=True) for _ in range(min(read_workers, len(file_paths)))]
+    for reader in readers:
+        reader.start()
+    try:
+        running = len(readers)
+        while running:
+            item = part_queue.get()
+            if item is finished:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+@lru_cache(maxsize=None)
+def read_header(file_path:str) -> list:
+    """Returns the column names of a CSV file, reading its header only once"""
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+def parse_part(file_path:str, data:bytes, pandas_dtypes:dict=None, validator:validation.SchemaValidator=None,
+               watermark:Watermark=None) -> str:
+    """Reads the raw part of a file with pandas and returns it as headerless CSV text
+
+    With a validator, every value is read as text and checked and coerced against the Domo schema instead of
+    being cast to the pandas data types. Parts converted from Parquet or Arrow files are already typed, so they
+    are returned without parsing. With a watermark, only the rows above it are returned.
+    """
+    if arrow_parts.is_arrow_file(file_path):
+        return filter_raw_part(file_path, data, watermark) if watermark is not None else data
+    if validator is not None:
+        with metrics.span('part.read_csv'):
+            chunk = pd.read_csv(BytesIO(data), header=None, names=read_header(file_path), dtype=str,
+                                keep_default_na=False, na_filter=False)
+        rows = len(chunk)
+        with metrics.span('part.validate'):
+            chunk = validator.validate(file_path, chunk)
+        metrics.count('rows.rejected', rows - len(chunk))
+    else:
+        with metrics.span('part.read_csv'):
+            chunk = pd.read_csv(BytesIO(data), header=None, names=read_header(file_path), dtype=pandas_dtypes)
+    if watermark is not None:
+        with metrics.span('part.watermark'):
+            chunk = watermark.apply(chunk)
+    metrics.count('rows.parsed', len(chunk))
+    with metrics.span('part.to_csv'):
+        return chunk.to_csv(index=False, header=False)
+
+def filter_raw_part(file_path:str, data:bytes, watermark:Watermark) -> bytes:
+    """Drops the records of a raw part at or below the watermark, keeping the part as it is when none are"""
+    names = read_columns(file_path) if arrow_parts.is_arrow_file(file_path) else read_header(file_path)
+    with metrics.span('part.watermark'):
+        return watermark.filter_csv(data, names)
+
+def load_watermark(store:JsonCache, dataset_id:str, domo_schema:list, column:str, domo_instance:Domo=None) -> Watermark:
+    """Loads the watermark of a column of the dataset. The column is matched by name to the schema and read by its position
+
+    The highest value of the column is queried from the dataset, falling back to the watermark recorded by the last upload
+    from this machine if the query fails.
+    """
+    names = [schema_column['name'] for schema_column in domo_schema]
+    if column not in names:
+        print(f"Error: The watermark column {column} is not a column of the dataset schema")
+        sys.exit(ec.EXIT_CODE_COLUMN_MISMATCH)
+    index = names.index(column)
+    domo_type = domo_schema[index]['type']
+    if domo_type not in WATERMARK_TYPES:
+        print(f"Error: The watermark column {column} is a {domo_type} column. Please choose a column of type {', '.join(WATERMARK_TYPES)}")
+        sys.exit(ec.EXIT_CODE_INVALID_DATA_TYPE)
+    datasets = domo_instance.datasets if domo_instance is not None else None
+    watermark = Watermark.load(store, dataset_id, column, index, domo_type, datasets)
+    if watermark.value is None:
+        print(f"Column {column} of dataset {dataset_id} has no watermark yet. Uploading every row")
+    else:
+        print(f"Uploading the rows where {column} is above {watermark.value}")
+    return watermark
+
+@metrics.timed('watermark.search')
+def find_watermark_starts(file_paths:list, watermark:Watermark) -> dict:
+    """Finds where the rows above the watermark start in CSV files sorted by the watermark column
+
+    The rows before that offset are never read. Parquet and Arrow files are filtered part by part instead.
+
+    Returns:
+        dict: The offset of the first row above the watermark in each CSV file
+    """
+    index = watermark.index
+    starts = {}
+    for file_path in file_paths:
+        if arrow_parts.is_arrow_file(file_path):
+            continue
+        # a record too short to hold the column stops the search, and the filter deals with it
+        starts[file_path] = csv_parts.find_first_record(
+            file_path, lambda row: len(row) <= index or watermark.is_above(row[index]))
+        print(f"Skipping the first {starts[file_path]} bytes of {file_path}, which are at or below the watermark")
+    return starts
+
+@metrics.timed('watermark.scan')
+def has_rows_above(file_paths:list, watermark:Watermark, starts:dict=None) -> bool:
+    """Whether any of the files has a row above the watermark, so that no execution is started for an empty upload
+
+    Files whose start was found by binary search have new rows if that start is before their end. Only the watermark
+    column of the other files is read, and the scan stops at the first new row.
+    """
+    starts = starts or {}
+    for file_path in file_paths:
+        if file_path in starts:
+            if starts[file_path] < os.path.getsize(file_path):
+                return True
+        elif arrow_parts.is_arrow_file(file_path):
+            if any(watermark.any_above(values) for values in arrow_parts.iter_column(file_path, watermark.index)):
+                return True
+        elif watermark.has_rows_above(file_path):
+            return True
+    return False
+
+@metrics.timed('preflight')
+def preflight_validation(file_paths:list, validator:validation.SchemaValidator, k:int=10000, sampling_mode:str='reservoir',
+                         probes:int=SAMPLE_PROBES):
+    """Checks a sample of the rows of every CSV file against the schema before the upload starts
+
+    A file that does not match its schema then fails before a stream execution is created. In strict mode any
+    invalid value fails the upload. In reject mode the upload only fails when every sampled row is invalid,
+    which means the schema does not fit the file at all.
+    """
+    csv_paths = [file_path for file_path in file_paths if not arrow_parts.is_arrow_file(file_path)]
+    if not csv_paths:
+        return
+    rows_per_file = ceil(k/len(csv_paths))
+    probes_per_file = max(ceil(probes/len(csv_paths)), 1)
+    with ThreadPoolExecutor(max_workers=min(len(csv_paths), SAMPLE_WORKERS)) as executor:
+        samples = list(executor.map(
+            lambda file_path: sample_file(file_path, rows_per_file, sampling_mode, probes_per_file, as_text=True), csv_paths))
+    for file_path, sample in zip(csv_paths, samples):
+        try:
+            _, rejected, messages = validator.check(sample)
+        except validation.ValidationError as e:
+            print(f"Error: {file_path} does not match the schema. {e}")
+            sys.exit(ec.EXIT_CODE_COLUMN_MISMATCH)
+        if not rejected.any():
+            continue
+        for message in messages:
+            print(f"{file_path}: {message}")
+        if validator.mode == 'strict' or rejected.all():
+            print(f"Error: {rejected.sum()} of {len(sample)} sampled rows of {file_path} do not match the schema")
+            sys.exit(ec.EXIT_CODE_INVALID_DATA_TYPE)
+        print(f"{rejected.sum()} of {len(sample)} sampled rows of {file_path} do not match the schema and will be rejected")
+
+@metrics.timed('part.upload')
+def upload_part(streams, stream_id, execution_id, part_num:int, part):
+    """Uploads a single part, which can either be CSV text or the raw bytes of a CSV file"""
+    metrics.count('parts.uploaded')
+    metrics.count('bytes.uploaded', len(part))
+    if isinstance(part, bytes):
+        part = BytesIO(part)
+    return streams.upload_part(stream_id, execution_id, part_num, part)
+
+def compress_part(part, compression_level:int):
+    """Gzip-compresses a part. This runs in a worker process so compression does not hold up the uploads
+
+    Returns:
+        tuple: The compressed bytes, the size of the part before compression and the seconds spent compressing
+    """
+    start = time.perf_counter()
+    if isinstance(part, str):
+        part = part.encode()
+    compressed = gzip.compress(part, compresslevel=compression_level)
+    return compressed, len(part), time.perf_counter() - start
+
+def upload_gzip_part(streams, stream_id, execution_id, part_num:int, compression):
+    """Uploads a single part once its compression has finished and reports the bytes saved
+
+    Args:
+        compression (Future): The pending result of compress_part
+    """
+    compressed, size, compression_time = compression.result()
+    # compression runs in another process, so it reports its own timing
+    metrics.observe('part.compress', compression_time)
+    metrics.count('parts.uploaded')
+    metrics.count('bytes.uploaded', len(compressed))
+    url = f'/v1/streams/{stream_id}/executions/{execution_id}/part/{part_num}'
+    with metrics.span('part.upload'):
+        response = streams.transport.put_gzip(url, compressed)
+    if response.status_code != requests.codes.ok:
+        raise Exception(f"Error uploading part {part_num}: {response.text}")
+    print(f"Part {part_num}: compressed {size} bytes to {len(compressed)} bytes, saving {size - len(compressed)} bytes in {compression_time:.3f} seconds")
+
+def timed_upload(part_sizer:PartSizer, size:int, upload, *args):
+    """Runs an upload function and records how long it took with the part sizer"""
+    start = time.perf_counter()
+    upload(*args)
+    if part_sizer is not None:
+        part_sizer.record(size, time.perf_counter() - start)
+
+def upload_parts(streams, stream_id, execution_id, parts, upload_workers:int=1, compression_level:int=None, part_sizer:PartSizer=None, checkpoint:UploadCheckpoint=None, abort_on_error:bool=True,
+                 progress:FileProgress=None):
+    """Uploads the parts of a stream execution using a bounded pool of worker threads
+
+    Part numbers are assigned when the parts are read, so they do not depend on which worker finishes first. At most twice as many parts as there are workers are held in memory at once. If a part
+    fails to upload, the remaining parts are cancelled and the execution is aborted.
+
+    When a compression level is given, the parts are gzip-compressed in a pool of worker processes before
+    they are uploaded.
+
+    Args:
+        streams (StreamClient): The Domo streams client
+        stream_id (int): The id of the stream
+        execution_id (int): The id of the stream execution
+        parts (iterable): The part number and the CSV text or bytes of each part
+        upload_workers (int, optional): The number of parts to upload concurrently. Defaults to 1.
+        compression_level (int, optional): The gzip compression level from 0 to 9. Parts are not compressed if omitted.
+        part_sizer (PartSizer, optional): Records the upload time of each part to adapt the size of the next parts
+        checkpoint (UploadCheckpoint, optional): Marks each part as uploaded once Domo has accepted it
+        abort_on_error (bool, optional): Whether to abort the execution when a part fails. Defaults to True.
+        progress (FileProgress, optional): Records each uploaded part against the file it was read from
+
+    Returns:
+        int: The number of parts uploaded
+    """
+    upload_workers = max(upload_workers, 1)
+    max_pending = upload_workers * 2
+    pending = {}
+    uploaded = 0
+    failed_part = None
+    executor = ThreadPoolExecutor(max_workers=upload_workers)
+    compressor = ProcessPoolExecutor() if compression_level is not None else None
+
+    def complete(future):
+        nonlocal failed_part, uploaded
+        failed_part = pending.pop(future)
+        future.result()
+        if checkpoint is not None:
+            checkpoint.complete_part(failed_part)
+        if progress is not None:
+            progress.complete_part(failed_part)
+        failed_part = None
+        uploaded += 1
+
+    try:
+        for part_num, part in parts:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    complete(future)
+            if not part:
+                # the watermark filtered out every row of the part, so there is nothing to upload
+                if checkpoint is not None:
+                    checkpoint.complete_part(part_num)
+                if progress is not None:
+                    progress.complete_part(part_num)
+                continue
+            if compressor is not None:
+                compression = compressor.submit(compress_part, part, compression_level)
+                future = executor.submit(timed_upload, part_sizer, len(part), upload_gzip_part,
+                                         streams, stream_id, execution_id, part_num, compression)
+            else:
+                future = executor.submit(timed_upload, part_sizer, len(part), upload_part,
+                                         streams, stream_id, execution_id, part_num, part)
+            pending[future] = part_num
+        for future in list(pending):
+            complete(future)
+    except Exception as e:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if compressor is not None:
+            compressor.shutdown(wait=True)
+        if failed_part is not None:
+            print(f"Error in uploading part {failed_part} of execution {execution_id}")
+        else:
+            print(f"Error in reading the parts of execution {execution_id}")
+        print(e)
+        exit_code = ec.EXIT_CODE_INVALID_DATA_TYPE if isinstance(e, validation.ValidationError) else ec.EXIT_CODE_UPLOAD_ERROR
+        if abort_on_error:
+            print(f"Aborting execution {execution_id}")
+            try:
+                streams.abort_execution(stream_id, execution_id)
+            except Exception as abort_error:
+                print(f"Error in aborting execution {execution_id}: {abort_error}")
+        else:
+            print(f"Execution {execution_id} was left open. Run the upload again with --resume TRUE to upload the remaining parts")
+        sys.exit(exit_code)
+    executor.shutdown(wait=True)
+    if compressor is not None:
+        compressor.shutdown(wait=True)
+    return uploaded
+
+def upload_stream(domo_instance:Domo, file_name:str, dataset_name:str, update_method:str, dataset_id:str, folder_name=None, dataset_description:str=None, domo_schema=None, upload_workers:int=1, upload_mode:str='parse', compression_level:int=None, part_size:int=PART_SIZE, adaptive_part_size:bool=True, manifest_path:str=None, resume:bool=False, schema_cache:JsonCache=None,
+                  read_workers:int=1, progress_path:str=None, validation_mode:str='off', reject_path:str=None, sample_rows:int=10000,
+                  sampling_mode:str='reservoir', sample_probes:int=SAMPLE_PROBES, watermark_column:str=None,
+                  watermark_sorted:bool=False):
     """Uploads the dataset using the Stream API
 
     Args:
@@ -194,9 +799,122 @@ def upload_stream(domo_instance:Domo, file_name:str, dataset_name:str, update_me
         folder_name (_type_, optional): The name of the folder path if applicable
         dataset_description (str, optional): Optional description of the dataset 
         domo_schema (_type_, optional): Optional schema of the dataset. If omitted, then the data types will be inferred using sampling
+        upload_workers (int, optional): The number of parts to upload concurrently. Defaults to 1.
+        upload_mode (str, optional): 'parse' reads the files with pandas, 'raw' uploads the file contents as they are. Defaults to 'parse'.
+        compression_level (int, optional): The gzip compression level of the parts. Parts are uploaded uncompressed if omitted.
+        part_size (int, optional): The target size of each part in bytes. Defaults to 50 MB.
+        adaptive_part_size (bool, optional): Whether to tune the part size from the upload throughput. Defaults to True.
+        manifest_path (str, optional): The path of the checkpoint manifest recording the uploaded parts
+        resume (bool, optional): Whether to resume the execution recorded in the manifest, uploading only the missing parts. With a
+            manifest, a failed upload leaves its execution open so the next run can resume it, and a run that does not resume it
+            aborts it before starting a new one. Defaults to False.
+        schema_cache (JsonCache, optional): The cache recording the schemas already synced to existing datasets
+        read_workers (int, optional): The number of matched files to read at the same time. Defaults to 1.
+        progress_path (str, optional): The path of the JSON summary of the parts read and uploaded from each file
+        validation_mode (str, optional): 'strict' fails on values that do not match the schema, 'reject' writes the rows holding them
+            to the reject file and uploads the others, 'off' leaves the values to Domo. A sample of every file is checked before the
+            upload starts. In raw mode only the sample is checked. Defaults to 'off'.
+        reject_path (str, optional): The path of the CSV file the rejected rows are written to
+        sample_rows (int, optional): The number of rows sampled to check the files before the upload
+        sampling_mode (str, optional): 'reservoir' or 'seek', how the rows checked before the upload are sampled
+        sample_probes (int, optional): The number of random offsets seek sampling reads from
+        watermark_column (str, optional): A monotonically increasing key or timestamp column. Only the rows above the highest value
+            of the column in the dataset are uploaded, and no execution is started if there are none. If the dataset cannot be queried,
+            the highest value recorded by the last upload from this machine is used, which is missing on a new worker and stale if the
+            dataset was replaced since.
+        watermark_sorted (bool, optional): Whether the CSV files are sorted by the watermark column, so the rows at or below the watermark
+            are found by binary search and never read. Defaults to False.
+
+    Returns:
+        tuple: The stream id and the execution id, both None if no row is above the watermark
     """
     file_path = file_name
     streams = domo_instance.streams
+    # if the regex match is selected, load all the files to a single domo dataset
+    if isinstance(file_name, list):
+        file_paths = [get_file_path(file, folder_name) for file in file_name]
+    # otherwise load a single file
+    else:
+        file_paths = [get_file_path(file_path, folder_name)]
+
+    validator = None
+    watermark = None
+    if watermark_column is not None:
+        watermark_store = Watermark.store()
+        watermark = load_watermark(watermark_store, dataset_id, domo_schema['columns'], watermark_column, domo_instance)
+    checkpoint = UploadCheckpoint.load(manifest_path)
+    if resume and checkpoint is not None and checkpoint.can_resume(streams, file_paths):
+        stream_id = checkpoint.stream_id
+        execution_id = checkpoint.execution_id
+        pandas_dtypes = map_domo_to_pandas(domo_schema['columns']) if dataset_id != '' else None
+        if validation_mode != 'off':
+            # the rows rejected by the interrupted run stay in the reject file
+            validator = validation.SchemaValidator(domo_schema['columns'], validation_mode,
+                                                   validation.RejectWriter(reject_path, append=True))
+        print(f"Resuming execution {execution_id} of stream {stream_id} after {checkpoint.last_part_num()} parts")
+    else:
+        if checkpoint is not None:
+            checkpoint.discard(streams)
+        if validation_mode != 'off':
+            validator = validation.SchemaValidator(domo_schema['columns'], validation_mode,
+                                                   validation.RejectWriter(reject_path))
+            preflight_validation(file_paths, validator, sample_rows, sampling_mode, sample_probes)
+        starts = {}
+        if watermark is not None and watermark.value is not None:
+            if watermark_sorted:
+                starts = find_watermark_starts(file_paths, watermark)
+            if not has_rows_above(file_paths, watermark, starts):
+                print(f"No rows are above the watermark of column {watermark_column}. Nothing to upload")
+                return None, None
+        stream_id, execution_id, pandas_dtypes = start_execution(domo_instance, dataset_name, update_method,
+                                                                 dataset_id, dataset_description, domo_schema, schema_cache)
+        checkpoint = UploadCheckpoint(manifest_path, stream_id, execution_id, file_paths)
+        checkpoint.compact()
+        for file_path, offset in starts.items():
+            checkpoint.skip_to(file_path, offset)
+
+    # Load the data into domo by chunks and parts
+    part_sizer = PartSizer(part_size, adaptive_part_size)
+    if upload_mode == 'raw':
+        convert = partial(filter_raw_part, watermark=watermark) if watermark is not None else None
+    else:
+        convert = partial(parse_part, pandas_dtypes=pandas_dtypes, validator=validator, watermark=watermark)
+    progress = FileProgress(progress_path, file_paths)
+    file_parts = iter_file_parts(file_paths, part_sizer, checkpoint, read_workers, convert, progress)
+    parts = ((part_num, data) for part_num, _, data in file_parts)
+    try:
+        upload_parts(streams, stream_id, execution_id, parts, upload_workers, compression_level, part_sizer, checkpoint,
+                     abort_on_error=manifest_path is None, progress=progress)
+    finally:
+        progress.save()
+    if validator is not None and validator.reject_writer.rows:
+        print(f"{validator.reject_writer.rows} rows did not match the schema and were written to {reject_path}")
+    if watermark is not None and watermark.skipped:
+        print(f"{watermark.skipped} rows read were at or below the watermark of column {watermark_column}, or had no value, and were skipped")
+
+    # commit the stream 
+    with metrics.span('execution.commit'):
+        commited_execution = streams.commit_execution(stream_id,execution_id)
+    checkpoint.commit()
+    print("Successfully loaded dataset to domo")
+    if watermark is not None and watermark.new_value != watermark.value:
+        # the watermark only moves once the rows below it are committed, so a failed upload sends them again
+        watermark.save(watermark_store, dataset_id)
+        print(f"The watermark of column {watermark_column} is now {watermark.new_value}")
+    return stream_id, execution_id
+
+@metrics.timed('execution.start')
+def start_execution(domo_instance:Domo, dataset_name:str, update_method:str, dataset_id:str, dataset_description:str=None, domo_schema=None,
+                    schema_cache:JsonCache=None):
+    """Creates or updates the stream of the dataset and starts a new execution on it
+
+    When a schema cache is provided, the check of the schema of an existing dataset is skipped if a previous
+    upload already synced the same schema to it.
+
+    Returns:
+        tuple: The stream id, the execution id and the pandas data types of the existing dataset, if any
+    """
+    streams = domo_instance.streams
     dsr = DataSetRequest()
     dsr.name = dataset_name
     dsr.schema = domo_schema
@@ -204,14 +922,20 @@ def upload_stream(domo_instance:Domo, file_name:str, dataset_name:str, update_me
         dsr.description = dataset_description
 
     if dataset_id != '': # if a dataset id has been provided, meaning an existing dataset will be modified
-        # check to see if the schemas are identical
-        schema_in_domo = domo_instance.utilities.domo_schema(dataset_id)
         dataset_schema = domo_schema['columns']
         pandas_dtypes = map_domo_to_pandas(dataset_schema)
-        if not domo_instance.utilities.identical(c1=schema_in_domo, c2 = dataset_schema):
-            url = '/v1/datasets/{ds}'.format(ds=dataset_id)
-            change_result = domo_instance.transport.put(url,{'schema': {'columns': dataset_schema}})
-            print("Schema updated")
+        # check to see if the schemas are identical, unless a previous upload already synced this schema
+        sync_key = 'synced:' + dataset_id + ':' + hashlib.sha256(json.dumps(dataset_schema).encode()).hexdigest()
+        if schema_cache is not None and schema_cache.get(sync_key):
+            print("The dataset schema was synced by a previous upload")
+        else:
+            schema_in_domo = domo_instance.utilities.domo_schema(dataset_id)
+            if not domo_instance.utilities.identical(c1=schema_in_domo, c2 = dataset_schema):
+                url = '/v1/datasets/{ds}'.format(ds=dataset_id)
+                change_result = domo_instance.transport.put(url,{'schema': {'columns': dataset_schema}})
+                print("Schema updated")
+            if schema_cache is not None:
+                schema_cache.set(sync_key, True)
         stream_property = 'dataSource.id:' + dataset_id
         stream_id = streams.search(stream_property)[0]['id']
         stream_request = CreateStreamRequest(dsr, update_method)
@@ -227,27 +951,12 @@ def upload_stream(domo_instance:Domo, file_name:str, dataset_name:str, update_me
 
     execution = streams.create_execution(stream_id)
     execution_id = execution['id']
-
-    # if the regex match is selected, load all the files to a single domo dataset
-    if isinstance(file_name, list):
-        index = 0
-        for file in file_name:
-            for part, chunk in enumerate(pd.read_csv(file, chunksize= CHUNKSIZE, dtype = pandas_dtypes),start = 1):
-                index += 1
-                execution = streams.upload_part(stream_id, execution_id, index, chunk.to_csv(index = False, header = False))
-    # otherwise load a single file
-    else:
-        # Load the data into domo by chunks and parts
-        for part, chunk in enumerate(pd.read_csv(file_path,chunksize=CHUNKSIZE,dtype=pandas_dtypes),start = 1):
-            execution = streams.upload_part(stream_id, execution_id,part,chunk.to_csv(index=False, header = False))
-
-    # commit the stream 
-    commited_execution = streams.commit_execution(stream_id,execution_id)
-    print("Successfully loaded dataset to domo")
-    return stream_id, execution_id
+    return stream_id, execution_id, pandas_dtypes
 
 def main():
     args = get_args()
+    if args.metrics == 'TRUE' or args.metrics_textfile:
+        metrics.enable('upload_csv_to_dataset', args.metrics_textfile, args.metrics_format)
     client_id = args.client_id
     secret = args.secret_key
     file_to_load = args.file_name
@@ -257,58 +966,92 @@ def main():
     insert_method = args.insert_method
     dataset_id = args.dataset_id
     match_type = args.source_file_match_type
+    upload_workers = args.upload_workers
+    upload_mode = args.upload_mode
+    read_workers = args.read_workers
+    compression_level = args.compression_level if args.compression == 'gzip' else None
+    part_size = args.part_size_mb * 1024 * 1024
+    adaptive_part_size = args.adaptive_part_size == 'TRUE'
+    resume = args.resume == 'TRUE'
+    sampling_mode = args.sampling_mode
+    sample_rows = args.sample_rows
+    sample_probes = args.sample_probes
+    schema_cache = None
+    if args.schema_cache == 'TRUE':
+        schema_cache = JsonCache('schemas', args.schema_cache_ttl_hours * 3600)
     if args.domo_schema != '':
         domo_schema = args.domo_schema
         domo_schema = ast.literal_eval(domo_schema)
     
     try:
-        domo = Domo(
+        domo = connect_domo(
             client_id,
             secret,
-            api_host='api.domo.com'
+            api_host='api.domo.com',
+            token_cache=args.token_cache == 'TRUE'
         )
     except Exception as e:
         print(
             'The client_id or secret_key you provided were invalid. Please check for typos and try again.')
         print(e)
         sys.exit(ec.EXIT_CODE_INVALID_CREDENTIALS)
-    
+
+    base_folder_name = shipyard.logs.determine_base_artifact_folder(
+        'domo')
+    artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(
+        base_folder_name)
+    shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
+    manifest_path = shipyard.files.combine_folder_and_file_name(
+        artifact_subfolder_paths['artifacts'], 'upload_checkpoint.json')
+    progress_path = shipyard.files.combine_folder_and_file_name(
+        artifact_subfolder_paths['artifacts'], 'upload_progress.json')
+    reject_path = shipyard.files.combine_folder_and_file_name(
+        artifact_subfolder_paths['artifacts'], 'upload_rejects.csv')
+
     if match_type == 'regex_match':
         file_names = shipyard.files.find_all_local_file_names(
         folder_name)
         matching_file_names = shipyard.files.find_all_file_matches(
         file_names, re.compile(file_to_load))
         print(f'{len(matching_file_names)} files found. Preparing to upload...')
+        require_pyarrow(matching_file_names, folder_name)
         # if the schema is provided, then use that otherwise infer the schema using sampling
-        if args.domo_schema != '':
-            dataset_schema = make_schema(domo_schema, matching_file_names, folder_name)
-        else:
-            dataset_schema = infer_schema(matching_file_names, folder_name, domo, k = 10000)
+        with metrics.span('schema'):
+            if args.domo_schema != '':
+                dataset_schema = make_schema(domo_schema, matching_file_names, folder_name)
+            else:
+                dataset_schema = infer_schema(matching_file_names, folder_name, domo, k = sample_rows,
+                                              sampling_mode = sampling_mode, probes = sample_probes,
+                                              schema_cache = schema_cache, dataset_id = dataset_id)
         stream_id, execution_id = upload_stream(domo, matching_file_names, dataset_name,
                                                 insert_method, dataset_id, 
-                                                folder_name, dataset_description, dataset_schema)
-        base_folder_name = shipyard.logs.determine_base_artifact_folder(
-            'domo')
-        artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(
-            base_folder_name)
-        shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
-        shipyard.logs.create_pickle_file(artifact_subfolder_paths, 'stream_id', stream_id)
-        shipyard.logs.create_pickle_file(artifact_subfolder_paths, 'execution_id', execution_id)
+                                                folder_name, dataset_description, dataset_schema,
+                                                upload_workers, upload_mode, compression_level,
+                                                part_size, adaptive_part_size, manifest_path, resume,
+                                                schema_cache, read_workers, progress_path,
+                                                args.validation, reject_path, sample_rows,
+                                                sampling_mode, sample_probes, args.watermark_column,
+                                                args.watermark_sorted == 'TRUE')
 
     else:
+        require_pyarrow([file_to_load], folder_name)
         # if the schema is provided, then use that otherwise infer the schema using sampling
-        if args.domo_schema != '':
-            dataset_schema = make_schema(domo_schema, file_to_load, folder_name)
-        else:
-            dataset_schema = infer_schema(file_to_load, folder_name, domo, k = 10000)
+        with metrics.span('schema'):
+            if args.domo_schema != '':
+                dataset_schema = make_schema(domo_schema, file_to_load, folder_name)
+            else:
+                dataset_schema = infer_schema(file_to_load, folder_name, domo, k = sample_rows,
+                                              sampling_mode = sampling_mode, probes = sample_probes,
+                                              schema_cache = schema_cache, dataset_id = dataset_id)
         stream_id, execution_id = upload_stream(domo, file_to_load, dataset_name,insert_method, dataset_id, 
-            folder_name, dataset_description, dataset_schema)
+            folder_name, dataset_description, dataset_schema, upload_workers, upload_mode,
+            compression_level, part_size, adaptive_part_size, manifest_path, resume, schema_cache,
+            progress_path=progress_path, validation_mode=args.validation, reject_path=reject_path,
+            sample_rows=sample_rows, sampling_mode=sampling_mode, sample_probes=sample_probes,
+            watermark_column=args.watermark_column, watermark_sorted=args.watermark_sorted == 'TRUE')
 
-        base_folder_name = shipyard.logs.determine_base_artifact_folder(
-            'domo')
-        artifact_subfolder_paths = shipyard.logs.determine_artifact_subfolders(
-            base_folder_name)
-        shipyard.logs.create_artifacts_folders(artifact_subfolder_paths)
+    # nothing is uploaded when no row is above the watermark
+    if stream_id is not None:
         shipyard.logs.create_pickle_file(artifact_subfolder_paths, 'stream_id', stream_id)
         shipyard.logs.create_pickle_file(artifact_subfolder_paths, 'execution_id', execution_id)
 
@@ -0,0 +1,243 @@
+import os
+import csv
+import warnings
+import threading
+import numpy as np
+import pandas as pd
+
+VALIDATION_MODES = ['off', 'strict', 'reject']
+TRUE_VALUES = ['true', 't', 'yes', 'y', '1']
+FALSE_VALUES = ['false', 'f', 'no', 'n', '0']
+MAX_REPORTED_VALUES = 5 # invalid values listed in an error message
+LONG_LIMIT = 2 ** 63
+DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+SUBSECOND_UNITS = ['ms', 'us', 'ns'] # precisions tried for times with fractional seconds, coarsest first
+# the text pandas reads as missing by default, which is how the types of inferred schemas were sampled
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+             'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+class ValidationError(ValueError):
+    """Raised in strict mode when a value cannot be coerced to the Domo type of its column"""
+
+
+def is_na_token(values:pd.Series) -> np.ndarray:
+    """Flags the spellings of missing values such as NA, NULL or nan that pandas reads as nulls by default"""
+    return values.isin(NA_VALUES).to_numpy()
+
+
+def coerce_long(values:pd.Series, present:np.ndarray):
+    """Coerces integers, including integral decimals such as 1.0 or 1e3, and flags every other value
+
+    Spellings of missing values such as NA or NULL are nulls.
+    """
+    present = present & ~is_na_token(values)
+    numbers = pd.to_numeric(values, errors='coerce')
+    if pd.api.types.is_integer_dtype(numbers) and not numbers.isna().any():
+        return numbers, np.zeros(len(values), dtype=bool)
+    floats = numbers.to_numpy(dtype='float64', na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        integral = np.isfinite(floats) & (np.mod(floats, 1) == 0) & (np.abs(floats) < LONG_LIMIT)
+    invalid = present & ~integral
+    integers = np.zeros(len(values), dtype='int64')
+    integers[integral] = floats[integral].astype('int64')
+    # values written as integers are parsed again on their own, so those too large for a float keep every digit
+    plain = integral & values.astype(str).str.fullmatch(r'\s*[+-]?\d+\s*').to_numpy(dtype=bool)
+    if plain.any():
+        integers[plain] = pd.to_numeric(values[plain]).to_numpy(dtype='int64')
+    coerced = pd.Series(pd.arrays.IntegerArray(integers, ~integral), index=values.index)
+    return coerced, invalid
+
+
+def coerce_decimal(values:pd.Series, present:np.ndarray):
+    """Flags values that are not finite numbers. Valid values keep their text, so no precision is lost
+
+    Spellings of missing values such as NA or NULL are nulls and are emptied.
+    """
+    missing = is_na_token(values)
+    if missing.any():
+        values = values.mask(missing, '')
+    numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    return values, present & ~missing & ~np.isfinite(numbers)
+
+
+def parse_datetimes(values:pd.Series) -> pd.Series:
+    """Parses dates and times, trying the fast parsers before the slow one
+
+    ISO 8601 values are parsed first. The values left over are parsed with the format of the first of
+    them, which covers files written in a single non-ISO format, and only the values that still fail are
+    parsed one by one. Values with a UTC offset are converted to UTC.
+    """
+    parsed = pd.to_datetime(values, errors='coerce', utc=True, format='ISO8601')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for date_format in [None, 'mixed']:
+            retry = parsed.isna().to_numpy()
+            if not retry.any():
+                break
+            parsed[retry] = pd.to_datetime(values[retry], errors='coerce', utc=True, format=date_format)
+    return parsed.dt.tz_localize(None)
+
+
+def coerce_datetime(values:pd.Series, present:np.ndarray, unit:str='s'):
+    """Coerces dates and times to the form Domo expects, YYYY-MM-DD for days or YYYY-MM-DD HH:MM:SS for seconds
+
+    Values already in that form are kept as they are, so only the other values are parsed and formatted again.
+    Times with fractional seconds keep them, to the millisecond, microsecond or nanosecond.
+    """
+    domo_format = DATE_FORMAT if unit == 'D' else DATETIME_FORMAT
+    canonical = pd.to_datetime(values, errors='coerce', format=domo_format).notna().to_numpy()
+    rest = present & ~canonical
+    if not rest.any():
+        return values, rest
+    parsed = parse_datetimes(values[rest])
+    missing = parsed.isna().to_numpy()
+    times = parsed.to_numpy()
+    text = np.datetime_as_string(times.astype(f'datetime64[{unit}]'), unit=unit).astype(object)
+    if unit != 'D':
+        left = ~missing & (times != times.astype('datetime64[s]'))
+        for subsecond_unit in SUBSECOND_UNITS:
+            if not left.any():
+                break
+            exact = left & (times.astype(f'datetime64[{subsecond_unit}]') == times)
+            text[exact] = np.datetime_as_string(times[exact], unit=subsecond_unit)
+            left &= ~exact
+    text = np.char.replace(text.astype(str), 'T', ' ').astype(object)
+    text[missing] = ''
+    coerced = values.to_numpy(dtype=object, copy=True)
+    coerced[rest] = text
+    invalid = np.zeros(len(values), dtype=bool)
+    invalid[rest] = missing
+    return pd.Series(coerced, index=values.index), invalid
+
+
+def coerce_boolean(values:pd.Series, present:np.ndarray):
+    """Coerces the usual spellings of true and false to true and false"""
+    lowered = values.str.strip().str.lower()
+    is_true = lowered.isin(TRUE_VALUES).to_numpy()
+    is_false = lowered.isin(FALSE_VALUES).to_numpy()
+    coerced = np.where(is_true, 'true', np.where(is_false, 'false', ''))
+    return pd.Series(coerced, index=values.index), present & ~(is_true | is_false)
+
+
+COERCIONS = {
+    'LONG': coerce_long,
+    'DECIMAL': coerce_decimal,
+    'DOUBLE': coerce_decimal,
+    'DATE': lambda values, present: coerce_datetime(values, present, 'D'),
+    'DATETIME': coerce_datetime,
+    'BOOLEAN': coerce_boolean
+}
+
+
+def coerce_chunk(chunk:pd.DataFrame, domo_types:list):
+    """Coerces every column of a chunk read as text to its Domo type, a whole column at a time
+
+    Columns are matched to the schema by position, the way Domo reads the parts of a stream. Empty values
+    are nulls and are valid for every type.
+
+    Args:
+        chunk (pd.DataFrame): The rows to check, with every value read as text
+        domo_types (list): The Domo data type of each column
+
+    Returns:
+        tuple: The coerced chunk and, for each column with invalid values, a mask of the rows holding them
+    """
+    if len(chunk.columns) != len(domo_types):
+        raise ValidationError(f"The file has {len(chunk.columns)} columns but the schema has {len(domo_types)}")
+    coerced = {}
+    invalid = {}
+    for name, domo_type in zip(chunk.columns, domo_types):
+        values = chunk[name]
+        coerce = COERCIONS.get(domo_type)
+        if coerce is None:
+            coerced[name] = values
+            continue
+        if values.hasnans:
+            values = values.fillna('')
+        present = (values != '').to_numpy()
+        coerced[name], column_invalid = coerce(values, present)
+        if column_invalid.any():
+            invalid[name] = column_invalid
+    return pd.DataFrame(coerced, index=chunk.index), invalid
+
+
+def describe_invalid(chunk:pd.DataFrame, invalid:dict, domo_types:dict) -> list:
+    """Describes the first few invalid values of each column"""
+    messages = []
+    for name, mask in invalid.items():
+        values = chunk[name][mask]
+        examples = ', '.join(repr(value) for value in values.head(MAX_REPORTED_VALUES))
+        messages.append(f"{mask.sum()} values of column {name} are not valid {domo_types[name]} values: {examples}")
+    return messages
+
+
+class RejectWriter:
+    """Appends rejected rows to a CSV file, with the file they came from and the columns that were invalid
+
+    Parts are converted by several reader threads, so writes are serialized. Without a path the rows are
+    only counted.
+    """
+
+    def __init__(self, reject_path:str, append:bool=False):
+        self.reject_path = reject_path
+        self.append = append
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def write(self, file_path:str, rows:pd.DataFrame, reasons:pd.Series):
+        rows = rows.assign(_source_file=file_path, _invalid_columns=reasons.to_numpy())
+        with self.lock:
+            self.rows += len(rows)
+            if self.reject_path is None:
+                return
+            # the file is only created once a row is rejected, and is replaced unless an upload is resumed
+            header = not (self.append and os.path.exists(self.reject_path))
+            rows.to_csv(self.reject_path, mode='a' if self.append else 'w', index=False, header=header,
+                        quoting=csv.QUOTE_MINIMAL)
+            self.append = True
+
+
+class SchemaValidator:
+    """Checks and coerces the parts of an upload against the Domo schema of the dataset
+
+    In strict mode, the first invalid value stops the upload. In reject mode, rows with an invalid value are
+    removed from the part and written to a reject file, and the other rows are uploaded.
+    """
+
+    def __init__(self, domo_schema:list, mode:str='strict', reject_writer:RejectWriter=None):
+        self.domo_types = [column['type'] for column in domo_schema]
+        self.mode = mode
+        self.reject_writer = reject_writer if reject_writer is not None else RejectWriter(None)
+
+    def check(self, chunk:pd.DataFrame):
+        """Coerces a chunk and finds its invalid values without acting on them
+
+        Returns:
+            tuple: The coerced chunk, a mask of the rows with an invalid value and the descriptions of the invalid values
+        """
+        coerced, invalid = coerce_chunk(chunk, self.domo_types)
+        if not invalid:
+            return coerced, np.zeros(len(chunk), dtype=bool), []
+        rejected = np.logical_or.reduce(list(invalid.values()))
+        return coerced, rejected, describe_invalid(chunk, invalid, dict(zip(chunk.columns, self.domo_types)))
+
+    def validate(self, file_path:str, chunk:pd.DataFrame) -> pd.DataFrame:
+        """Returns the coerced rows of a chunk that can be uploaded
+
+        Raises:
+            ValidationError: in strict mode, if any value is invalid
+        """
+        coerced, invalid = coerce_chunk(chunk, self.domo_types)
+        if not invalid:
+            return coerced
+        if self.mode == 'strict':
+            messages = describe_invalid(chunk, invalid, dict(zip(chunk.columns, self.domo_types)))
+            raise ValidationError(f"Invalid values in {file_path}: " + '; '.join(messages))
+        rejected = np.logical_or.reduce(list(invalid.values()))
+        reasons = np.full(rejected.sum(), '', dtype=object)
+        for name, mask in invalid.items():
+            reasons = np.where(mask[rejected], reasons + name + ';', reasons)
+        self.reject_writer.write(file_path, chunk[rejected], pd.Series(reasons).str.rstrip(';'))
+        return coerced[~rejected]
@@ -1,12 +1,19 @@
 import argparse
 import sys
-import pydomo
 import shipyard_utils as shipyard
 
 try:
     import errors
+    import metrics
+    from stream_resolver import StreamResolver
+    from poller import wait_for_completion
+    from token_cache import connect_domo
 except BaseException:
     from . import errors
+    from . import metrics
+    from .stream_resolver import StreamResolver
+    from .poller import wait_for_completion
+    from .token_cache import connect_domo
 
 
 def get_args():
@@ -15,36 +22,35 @@ def get_args():
     parser.add_argument('--secret-key', dest='secret_key', required=True)
     parser.add_argument('--dataset-id', dest='dataset_id', required=True)
     parser.add_argument('--execution-id', dest='execution_id', required=False)
+    parser.add_argument('--wait-for-completion', dest='wait_for_completion',
+                        required=False, default='FALSE')
+    parser.add_argument('--timeout', dest='timeout', type=float, required=False)
+    parser.add_argument('--metrics', dest='metrics', choices={'TRUE', 'FALSE'},
+                        required=False, default='FALSE')
+    parser.add_argument('--metrics-textfile', dest='metrics_textfile', required=False)
+    parser.add_argument('--metrics-format', dest='metrics_format',
+                        choices=set(metrics.METRICS_FORMATS), required=False, default='prometheus')
+    parser.add_argument('--token-cache', dest='token_cache', choices={'TRUE', 'FALSE'},
+                        required=False, default='FALSE')
     args = parser.parse_args()
     return args
 
 
-def get_execution_details(dataset_id, execution_id, domo):
+def get_execution_details(dataset_id, execution_id, resolver):
     """
-    Gets the Stream ID of a particular stream using the dataSet id.
+    Gets the details of an execution of the stream of a dataSet.
 
     Returns:
-        stream_id (int): the Id of the found stream
+        execution_data (dict): the details of the execution
     """
-    streams = domo.streams
-    limit = 1000
-    offset = 0
-    # get all streams
-    stream_list = streams.list(limit, offset)
-    # return stream with matching dataset id
-    for stream in stream_list:
-        if stream['dataSet']['id'] == dataset_id:
-            # get execution details from id
-            try:
-                execution_data = streams.get_execution(
-                    stream['id'], execution_id)
-                return execution_data
-            except Exception as e:
-                print(f"Error occured - {e}")
-                sys.exit(errors.EXIT_CODE_EXECUTION_ID_NOT_FOUND)
-    else:
-        print(f"stream with dataSet id:{dataset_id} not found!")
+    try:
+        return resolver.get_execution(dataset_id, execution_id)
+    except LookupError as e:
+        print(e)
         sys.exit(errors.EXIT_CODE_DATASET_NOT_FOUND)
+    except Exception as e:
+        print(f"Error occured - {e}")
+        sys.exit(errors.EXIT_CODE_EXECUTION_ID_NOT_FOUND)
 
 
 def determine_execution_status(execution_data):
@@ -71,11 +77,14 @@ def determine_execution_status(execution_data):
 
 def main():
     args = get_args()
+    if args.metrics == 'TRUE' or args.metrics_textfile:
+        metrics.enable('verify_refresh_status', args.metrics_textfile, args.metrics_format)
     # initialize domo with auth credentials
-    domo = pydomo.Domo(
+    domo = connect_domo(
         args.client_id,
         args.secret_key,
-        api_host='api.domo.com'
+        api_host='api.domo.com',
+        token_cache=args.token_cache == 'TRUE'
     )
     dataset_id = args.dataset_id
     # create artifacts folder to save variable
@@ -91,7 +100,15 @@ def main():
         execution_id = shipyard.logs.read_pickle_file(
             artifact_subfolder_paths, 'execution_id')
     # run check status
-    execution_data = get_execution_details(dataset_id, execution_id, domo)
+    resolver = StreamResolver(domo)
+    if args.wait_for_completion == 'TRUE':
+        execution_data = wait_for_completion(
+            lambda: get_execution_details(dataset_id, execution_id, resolver),
+            resolver, dataset_id, args.timeout)
+    else:
+        execution_data = get_execution_details(
+            dataset_id, execution_id, resolver)
+    exit_code_status = determine_execution_status(execution_data)
 
     # create artifacts folder to save response
     base_folder_name = shipyard.logs.determine_base_artifact_folder(
@@ -106,7 +123,6 @@ def main():
         execution_data,
         domo_refresh_response_path)
 
-    exit_code_status = determine_execution_status(execution_data)
     sys.exit(exit_code_status)
 
 
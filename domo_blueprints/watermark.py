@@ -0,0 +1,167 @@
+import threading
+from io import BytesIO
+import numpy as np
+import pandas as pd
+try:
+    import validation
+    from cache import JsonCache
+except BaseException:
+    from . import validation
+    from .cache import JsonCache
+
+WATERMARK_TYPES = ['LONG', 'DECIMAL', 'DOUBLE', 'DATE', 'DATETIME', 'STRING']
+WATERMARK_TTL = 10 * 365 * 24 * 3600 # watermarks are kept until they are replaced
+MAX_WATERMARKS = 10000
+SCAN_CHUNK_ROWS = 1000000 # values of the watermark column read at a time when looking for new rows
+
+
+def comparable_keys(values:pd.Series, domo_type:str) -> pd.Series:
+    """Converts the values of a watermark column into keys that compare in the order of their Domo type
+
+    Numbers compare as numbers and dates and times as points in time, whether the values are text or were
+    already parsed. Empty and invalid values become nulls.
+    """
+    if domo_type in ('LONG', 'DECIMAL', 'DOUBLE'):
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            return values
+        return pd.to_numeric(values, errors='coerce')
+    if domo_type in ('DATE', 'DATETIME'):
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        return validation.parse_datetimes(values.astype(str).mask(values.isna(), ''))
+    values = values.astype(object)
+    return values.mask(values.isna() | (values == ''))
+
+
+class Watermark:
+    """Skips the rows at or below the high watermark of a column and tracks the highest value uploaded
+
+    The watermark is the highest value of a monotonically increasing key or timestamp column uploaded to a
+    dataset so far. Rows whose value is at or below it were sent by an earlier run, and rows without a valid
+    value cannot be placed against it, so both are skipped and counted. Parts are filtered by several threads,
+    so the new watermark is tracked under a lock. It keeps the text of the highest value as it was read.
+
+    The dataset is the record of what was uploaded, so the watermark is read from it with a SQL query for the
+    highest value of the column. A replaced or truncated dataset then gets its rows again. The watermark is also
+    recorded in a local cache, which is only used when the dataset cannot be queried. A worker that starts
+    without that cache and cannot query the dataset uploads every row again, and a cache older than the dataset
+    skips rows that are no longer in it.
+    """
+
+    def __init__(self, column:str, index:int, domo_type:str, value:str=None):
+        self.column = column
+        self.index = index
+        self.domo_type = domo_type
+        self.value = value
+        self.key = self.parse(value) if value is not None else None
+        self.new_value = value
+        self.new_key = self.key
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def store() -> JsonCache:
+        return JsonCache('watermarks', WATERMARK_TTL, max_entries=MAX_WATERMARKS)
+
+    @staticmethod
+    def store_key(dataset_id:str, column:str) -> str:
+        return f'{dataset_id}:{column}'
+
+    @staticmethod
+    def query(datasets, dataset_id:str, column:str) -> str:
+        """Returns the highest value of a column of a dataset as text, or None if it has no values"""
+        quoted = '`' + column.replace('`', '``') + '`'
+        value = datasets.query(dataset_id, f"SELECT MAX({quoted}) FROM table")['rows'][0][0]
+        return str(value) if value is not None else None
+
+    @classmethod
+    def load(cls, store:JsonCache, dataset_id:str, column:str, index:int, domo_type:str, datasets=None):
+        """Returns the watermark of a column of a dataset, starting from none if the column has no values
+
+        The highest value in the dataset is used when datasets is given and the query succeeds. Otherwise
+        the watermark recorded by the last upload from this machine is used.
+        """
+        entry = store.get(cls.store_key(dataset_id, column))
+        if entry is not None and entry['type'] != domo_type:
+            print(f"The watermark of column {column} was recorded for the type {entry['type']}, not {domo_type}. Ignoring it")
+            entry = None
+        recorded = cls(column, index, domo_type, entry['value'] if entry is not None else None)
+        if datasets is None:
+            return recorded
+        try:
+            watermark = cls(column, index, domo_type, cls.query(datasets, dataset_id, column))
+        except Exception as e:
+            print(f"Could not query the highest value of column {column} from the dataset. Using the watermark "
+                  f"recorded by the last upload from this machine instead. {e}")
+            return recorded
+        if entry is not None and recorded.value != watermark.value and recorded.key != watermark.key:
+            found = f"the highest value in the dataset is {watermark.value}" if watermark.value is not None else "the dataset has no values in it"
+            print(f"The recorded watermark of column {column} is {recorded.value}, but {found}. Using the dataset")
+        return watermark
+
+    def save(self, store:JsonCache, dataset_id:str):
+        """Records the new watermark. Call it only once the rows below it have been committed"""
+        if self.new_value is None:
+            return
+        store.set(self.store_key(dataset_id, self.column), {'type': self.domo_type, 'value': self.new_value})
+
+    def parse(self, text:str):
+        return comparable_keys(pd.Series([text], dtype=object), self.domo_type).iloc[0]
+
+    def is_above(self, text:str) -> bool:
+        """Whether a single value is above the watermark, used to search files sorted by the column"""
+        if self.key is None:
+            return True
+        key = self.parse(text)
+        return not pd.isna(key) and key > self.key
+
+    def any_above(self, values:pd.Series) -> bool:
+        """Whether any of the values is above the watermark, without tracking them"""
+        if self.key is None:
+            return True
+        keys = comparable_keys(values, self.domo_type).dropna()
+        return bool((keys > self.key).any())
+
+    def mask(self, values:pd.Series) -> np.ndarray:
+        """Returns a mask of the values above the watermark, a whole column at a time, and tracks the highest one"""
+        keys = comparable_keys(values, self.domo_type)
+        keep = keys.notna().to_numpy().copy()
+        if self.key is not None:
+            keep[keep] = (keys[keep] > self.key).to_numpy(dtype=bool)
+        kept = keys[keep]
+        with self.lock:
+            self.skipped += len(values) - int(keep.sum())
+            if len(kept):
+                position = kept.index[np.argmax(kept.to_numpy())]
+                if self.new_key is None or kept[position] > self.new_key:
+                    self.new_key = kept[position]
+                    self.new_value = str(values[position])
+        return keep
+
+    def apply(self, chunk:pd.DataFrame) -> pd.DataFrame:
+        """Returns the rows of a chunk above the watermark. The column is found by its position in the schema"""
+        return chunk[self.mask(chunk.iloc[:, self.index])]
+
+    def has_rows_above(self, file_path:str) -> bool:
+        """Whether a CSV file has a row above the watermark. Only the watermark column is read, and only until one is found"""
+        read_options = {'dtype': str, 'keep_default_na': False, 'na_filter': False}
+        with pd.read_csv(file_path, usecols=[self.index], chunksize=SCAN_CHUNK_ROWS, **read_options) as chunks:
+            return any(self.any_above(chunk.iloc[:, 0]) for chunk in chunks)
+
+    def filter_csv(self, data:bytes, names:list) -> bytes:
+        """Returns the records of a headerless CSV part above the watermark
+
+        Only the watermark column is parsed to decide. A part whose records are all kept is returned as it is,
+        and only a part that is partly kept is parsed in full and written again.
+        """
+        read_options = {'header': None, 'names': names, 'dtype': str, 'keep_default_na': False, 'na_filter': False}
+        if isinstance(data, str):
+            data = data.encode()
+        values = pd.read_csv(BytesIO(data), usecols=[self.index], **read_options).iloc[:, 0]
+        keep = self.mask(values)
+        if keep.all():
+            return data
+        if not keep.any():
+            return b''
+        rows = pd.read_csv(BytesIO(data), **read_options)
+        return rows[keep].to_csv(index=False, header=False).encode()
@@ -29,8 +29,8 @@ config = {
         "Topic :: Scientific/Engineering",
         "Topic :: Software Development",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
     ],
-    "python_requires": ">=3.7"}
+    "python_requires": ">=3.8"}
 
 setup(**config)
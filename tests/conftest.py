@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the blueprints import their sibling modules by name, the way they are run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'domo_blueprints'))
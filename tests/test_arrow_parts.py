@@ -0,0 +1,100 @@
+import os
+import re
+import datetime
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import arrow_parts
+
+ROWS = 1000
+
+
+def make_table():
+    return pa.table({
+        'id': pa.array(range(ROWS), pa.int64()),
+        'score': pa.array([i / 4 for i in range(ROWS)], pa.float64()),
+        'name': pa.array([f'name {i}' for i in range(ROWS)]),
+        'at': pa.array([datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=i) for i in range(ROWS)],
+                       pa.timestamp('ms'))
+    })
+
+
+@pytest.fixture(params=['rows.parquet', 'rows.feather'])
+def arrow_file(tmp_path, request, monkeypatch):
+    monkeypatch.setattr(arrow_parts, 'BATCH_ROWS', 128)
+    file_path = str(tmp_path / request.param)
+    if file_path.endswith('.parquet'):
+        pq.write_table(make_table(), file_path, row_group_size=128)
+    else:
+        feather.write_feather(make_table(), file_path, chunksize=128)
+    return file_path
+
+
+def open_files(file_path:str) -> list:
+    fd_dir = '/proc/self/fd'
+    links = [os.path.realpath(os.path.join(fd_dir, fd)) for fd in os.listdir(fd_dir)]
+    return [link for link in links if link == os.path.realpath(file_path)]
+
+
+def test_domo_schema(arrow_file):
+    assert arrow_parts.get_domo_schema(arrow_file) == [
+        {'type': 'LONG', 'name': 'id'}, {'type': 'DOUBLE', 'name': 'score'},
+        {'type': 'STRING', 'name': 'name'}, {'type': 'DATETIME', 'name': 'at'}]
+
+
+def test_parts_hold_every_row_once(arrow_file):
+    parts = list(arrow_parts.iter_arrow_parts(arrow_file, 4096))
+    assert len(parts) > 1
+    assert [start for start, _, _ in parts] == [sum(rows for _, rows, _ in parts[:i]) for i in range(len(parts))]
+    lines = b''.join(data for _, _, data in parts).decode().splitlines()
+    assert len(lines) == ROWS
+    # pyarrow writes the milliseconds of a millisecond timestamp
+    assert re.fullmatch(r'1,0.25,"name 1","2024-01-01 00:01:00(\.0+)?"', lines[1])
+
+
+def test_parts_resume_from_a_row(arrow_file):
+    first = list(arrow_parts.iter_arrow_parts(arrow_file, 4096))
+    start, rows, data = first[2]
+    assert arrow_parts.read_rows(arrow_file, start, rows) == data
+    resumed = list(arrow_parts.iter_arrow_parts(arrow_file, 4096, start))
+    assert b''.join(data for _, _, data in resumed) == b''.join(data for _, _, data in first[2:])
+
+
+def test_column_values(arrow_file):
+    values = [value for chunk in arrow_parts.iter_column(arrow_file, 3) for value in chunk]
+    assert len(values) == ROWS
+    assert values[-1].startswith('2024-01-01 16:39:00')
+
+
+def test_files_are_closed(arrow_file):
+    batches = arrow_parts.iter_record_batches(arrow_file, 300)
+    # a batch still in use must not keep the file open
+    batch = next(batches)
+    assert batch.num_rows == 84
+    batches.close()
+    arrow_parts.read_schema(arrow_file)
+    list(arrow_parts.iter_column(arrow_file, 0))
+    assert open_files(arrow_file) == []
+    assert batch.column(0)[0].as_py() == 300
+
+
+def test_memory_map_is_closed_with_the_generator(arrow_file, monkeypatch):
+    if arrow_parts.get_file_format(arrow_file) != 'arrow':
+        pytest.skip('only Arrow IPC files are memory-mapped')
+    sources = []
+    memory_map = pa.memory_map
+
+    def recording_memory_map(*args):
+        sources.append(memory_map(*args))
+        return sources[-1]
+
+    monkeypatch.setattr(pa, 'memory_map', recording_memory_map)
+    batches = arrow_parts.iter_record_batches(arrow_file)
+    next(batches)
+    assert not sources[0].closed
+    batches.close()
+    assert sources[0].closed
@@ -0,0 +1,76 @@
+import os
+import json
+import threading
+
+import cache as cache_module
+from cache import JsonCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return JsonCache('entries', kwargs.pop('ttl', 3600), cache_dir=str(tmp_path), **kwargs)
+
+
+def test_get_returns_what_was_set(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get('missing') is None
+    cache.set('key', {'value': 1})
+    assert cache.get('key') == {'value': 1}
+    cache.delete('key')
+    assert cache.get('key') is None
+
+
+def test_get_does_not_write_the_file(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path)
+    cache.set('key', 'value')
+    monkeypatch.setattr(JsonCache, '_save', lambda self, entries: (_ for _ in ()).throw(AssertionError('saved')))
+    for _ in range(3):
+        assert cache.get('key') == 'value'
+        assert cache.get('missing') is None
+
+
+def test_expired_entries_are_removed(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, ttl=60)
+    now = 1000000.0
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now)
+    cache.set('old', 1)
+    cache.set('new', 2)
+    now += 30
+    cache.set('new', 3)
+    now += 45
+    assert cache.get('old') is None
+    assert cache.get('new') == 3
+    with open(cache.path) as f:
+        assert list(json.load(f)) == ['new']
+
+
+def test_oldest_entries_are_evicted(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, max_entries=2)
+    now = 1000000.0
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now)
+    for key in ['a', 'b', 'c']:
+        now += 1
+        cache.set(key, key)
+    assert [cache.get(key) for key in ['a', 'b', 'c']] == [None, 'b', 'c']
+
+
+def test_concurrent_writers_keep_each_others_entries(tmp_path):
+    # separate instances stand in for separate runs sharing the cache file
+    caches = [make_cache(tmp_path, max_entries=1000) for _ in range(4)]
+
+    def write(index):
+        for i in range(25):
+            caches[index].set(f'{index}-{i}', i)
+
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(len(caches))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(caches[0].get(f'{index}-{i}') == i for index in range(len(caches)) for i in range(25))
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
+
+
+def test_private_cache_is_only_readable_by_the_owner(tmp_path):
+    cache = make_cache(tmp_path, private=True)
+    cache.set('token', 'secret')
+    assert os.stat(cache.path).st_mode & 0o077 == 0
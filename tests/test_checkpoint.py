@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+import upload_csv_to_dataset as upload
+from checkpoint import UploadCheckpoint
+
+
+class Streams:
+    def __init__(self, state:str='ACTIVE'):
+        self.state = state
+        self.aborted = []
+
+    def get_execution(self, stream_id, execution_id):
+        return {'id': execution_id, 'currentState': self.state}
+
+    def abort_execution(self, stream_id, execution_id):
+        self.aborted.append(execution_id)
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    file_path = tmp_path / 'rows.csv'
+    with open(file_path, 'w') as f:
+        f.write('id,note\n')
+        for i in range(2000):
+            f.write(f'{i},"row\n{i}"\n' if i % 5 == 0 else f'{i},row {i}\n')
+    return str(file_path)
+
+
+def read_rows(parts:list) -> bytes:
+    return b''.join(data for _, _, data in sorted(parts))
+
+
+def test_resume_uploads_every_record_once(tmp_path, csv_file):
+    manifest_path = str(tmp_path / 'manifest.json')
+    checkpoint = UploadCheckpoint(manifest_path, 1, 2, [csv_file])
+    checkpoint.compact()
+    parts = upload.iter_file_parts([csv_file], 4096, checkpoint)
+    # the first parts are uploaded and one more is read before the run dies
+    uploaded = []
+    for _ in range(3):
+        uploaded.append(next(parts))
+        checkpoint.complete_part(uploaded[-1][0])
+    interrupted = next(parts)
+    parts.close()
+
+    resumed = UploadCheckpoint.load(manifest_path)
+    assert resumed.can_resume(Streams(), [csv_file])
+    assert [part_num for part_num, _ in resumed.pending_parts()] == [interrupted[0]]
+    rest = list(upload.iter_file_parts([csv_file], 4096, resumed))
+    assert rest[0] == interrupted
+    assert [part_num for part_num, _, _ in rest] == list(range(4, 4 + len(rest)))
+    with open(csv_file, 'rb') as f:
+        f.readline()
+        assert read_rows(uploaded + rest) == f.read()
+
+
+def test_skip_to_starts_reading_past_the_skipped_records(tmp_path, csv_file):
+    checkpoint = UploadCheckpoint(str(tmp_path / 'manifest.json'), 1, 2, [csv_file])
+    with open(csv_file, 'rb') as f:
+        data = f.read()
+    offset = data.index(b'\n1000,') + 1
+    checkpoint.skip_to(csv_file, offset)
+    assert UploadCheckpoint.load(checkpoint.manifest_path).file_offset(csv_file) == offset
+    assert read_rows(list(upload.iter_file_parts([csv_file], 4096, checkpoint))) == data[offset:]
+
+
+def test_cannot_resume_a_changed_file_or_a_closed_execution(tmp_path, csv_file):
+    manifest_path = str(tmp_path / 'manifest.json')
+    UploadCheckpoint(manifest_path, 1, 2, [csv_file]).compact()
+    assert not UploadCheckpoint.load(manifest_path).can_resume(Streams('SUCCESS'), [csv_file])
+    with open(csv_file, 'a') as f:
+        f.write('2000,late\n')
+    assert not UploadCheckpoint.load(manifest_path).can_resume(Streams(), [csv_file])
+
+
+def test_cannot_resume_a_committed_execution(tmp_path, csv_file):
+    checkpoint = UploadCheckpoint(str(tmp_path / 'manifest.json'), 1, 2, [csv_file])
+    checkpoint.commit()
+    assert not UploadCheckpoint.load(checkpoint.manifest_path).can_resume(Streams(), [csv_file])
+    assert UploadCheckpoint.load(str(tmp_path / 'missing.json')) is None
+
+
+def count_lines(path:str) -> int:
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def test_parts_are_appended_and_compacted_on_commit(tmp_path, csv_file):
+    manifest_path = str(tmp_path / 'manifest.json')
+    checkpoint = UploadCheckpoint(manifest_path, 1, 2, [csv_file])
+    checkpoint.compact()
+    for part_num in range(1, 11):
+        checkpoint.add_part(part_num, csv_file, part_num * 10, 10, b'data')
+        checkpoint.complete_part(part_num)
+    assert count_lines(manifest_path) == 1 + 2 * 10
+    checkpoint.commit()
+    assert count_lines(manifest_path) == 1 + 10 + 1
+    committed = UploadCheckpoint.load(manifest_path)
+    assert committed.committed and not committed.pending_parts()
+
+
+def test_a_line_cut_short_is_ignored(tmp_path, csv_file):
+    manifest_path = str(tmp_path / 'manifest.json')
+    checkpoint = UploadCheckpoint(manifest_path, 1, 2, [csv_file])
+    checkpoint.compact()
+    checkpoint.add_part(1, csv_file, 8, 10, b'data')
+    checkpoint.complete_part(1)
+    checkpoint.add_part(2, csv_file, 18, 10, b'data')
+    with open(manifest_path, 'a') as f:
+        f.write('{"type": "uploaded", "part_')
+    resumed = UploadCheckpoint.load(manifest_path)
+    assert [part_num for part_num, _ in resumed.pending_parts()] == [2]
+    assert resumed.file_offset(csv_file) == 28
+
+
+def test_a_manifest_of_an_earlier_version_is_loaded(tmp_path, csv_file):
+    manifest_path = str(tmp_path / 'manifest.json')
+    files = UploadCheckpoint(None, 1, 2, [csv_file]).files
+    part = {'file': csv_file, 'offset': 8, 'length': 10, 'md5': '', 'uploaded': False}
+    with open(manifest_path, 'w') as f:
+        json.dump({'stream_id': 1, 'execution_id': 2, 'committed': False, 'files': files, 'starts': {},
+                   'parts': {'1': part}}, f)
+    resumed = UploadCheckpoint.load(manifest_path)
+    assert resumed.can_resume(Streams(), [csv_file])
+    assert resumed.pending_parts() == [(1, part)]
+
+
+def test_an_execution_that_is_not_resumed_is_aborted(tmp_path, csv_file):
+    streams = Streams()
+    checkpoint = UploadCheckpoint(str(tmp_path / 'manifest.json'), 1, 2, [csv_file])
+    checkpoint.discard(streams)
+    checkpoint.commit()
+    checkpoint.discard(streams)
+    assert streams.aborted == [2]
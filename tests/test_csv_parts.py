@@ -0,0 +1,75 @@
+import os
+import csv
+
+import pytest
+
+import csv_parts
+
+QUOTED = b'id,note\n1,"a\nb"\n2,"say ""hi""\nthere"\n3,plain\n'
+
+
+def test_find_record_end_skips_quoted_newlines():
+    header_end = csv_parts.find_record_end(QUOTED, 0, 0)
+    assert QUOTED[:header_end] == b'id,note\n'
+    first_end = csv_parts.find_record_end(QUOTED, header_end, header_end)
+    assert QUOTED[header_end:first_end] == b'1,"a\nb"\n'
+    second_end = csv_parts.find_record_end(QUOTED, first_end, first_end)
+    assert QUOTED[first_end:second_end] == b'2,"say ""hi""\nthere"\n'
+
+
+def test_find_record_end_from_inside_a_quoted_field():
+    header_end = csv_parts.find_record_end(QUOTED, 0, 0)
+    # the target is past the newline inside the first quoted field
+    target = QUOTED.index(b'\nb"') + 1
+    assert QUOTED[:csv_parts.find_record_end(QUOTED, header_end, target)].endswith(b'1,"a\nb"\n')
+
+
+def test_find_record_end_without_a_terminator():
+    assert csv_parts.find_record_end(b'a,b\n1,2', 4, 4) == 7
+    assert csv_parts.find_record_end(b'a,b\n', 0, 10) == 4
+
+
+def test_iter_records_yields_whole_records(tmp_path):
+    file_path = tmp_path / 'quoted.csv'
+    file_path.write_bytes(QUOTED)
+    records = list(csv_parts.iter_records(str(file_path)))
+    assert records == ['id,note\n', '1,"a\nb"\n', '2,"say ""hi""\nthere"\n', '3,plain\n']
+
+
+@pytest.fixture
+def sorted_file(tmp_path):
+    file_path = tmp_path / 'sorted.csv'
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'note'])
+        for i in range(5000):
+            writer.writerow([i, f'line {i}\nstill {i}' if i % 3 == 0 else 'x'])
+    return str(file_path)
+
+
+def offset_of(file_path:str, key:int) -> int:
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    position = csv_parts.find_record_end(data, 0, 0)
+    while position < len(data):
+        if int(csv_parts.parse_record(data, position)[0]) >= key:
+            return position
+        position = csv_parts.find_record_end(data, position, position)
+    return len(data)
+
+
+@pytest.mark.parametrize('key', [0, 1, 2999, 3000, 4999])
+def test_find_first_record_binary_search(sorted_file, key):
+    # a small scan window makes the search bisect across quoted newlines
+    start = csv_parts.find_first_record(sorted_file, lambda row: int(row[0]) >= key, scan_window=256)
+    assert start == offset_of(sorted_file, key)
+
+
+def test_find_first_record_past_the_end(sorted_file):
+    assert csv_parts.find_first_record(sorted_file, lambda row: False, scan_window=256) == os.path.getsize(sorted_file)
+
+
+def test_find_first_record_of_an_empty_file(tmp_path):
+    file_path = tmp_path / 'empty.csv'
+    file_path.write_bytes(b'')
+    assert csv_parts.find_first_record(str(file_path), lambda row: True) == 0
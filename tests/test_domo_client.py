@@ -0,0 +1,124 @@
+import asyncio
+
+from aiohttp import web
+
+import domo_client
+from cache import JsonCache
+from domo_client import AsyncDomoClient
+from retry import RetryPolicy
+from token_cache import TokenCache
+
+
+class FakeInstance:
+    """Serves the content API endpoints the blueprints use, failing the first requests as told"""
+
+    def __init__(self, failures:list=None):
+        self.failures = list(failures or [])
+        self.logins = 0
+        self.requests = []
+        self.rejected_tokens = set()
+
+    async def login(self, request):
+        self.logins += 1
+        return web.json_response({'success': True, 'sessionToken': f'token-{self.logins}'})
+
+    async def cards(self, request):
+        self.requests.append((request.headers.get('x-domo-authentication'), request.query.getall('urns')))
+        if request.headers.get('x-domo-authentication') in self.rejected_tokens:
+            return web.json_response({'status': 401}, status=401)
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            return web.json_response({'status': status}, status=status, headers=headers)
+        return web.json_response([{'id': int(card_id)} for card_id in request.query['urns'].split(',')])
+
+    async def document(self, request):
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            return web.Response(status=status, headers=headers, text='unavailable')
+        return web.Response(body=b'document body')
+
+
+def run_with_instance(instance:FakeInstance, test, **client_kwargs):
+    async def main():
+        app = web.Application()
+        app.router.add_post('/api/content/v2/authentication', instance.login)
+        app.router.add_get('/api/content/v1/cards', instance.cards)
+        app.router.add_get('/document', instance.document)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncDomoClient('instance', retry_policy=RetryPolicy(backoff_base=0.01),
+                                       **client_kwargs) as client:
+                client.base_url = f'http://127.0.0.1:{port}'
+                return await test(client)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_transient_failures_and_rate_limits_are_retried():
+    instance = FakeInstance([(503, {}), (429, {'Retry-After': '0'})])
+
+    async def test(client):
+        return await domo_client.get_card_data('1', client)
+
+    assert run_with_instance(instance, test) == [{'id': 1}]
+    assert len(instance.requests) == 3
+
+
+def test_download_only_writes_successful_responses(tmp_path):
+    instance = FakeInstance([(404, {})])
+    file_path = str(tmp_path / 'document.pdf')
+
+    async def test(client):
+        missing = await client.download('GET', '/document', file_path)
+        assert missing.status == 404
+        assert not (tmp_path / 'document.pdf').exists()
+        found = await client.download('GET', '/document', file_path)
+        return found.status
+
+    assert run_with_instance(instance, test) == 200
+    assert (tmp_path / 'document.pdf').read_bytes() == b'document body'
+
+
+def test_cards_are_fetched_in_batches(monkeypatch):
+    monkeypatch.setattr(domo_client, 'METADATA_BATCH_SIZE', 2)
+    instance = FakeInstance()
+
+    async def test(client):
+        return await domo_client.get_cards_data(['1', '2', '3', '4', '5'], client)
+
+    assert sorted(run_with_instance(instance, test)) == ['1', '2', '3', '4', '5']
+    assert sorted(urns for _, urns in instance.requests) == [['1,2'], ['3,4'], ['5']]
+
+
+def test_rejected_session_token_logs_in_again(tmp_path):
+    token_cache = TokenCache(JsonCache('tokens', 3600, cache_dir=str(tmp_path), private=True), enabled=True)
+    token_cache.set('session', 'instance', 'user@example.com', 'password', 'revoked-token', 3600)
+    instance = FakeInstance()
+    instance.rejected_tokens.add('revoked-token')
+
+    async def test(client):
+        await domo_client.authenticate(client, 'user@example.com', 'password', 'instance', token_cache)
+        return await domo_client.get_card_data('1', client)
+
+    assert run_with_instance(instance, test) == [{'id': 1}]
+    assert instance.logins == 1
+    assert [token for token, _ in instance.requests] == ['revoked-token', 'token-1']
+    assert token_cache.get('session', 'instance', 'user@example.com', 'password') == 'token-1'
+
+
+def test_a_forbidden_token_logs_in_again_only_once():
+    instance = FakeInstance([(403, {})])
+
+    async def test(client):
+        await domo_client.authenticate(client, 'user@example.com', 'password', 'instance')
+        return (await client.request('GET', '/api/content/v1/cards', params={'urns': '1'})).status
+
+    assert run_with_instance(instance, test) == 200
+    instance = FakeInstance([(403, {}), (403, {})])
+    assert run_with_instance(instance, test) == 403
+    assert instance.logins == 2
@@ -0,0 +1,90 @@
+import re
+import csv
+import sqlite3
+
+import pytest
+
+import download_dataset_as_csv as download
+
+SCHEMA = [{'name': 'id', 'type': 'LONG'}, {'name': 'name', 'type': 'STRING'}, {'name': 'score', 'type': 'DOUBLE'}]
+NAMES = ['a', 'b', 'b', 'b', 'b', "o'neil", 'c', None]
+
+
+class Datasets:
+    """Answers the dataset query API from an in-memory SQLite table"""
+
+    def __init__(self, rows:list):
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.connection.execute('CREATE TABLE "table" (id INTEGER, name TEXT, score REAL)')
+        self.connection.executemany('INSERT INTO "table" VALUES (?, ?, ?)', rows)
+        self.rows = rows
+        self.queries = []
+
+    def get(self, ds_id):
+        return {'rows': len(self.rows), 'schema': {'columns': SCHEMA}}
+
+    def query(self, ds_id, sql):
+        self.queries.append(sql)
+        rows = self.connection.execute(sql.replace('FROM table', 'FROM "table"')).fetchall()
+        return {'rows': [list(row) for row in rows]}
+
+
+class Domo:
+    def __init__(self, rows:list):
+        self.datasets = Datasets(rows)
+
+
+@pytest.fixture
+def domo(monkeypatch):
+    monkeypatch.setattr(download, 'PAGE_ROWS', 50)
+    return Domo([(i, NAMES[i % len(NAMES)], i / 7) for i in range(1000)])
+
+
+def read_output(path) -> list:
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        assert next(reader) == ['id', 'name', 'score']
+        return list(reader)
+
+
+def expected_rows(rows:list) -> list:
+    return sorted([str(value) if value is not None else '' for value in row] for row in rows)
+
+
+@pytest.mark.parametrize('partition_column', [None, 'id', 'name'])
+def test_partitions_cover_every_row_once(tmp_path, domo, partition_column):
+    download.download_partitioned('dataset', domo, 'out.csv', str(tmp_path), 4, partition_column)
+    output = read_output(tmp_path / 'out.csv')
+    assert sorted(output) == expected_rows(domo.datasets.rows)
+
+
+def test_pages_are_read_by_keyset(tmp_path, domo):
+    download.download_partitioned('dataset', domo, 'out.csv', str(tmp_path), 4, 'name')
+    pages = [query for query in domo.datasets.queries if query.startswith('SELECT *')]
+    offsets = [int(offset) for offset in re.findall(r'OFFSET (\d+)', ' '.join(pages))]
+    # only the rows of a single value are paged by offset, never a whole partition
+    run = max(NAMES.count(name) for name in NAMES) * 1000 // len(NAMES)
+    assert max(offsets) <= run
+    assert not any('DISTINCT' in query for query in domo.datasets.queries)
+
+
+def test_quantile_partitions_of_a_text_column(domo):
+    metadata = domo.datasets.get('dataset')
+    plans = download.plan_partitions('dataset', domo, metadata, 4, 'name')
+    assert [plan['keyset'] for plan in plans] == [True] * (len(plans) - 1) + [False]
+    assert plans[-1]['where'] == '`name` IS NULL'
+    # b fills two of the quantiles, so it bounds a single partition
+    assert len(plans) == 4
+
+
+def test_unknown_partition_column(domo):
+    metadata = domo.datasets.get('dataset')
+    with pytest.raises(SystemExit) as exit_info:
+        download.plan_partitions('dataset', domo, metadata, 4, 'missing')
+    assert exit_info.value.code == download.ec.EXIT_CODE_COLUMN_MISMATCH
+
+
+def test_values_and_columns_are_quoted():
+    assert download.quote_column('we`ird') == '`we``ird`'
+    assert download.quote_value("o'neil") == "'o''neil'"
+    assert download.quote_value(1.5) == '1.5'
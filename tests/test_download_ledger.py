@@ -0,0 +1,100 @@
+import os
+import asyncio
+
+import pytest
+
+from cache import JsonCache
+from download_ledger import DownloadLedger
+import download_file_card
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return DownloadLedger('instance', JsonCache('download_ledger', 3600, cache_dir=str(tmp_path / 'cache')))
+
+
+@pytest.fixture
+def document(tmp_path):
+    file_path = str(tmp_path / 'report.pdf')
+    with open(file_path, 'wb') as f:
+        f.write(b'first revision')
+    return file_path
+
+
+def test_recorded_file_is_current(ledger, document):
+    ledger.record('1', document, 'rev-1', {'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+    assert ledger.is_current('1', document, 'rev-1')
+    assert not ledger.is_current('1', document, 'rev-2')
+    assert not ledger.is_current('2', document, 'rev-1')
+    assert ledger.conditional_headers('1', document) == {
+        'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+
+def test_modified_or_deleted_file_is_downloaded_again(ledger, document):
+    ledger.record('1', document, 'rev-1')
+    with open(document, 'wb') as f:
+        f.write(b'edited revision')
+    assert ledger.get('1', document) is None
+    ledger.record('1', document, 'rev-1')
+    os.remove(document)
+    assert not ledger.is_current('1', document, 'rev-1')
+    assert ledger.conditional_headers('1', document) == {}
+
+
+def test_touched_file_is_hashed_once(ledger, document, monkeypatch):
+    ledger.record('1', document, 'rev-1')
+    stat = os.stat(document)
+    os.utime(document, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert ledger.is_current('1', document, 'rev-1')
+    monkeypatch.setattr('download_ledger.file_sha256', lambda file_path: pytest.fail('hashed again'))
+    assert ledger.is_current('1', document, 'rev-1')
+
+
+def test_refresh_keeps_the_validators(ledger, document):
+    ledger.record('1', document, 'rev-1', {'ETag': '"abc"'})
+    ledger.refresh('1', document, 'rev-2')
+    entry = ledger.get('1', document)
+    assert entry['etag'] == '"abc"'
+    assert entry['revision_id'] == 'rev-2'
+
+
+class FakeResponse:
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = headers
+
+
+class FakeClient:
+    def __init__(self, status, body=b'', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.requests = []
+
+    async def download(self, method, path, file_path, headers=None, **kwargs):
+        self.requests.append(headers)
+        if self.status == 200:
+            with open(file_path, 'wb') as f:
+                f.write(self.body)
+        return FakeResponse(self.status, self.headers)
+
+
+def fetch(client, card, document, ledger):
+    return asyncio.run(download_file_card.fetch_document(card, client, document, ledger=ledger))
+
+
+def test_not_modified_keeps_the_recorded_download(ledger, document):
+    card = {'id': 1, 'title': 'report.pdf', 'metadata': {'revisionId': 'rev-1'}}
+    client = FakeClient(200, b'second revision', {'ETag': '"def"', 'Last-Modified': 'Tue, 02 Jan 2024 00:00:00 GMT'})
+    assert fetch(client, card, document, ledger)[0] == 'downloaded'
+    with open(document, 'rb') as f:
+        assert f.read() == b'second revision'
+
+    # a new revision id with the same content, which the server reports as not modified without validators
+    card['metadata']['revisionId'] = 'rev-2'
+    client = FakeClient(304)
+    assert fetch(client, card, document, ledger)[0] == 'unchanged'
+    assert client.requests == [{'If-None-Match': '"def"', 'If-Modified-Since': 'Tue, 02 Jan 2024 00:00:00 GMT'}]
+    assert ledger.conditional_headers('1', document) == client.requests[0]
+    assert ledger.is_current('1', document, 'rev-2')
+    assert not os.path.exists(f'{document}.download')
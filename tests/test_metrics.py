@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    registry.enabled = True
+    monkeypatch.setattr(metrics, 'REGISTRY', registry)
+    return registry
+
+
+def test_disabled_registry_records_nothing(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'REGISTRY', registry)
+    assert metrics.span('upload.part') is metrics.NULL_SPAN
+    metrics.count('parts')
+    metrics.observe('upload.part', 1.0)
+    items = [1, 2]
+    assert metrics.iterate('read', items) is items
+    assert registry.spans == {} and registry.counters == {}
+
+
+def test_spans_and_counters_add_up(registry):
+    for seconds in [1.0, 3.0, 2.0]:
+        metrics.observe('upload.part', seconds)
+    with metrics.span('commit'):
+        pass
+    metrics.count('bytes.uploaded', 100)
+    metrics.count('bytes.uploaded', 50)
+    report = registry.report('upload_csv_to_dataset')
+    assert report['spans']['upload.part'] == {'count': 3, 'seconds': 6.0, 'min_seconds': 1.0, 'max_seconds': 3.0}
+    assert report['spans']['commit']['count'] == 1
+    assert report['counters'] == {'bytes.uploaded': 150}
+
+
+def test_timed_functions_and_coroutines(registry):
+    @metrics.timed('sync')
+    def add(a, b):
+        return a + b
+
+    @metrics.timed('async')
+    async def multiply(a, b):
+        return a * b
+
+    assert add(2, 3) == 5
+    assert asyncio.run(multiply(2, 3)) == 6
+    assert add.__name__ == 'add'
+    assert registry.spans['sync']['count'] == 1
+    assert registry.spans['async']['count'] == 1
+
+
+def test_iterate_times_each_item(registry):
+    assert list(metrics.iterate('read', iter([1, 2, 3]))) == [1, 2, 3]
+    # the final call that finds the iterator exhausted is timed too
+    assert registry.spans['read']['count'] == 4
+
+
+REPORT = {
+    'blueprint': 'upload "csv"',
+    'started': 1700000000.0,
+    'seconds': 12.5,
+    'spans': {'upload.part': {'count': 2, 'seconds': 3.0, 'min_seconds': 1.0, 'max_seconds': 2.0}},
+    'counters': {'parts': 2}
+}
+
+
+def test_prometheus_textfile():
+    lines = metrics.format_textfile(REPORT).splitlines()
+    assert '# TYPE domo_blueprint_span_seconds_total counter' in lines
+    assert 'domo_blueprint_span_seconds_total{blueprint="upload \\"csv\\"",stage="upload.part"} 3.0' in lines
+    assert 'domo_blueprint_events_total{blueprint="upload \\"csv\\"",name="parts"} 2' in lines
+    assert 'domo_blueprint_run_seconds{blueprint="upload \\"csv\\""} 12.5' in lines
+    assert '# EOF' not in lines
+
+
+def test_openmetrics_textfile():
+    lines = metrics.format_textfile(REPORT, 'openmetrics').splitlines()
+    assert '# TYPE domo_blueprint_span_seconds counter' in lines
+    assert 'domo_blueprint_span_runs_total{blueprint="upload \\"csv\\"",stage="upload.part"} 2' in lines
+    assert lines[-1] == '# EOF'
+
+
+def test_textfile_is_replaced_atomically(tmp_path):
+    textfile_path = str(tmp_path / 'upload.prom')
+    metrics.write_textfile(REPORT, textfile_path)
+    assert (tmp_path / 'upload.prom').read_text() == metrics.format_textfile(REPORT)
+    assert [path.name for path in tmp_path.iterdir()] == ['upload.prom']
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+import poller
+from poller import AdaptivePoller, PollScheduler
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def execution(execution_id:int, seconds:float, state:str='SUCCESS') -> dict:
+    started_at = START + timedelta(hours=execution_id)
+    return {'id': execution_id, 'currentState': state, 'startedAt': started_at.isoformat(),
+            'endedAt': (started_at + timedelta(seconds=seconds)).isoformat()}
+
+
+class Streams:
+    """Lists executions oldest first, the way the streams API does"""
+
+    def __init__(self, executions:list):
+        self.executions = executions
+        self.requests = []
+
+    def get(self, stream_id):
+        self.requests.append(('get', stream_id))
+        return {'id': stream_id, 'lastExecution': self.executions[-1] if self.executions else None}
+
+    def list_executions(self, stream_id, limit, offset):
+        self.requests.append(('list', offset))
+        return self.executions[offset:offset + limit]
+
+
+def test_history_is_read_from_the_newest_end():
+    # a long history of slow refreshes, followed by recent fast ones
+    executions = [execution(i, 600) for i in range(1, 5001)]
+    executions += [execution(i, 30) for i in range(5001, 5031)]
+    streams = Streams(executions)
+    durations = poller.get_historical_durations(streams, 1)
+    assert list(durations) and set(durations) == {30}
+    assert len(durations) == poller.HISTORY_LIMIT
+    assert streams.requests == [('get', 1), ('list', 5030 - poller.HISTORY_PAGE_SIZE)]
+
+
+def test_history_reads_a_bounded_number_of_pages():
+    # no successful execution to stop at
+    executions = [execution(i, 60, 'ABORTED') for i in range(1, 5001)]
+    streams = Streams(executions)
+    assert poller.get_historical_durations(streams, 1) == ()
+    assert len([request for request in streams.requests if request[0] == 'list']) == poller.HISTORY_MAX_PAGES
+
+
+def test_history_is_read_once_per_stream():
+    streams = Streams([execution(i, 60) for i in range(1, 11)])
+    first = poller.get_historical_durations(streams, 1)
+    requests = len(streams.requests)
+    assert poller.get_historical_durations(streams, 1) == first
+    assert len(streams.requests) == requests
+
+
+def test_a_stream_without_executions_has_no_history():
+    streams = Streams([])
+    assert poller.get_historical_durations(streams, 1) == ()
+    assert streams.requests == [('get', 1)]
+
+
+def test_first_delay_waits_for_most_of_the_expected_duration():
+    adaptive = AdaptivePoller(expected_duration=100, elapsed=30, jitter=0)
+    assert adaptive.next_delay() == 50
+    assert adaptive.next_delay() == 10
+    assert adaptive.next_delay() == 20
+
+
+def test_delays_back_off_up_to_the_maximum():
+    adaptive = AdaptivePoller(min_delay=1, max_delay=4, jitter=0)
+    assert [adaptive.next_delay() for _ in range(5)] == [1, 2, 4, 4, 4]
+
+
+def test_scheduler_polls_every_execution_until_done(monkeypatch):
+    monkeypatch.setattr(poller.time, 'sleep', lambda seconds: None)
+    states = {'a': iter(['ACTIVE', 'SUCCESS']), 'b': iter(['ABORTED'])}
+    scheduler = PollScheduler()
+    for key in states:
+        scheduler.add(key, AdaptivePoller(min_delay=0, jitter=0), lambda key=key: next(states[key]),
+                      lambda state: state != 'ACTIVE')
+    assert scheduler.run() == {'a': 'SUCCESS', 'b': 'ABORTED'}
+
+
+class Resolver:
+    def __init__(self, streams:Streams):
+        self.domo = type('Domo', (), {'streams': streams})()
+        self.resolved = []
+
+    def resolve(self, dataset_id):
+        self.resolved.append(dataset_id)
+        return 1
+
+
+def test_wait_for_completion_polls_until_the_execution_finishes(monkeypatch):
+    monkeypatch.setattr(poller.time, 'sleep', lambda seconds: None)
+    resolver = Resolver(Streams([execution(i, 60) for i in range(1, 4)]))
+    states = iter(['ACTIVE', 'ACTIVE', 'SUCCESS'])
+    result = poller.wait_for_completion(lambda: {'id': 4, 'currentState': next(states)}, resolver, 'dataset')
+    assert result == {'id': 4, 'currentState': 'SUCCESS'}
+    assert resolver.resolved == ['dataset']
+
+
+def test_wait_for_completion_returns_a_finished_execution_without_reading_the_history():
+    resolver = Resolver(Streams([]))
+    result = poller.wait_for_completion(lambda: {'id': 4, 'currentState': 'INVALID'}, resolver, 'dataset')
+    assert result['currentState'] == 'INVALID'
+    assert resolver.resolved == [] and resolver.domo.streams.requests == []
@@ -0,0 +1,79 @@
+import pytest
+
+import errors
+import poller
+import refresh_dataset
+
+
+class Streams:
+    def get(self, stream_id):
+        return {'id': stream_id, 'lastExecution': None}
+
+
+class Resolver:
+    """Starts executions that finish in the state given for their dataSet after a number of checks"""
+
+    def __init__(self, outcomes:dict):
+        self.outcomes = outcomes
+        self.checks = {}
+        self.domo = type('Domo', (), {'streams': Streams()})()
+
+    def resolve(self, dataset_id):
+        if dataset_id not in self.outcomes:
+            raise LookupError(f"stream with dataSet id:{dataset_id} not found!")
+        return f'stream-{dataset_id}'
+
+    def create_execution(self, dataset_id):
+        if self.outcomes[dataset_id] is None:
+            raise Exception('Error creating the execution')
+        return {'id': 1, 'currentState': 'ACTIVE'}
+
+    def get_execution(self, dataset_id, execution_id):
+        self.checks[dataset_id] = self.checks.get(dataset_id, 0) + 1
+        state, checks = self.outcomes[dataset_id]
+        return {'id': execution_id, 'currentState': 'ACTIVE' if self.checks[dataset_id] < checks else state}
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(poller.time, 'sleep', lambda seconds: None)
+
+
+def test_dataset_ids_are_read_from_the_list_and_the_file(tmp_path):
+    ids_file = tmp_path / 'ids.txt'
+    ids_file.write_text('# nightly\nb\n\n c \na\n')
+    assert refresh_dataset.read_dataset_ids('a, b', str(ids_file)) == ['a', 'b', 'c']
+
+
+def test_missing_dataset_ids_file_exits(tmp_path):
+    with pytest.raises(SystemExit) as exit_info:
+        refresh_dataset.read_dataset_ids(None, str(tmp_path / 'missing.txt'))
+    assert exit_info.value.code == errors.EXIT_CODE_FILE_NOT_FOUND
+
+
+def test_batch_refresh_reports_every_dataset_in_order():
+    resolver = Resolver({'a': ('SUCCESS', 3), 'b': ('INVALID', 1), 'c': None})
+    report = refresh_dataset.run_batch_refresh(['a', 'b', 'c', 'd'], resolver, max_concurrent=2,
+                                               wait_for_completion=True)
+    assert [(result['dataset_id'], result['status'], result['exit_code']) for result in report] == [
+        ('a', 'SUCCESS', errors.EXIT_CODE_FINAL_STATUS_SUCCESS),
+        ('b', 'INVALID', errors.EXIT_CODE_FINAL_STATUS_INVALID),
+        ('c', None, errors.EXIT_CODE_REFRESH_ERROR),
+        ('d', None, errors.EXIT_CODE_DATASET_NOT_FOUND)]
+    assert resolver.checks == {'a': 3, 'b': 1}
+
+
+def test_batch_refresh_without_waiting_only_starts_the_executions():
+    resolver = Resolver({'a': ('SUCCESS', 3)})
+    report = refresh_dataset.run_batch_refresh(['a'], resolver)
+    assert report[0]['status'] == 'ACTIVE'
+    assert resolver.checks == {}
+
+
+@pytest.mark.parametrize('exit_codes, expected', [
+    ([0, 0], errors.EXIT_CODE_FINAL_STATUS_SUCCESS),
+    ([0, errors.EXIT_CODE_FINAL_STATUS_INVALID, errors.EXIT_CODE_FINAL_STATUS_INVALID],
+     errors.EXIT_CODE_FINAL_STATUS_INVALID),
+    ([errors.EXIT_CODE_FINAL_STATUS_INVALID, errors.EXIT_CODE_REFRESH_ERROR], errors.EXIT_CODE_BATCH_FAILURE)])
+def test_batch_exit_code(exit_codes, expected):
+    assert refresh_dataset.determine_batch_exit_code([{'exit_code': code} for code in exit_codes]) == expected
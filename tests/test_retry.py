@@ -0,0 +1,113 @@
+import io
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import retry
+from retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class Response:
+    def __init__(self, status_code:int, headers:dict=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+
+
+def sender(*outcomes):
+    """Returns a send function that returns or raises the outcomes in turn, recording the body it sends"""
+    outcomes = list(outcomes)
+    sent = []
+
+    def send(body=None):
+        sent.append(body.read() if hasattr(body, 'read') else body)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return send, sent
+
+
+def test_retry_after_in_seconds_and_as_a_date():
+    assert retry.retry_delay('7', 0) == 7
+    assert retry.retry_delay('100000', 0) == retry.RETRY_AFTER_MAX
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < retry.retry_delay(date, 0) <= 30
+    assert 0 <= retry.retry_delay('soon', 3, backoff_base=1, backoff_max=5) <= 5
+
+
+@pytest.mark.parametrize('method, url, idempotent', [
+    ('PUT', 'https://api.domo.com/v1/streams/1/executions/2/part/3', True),
+    ('PUT', 'https://api.domo.com/v1/streams/1/executions/2/commit', False),
+    ('POST', 'https://api.domo.com/v1/streams/1/executions', False),
+    ('POST', 'https://api.domo.com/v1/datasets/query/execute/abc', True),
+    ('GET', 'https://api.domo.com/v1/datasets/abc?limit=1', True)])
+def test_idempotent_requests(method, url, idempotent):
+    assert retry.is_idempotent(method, url) == idempotent
+
+
+def test_transient_statuses_are_retried():
+    send, sent = sender(Response(503), Response(429, {'Retry-After': '1'}), Response(200))
+    response = RetryPolicy().send(send, 'GET', 'https://api.domo.com/v1/datasets')
+    assert response.status_code == 200
+    assert len(sent) == 3
+
+
+def test_retries_stop_after_max_retries():
+    send, sent = sender(*[Response(502) for _ in range(3)])
+    assert RetryPolicy(max_retries=2).send(send, 'GET', 'https://api.domo.com/v1/datasets').status_code == 502
+    assert len(sent) == 3
+
+
+def test_non_idempotent_requests_are_only_retried_when_unprocessed():
+    url = 'https://api.domo.com/v1/streams/1/executions/2/commit'
+    send, sent = sender(Response(502))
+    assert RetryPolicy().send(send, 'PUT', url).status_code == 502
+    send, sent = sender(Response(503), Response(200))
+    assert RetryPolicy().send(send, 'PUT', url).status_code == 200
+    send, sent = sender(requests.exceptions.ConnectionError('reset'))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        RetryPolicy().send(send, 'PUT', url)
+    assert len(sent) == 1
+
+
+def test_file_bodies_are_rewound_before_a_retry():
+    body = io.BytesIO(b'part data')
+    send, sent = sender(requests.exceptions.ConnectionError('reset'), Response(200))
+    url = 'https://api.domo.com/v1/streams/1/executions/2/part/1'
+    assert RetryPolicy().send(lambda: send(body), 'PUT', url, body).status_code == 200
+    assert sent == [b'part data', b'part data']
+
+
+def test_circuit_opens_after_repeated_failures_and_closes_after_a_trial(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retry.time, 'monotonic', lambda: now[0])
+    policy = RetryPolicy(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+    url = 'https://api.domo.com/v1/datasets'
+    for _ in range(2):
+        send, _ = sender(Response(503))
+        policy.send(send, 'GET', url)
+    send, sent = sender(Response(200))
+    with pytest.raises(CircuitOpenError):
+        policy.send(send, 'GET', url)
+    assert sent == []
+    now[0] += 31
+    assert policy.send(send, 'GET', url).status_code == 200
+    assert policy.breaker.opened_at is None
+
+
+def test_rate_limits_do_not_open_the_circuit():
+    policy = RetryPolicy(max_retries=0, breaker=CircuitBreaker(failure_threshold=1))
+    send, _ = sender(Response(429), Response(200))
+    policy.send(send, 'GET', 'https://api.domo.com/v1/datasets')
+    assert policy.send(send, 'GET', 'https://api.domo.com/v1/datasets').status_code == 200
@@ -0,0 +1,106 @@
+import pytest
+
+from cache import JsonCache
+from stream_resolver import StreamResolver
+
+
+class Transport:
+    def __init__(self, api_host:str, client_id:str):
+        self.apiHost = api_host
+        self.clientId = client_id
+
+
+class Utilities:
+    def __init__(self, streams:dict):
+        self.streams = streams
+        self.searches = 0
+
+    def get_stream_id(self, ds_id):
+        self.searches += 1
+        if ds_id not in self.streams:
+            raise IndexError('list index out of range')
+        return self.streams[ds_id]
+
+
+class Streams:
+    def __init__(self, live:set, error:Exception=None):
+        self.live = live
+        self.error = error
+        self.created = []
+
+    def check(self, stream_id):
+        if self.error is not None:
+            raise self.error
+        if stream_id not in self.live:
+            raise Exception('Error retrieving Stream: {"status":404,"statusReason":"Not Found"}')
+
+    def get_execution(self, stream_id, execution_id):
+        self.check(stream_id)
+        return {'id': execution_id, 'streamId': stream_id}
+
+    def create_execution(self, stream_id):
+        self.created.append(stream_id)
+        self.check(stream_id)
+        return {'id': 1, 'streamId': stream_id}
+
+
+class Domo:
+    def __init__(self, streams:dict, live:set=None, api_host:str='https://api.domo.com', client_id:str='client',
+                 error:Exception=None):
+        self.transport = Transport(api_host, client_id)
+        self.utilities = Utilities(streams)
+        self.streams = Streams(set(streams.values()) if live is None else live, error)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return JsonCache('streams', 3600, cache_dir=str(tmp_path))
+
+
+def test_streams_are_resolved_once(cache):
+    domo = Domo({'dataset': 1})
+    resolver = StreamResolver(domo, cache)
+    assert resolver.resolve('dataset') == 1
+    assert StreamResolver(domo, cache).resolve('dataset') == 1
+    assert domo.utilities.searches == 1
+
+
+def test_instances_and_credentials_do_not_share_entries(cache):
+    StreamResolver(Domo({'dataset': 1}), cache).resolve('dataset')
+    other_instance = Domo({'dataset': 2}, api_host='https://other.domo.com')
+    other_client = Domo({'dataset': 3}, client_id='other client')
+    assert StreamResolver(other_instance, cache).resolve('dataset') == 2
+    assert StreamResolver(other_client, cache).resolve('dataset') == 3
+
+
+def test_a_dataset_without_a_stream_is_not_found(cache):
+    with pytest.raises(LookupError):
+        StreamResolver(Domo({}), cache).resolve('dataset')
+
+
+def test_a_stale_stream_is_resolved_again(cache):
+    StreamResolver(Domo({'dataset': 1}), cache).resolve('dataset')
+    domo = Domo({'dataset': 2})
+    resolver = StreamResolver(domo, cache)
+    assert resolver.get_execution('dataset', 7) == {'id': 7, 'streamId': 2}
+    assert resolver.resolve('dataset') == 2
+
+
+def test_other_failures_are_not_retried(cache):
+    domo = Domo({'dataset': 1}, error=Exception('Error retrieving Execution: 503 Service Unavailable'))
+    resolver = StreamResolver(domo, cache)
+    resolver.resolve('dataset')
+    with pytest.raises(Exception, match='503'):
+        resolver.get_execution('dataset', 7)
+    assert domo.utilities.searches == 1
+
+
+def test_executions_are_never_created_twice(cache):
+    StreamResolver(Domo({'dataset': 1}), cache).resolve('dataset')
+    domo = Domo({'dataset': 2})
+    resolver = StreamResolver(domo, cache)
+    with pytest.raises(Exception, match='404'):
+        resolver.create_execution('dataset')
+    assert domo.streams.created == [1]
+    # the new stream is cached for the next attempt
+    assert resolver.create_execution('dataset')['streamId'] == 2
@@ -0,0 +1,87 @@
+import pydomo
+import pytest
+import requests
+
+import token_cache
+from cache import JsonCache
+from retry import RetryingTransport
+from token_cache import CachedTokenTransport, TokenCache, connect_domo
+
+
+class TokenResponse:
+    status_code = 200
+
+    def __init__(self, access_token:str):
+        self.access_token = access_token
+
+    def json(self):
+        return {'access_token': self.access_token, 'expires_in': 3600}
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_cache, 'JsonCache',
+                        lambda name, ttl, **kwargs: JsonCache(name, ttl, cache_dir=str(tmp_path), **kwargs))
+    return tmp_path
+
+
+@pytest.fixture
+def token_requests(monkeypatch):
+    issued = []
+
+    def post(url, auth):
+        issued.append(url)
+        return TokenResponse(f'token-{len(issued)}')
+    monkeypatch.setattr(requests, 'post', post)
+    return issued
+
+
+def test_cache_is_off_unless_enabled(cache_dir):
+    tokens = TokenCache()
+    tokens.set('oauth', 'api.domo.com', 'client', 'secret', 'token', 3600)
+    assert TokenCache(enabled=True).get('oauth', 'api.domo.com', 'client', 'secret') is None
+
+
+def test_tokens_are_only_read_back_with_their_secret(cache_dir):
+    tokens = TokenCache(enabled=True)
+    tokens.set('oauth', 'api.domo.com', 'client', 'secret', 'token', 3600)
+    assert tokens.get('oauth', 'api.domo.com', 'client', 'secret') == 'token'
+    assert tokens.get('oauth', 'api.domo.com', 'client', 'other secret') is None
+    assert tokens.get('oauth', 'other.domo.com', 'client', 'secret') is None
+
+
+def test_tokens_close_to_expiring_are_not_reused(cache_dir):
+    tokens = TokenCache(enabled=True)
+    tokens.set('session', 'instance', 'user@example.com', 'password', 'token', token_cache.REFRESH_MARGIN - 1)
+    assert tokens.get('session', 'instance', 'user@example.com', 'password') is None
+
+
+def test_renewed_tokens_keep_their_salt(cache_dir):
+    tokens = TokenCache(enabled=True)
+    tokens.set('oauth', 'api.domo.com', 'client', 'secret', 'first', 3600)
+    key = tokens.key('oauth', 'api.domo.com', 'client')
+    salt = tokens.cache.get(key)['salt']
+    tokens.set('oauth', 'api.domo.com', 'client', 'secret', 'second', 3600)
+    assert tokens.cache.get(key)['salt'] == salt
+    assert tokens.get('oauth', 'api.domo.com', 'client', 'secret') == 'second'
+
+
+def test_connect_domo_does_not_cache_tokens_by_default(cache_dir, token_requests):
+    domo = connect_domo('client', 'secret')
+    assert type(domo.transport) is RetryingTransport
+    assert domo.streams.transport is domo.transport
+    connect_domo('client', 'secret')
+    assert len(token_requests) == 2
+    assert pydomo.DomoAPITransport is pydomo.Transport.DomoAPITransport
+
+
+def test_connect_domo_reuses_a_cached_token(cache_dir, token_requests):
+    first = connect_domo('client', 'secret', token_cache=True)
+    second = connect_domo('client', 'secret', token_cache=True)
+    assert isinstance(second.transport, CachedTokenTransport)
+    assert second.transport.access_token == first.transport.access_token == 'token-1'
+    assert len(token_requests) == 1
+    # a rejected token is replaced, in the cache too
+    second.transport._renew_access_token()
+    assert second.transport.access_token == 'token-2'
+    assert connect_domo('client', 'secret', token_cache=True).transport.access_token == 'token-2'
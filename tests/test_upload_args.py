@@ -0,0 +1,34 @@
+import sys
+
+import pytest
+
+import upload_csv_to_dataset as upload
+
+REQUIRED = ['--client-id', 'client', '--secret-key', 'secret', '--file-name', 'rows.csv', '--dataset-name', 'rows',
+            '--insert-method', 'REPLACE']
+
+
+def parse(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['upload_csv_to_dataset.py'] + REQUIRED + list(args))
+    return upload.get_args()
+
+
+def test_defaults(monkeypatch):
+    args = parse(monkeypatch)
+    assert args.part_size_mb == 50
+    assert args.validation == 'off'
+
+
+@pytest.mark.parametrize('flag', ['--part-size-mb', '--upload-workers', '--read-workers', '--sample-rows',
+                                  '--sample-probes'])
+@pytest.mark.parametrize('value', ['0', '-1'])
+def test_counts_below_one_are_rejected(monkeypatch, capsys, flag, value):
+    with pytest.raises(SystemExit) as exit_info:
+        parse(monkeypatch, flag, value)
+    assert exit_info.value.code == 2
+    assert f'{flag} of at least 1' in capsys.readouterr().err
+
+
+def test_schema_cache_ttl_must_be_positive(monkeypatch):
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, '--schema-cache-ttl-hours', '0')
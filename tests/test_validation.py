@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+import validation
+
+
+def coerce(coercion, values:list):
+    values = pd.Series(values, dtype=object)
+    coerced, invalid = coercion(values, (values != '').to_numpy())
+    return list(coerced), list(invalid)
+
+
+def test_coerce_long():
+    coerced, invalid = coerce(validation.coerce_long, ['1', '2.0', '1e3', '', '1.5', 'x', '9007199254740993'])
+    assert coerced[:3] == [1, 2, 1000]
+    assert coerced[6] == 9007199254740993
+    assert invalid == [False, False, False, False, True, True, False]
+
+
+@pytest.mark.parametrize('coercion', [validation.coerce_long, validation.coerce_decimal])
+def test_numeric_coercers_treat_na_spellings_as_nulls(coercion):
+    coerced, invalid = coerce(coercion, ['NA', 'NULL', 'N/A', 'nan', 'null', '#N/A'])
+    assert not any(invalid)
+    assert all(pd.isna(value) or value == '' for value in coerced)
+
+
+def test_coerce_decimal_keeps_the_text_of_valid_values():
+    coerced, invalid = coerce(validation.coerce_decimal, ['1.10', '-2e-3', 'inf', 'abc', ''])
+    assert coerced[:2] == ['1.10', '-2e-3']
+    assert invalid == [False, False, True, True, False]
+
+
+def test_coerce_datetime():
+    coerced, invalid = coerce(validation.coerce_datetime,
+                              ['2023-01-02 03:04:05', '2023-01-02T03:04:05Z', '01/02/2023 03:04:05', 'soon', ''])
+    assert coerced[:3] == ['2023-01-02 03:04:05'] * 3
+    assert invalid == [False, False, False, True, False]
+
+
+def test_coerce_datetime_keeps_fractional_seconds():
+    coerced, invalid = coerce(validation.coerce_datetime,
+                              ['2023-01-01T10:00:00.750', '2023-01-01T10:00:00.000123', '2023-01-01T10:00:00.000'])
+    assert coerced == ['2023-01-01 10:00:00.750', '2023-01-01 10:00:00.000123', '2023-01-01 10:00:00']
+    assert not any(invalid)
+
+
+def test_coerce_date():
+    coerced, invalid = coerce(lambda values, present: validation.coerce_datetime(values, present, 'D'),
+                              ['2023-01-02', '2023-01-02T10:00:00', 'never'])
+    assert coerced[:2] == ['2023-01-02', '2023-01-02']
+    assert invalid == [False, False, True]
+
+
+def test_coerce_boolean():
+    coerced, invalid = coerce(validation.coerce_boolean, ['True', 'n', ' yes ', '0', 'maybe', ''])
+    assert coerced == ['true', 'false', 'true', 'false', '', '']
+    assert invalid == [False, False, False, False, True, False]
+
+
+def test_coerce_chunk_rejects_a_column_count_mismatch():
+    chunk = pd.DataFrame({'a': ['1'], 'b': ['x']})
+    with pytest.raises(validation.ValidationError):
+        validation.coerce_chunk(chunk, ['LONG'])
+    coerced, invalid = validation.coerce_chunk(chunk, ['LONG', 'STRING'])
+    assert coerced['a'].tolist() == [1] and invalid == {}
@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+from cache import JsonCache
+from watermark import Watermark
+
+
+class Datasets:
+    def __init__(self, value=None, error:Exception=None):
+        self.value = value
+        self.error = error
+        self.queries = []
+
+    def query(self, dataset_id, sql):
+        self.queries.append(sql)
+        if self.error is not None:
+            raise self.error
+        return {'rows': [[self.value]]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JsonCache('watermarks', 3600, cache_dir=str(tmp_path))
+
+
+def test_numbers_compare_as_numbers():
+    watermark = Watermark('id', 0, 'LONG', '9')
+    keep = watermark.mask(pd.Series(['10', '9', '', 'x', '100', '2']))
+    assert keep.tolist() == [True, False, False, False, True, False]
+    assert watermark.skipped == 4
+    assert watermark.new_value == '100'
+
+
+def test_datetimes_compare_as_points_in_time():
+    watermark = Watermark('updated', 1, 'DATETIME', '2024-01-02 00:00:00')
+    assert watermark.is_above('2024-01-10T08:00:00')
+    assert not watermark.is_above('2023-12-31 23:59:59')
+    assert not watermark.is_above('not a date')
+
+
+def test_without_a_watermark_every_valid_row_is_kept():
+    watermark = Watermark('id', 0, 'LONG')
+    assert watermark.mask(pd.Series(['3', '', '1'])).tolist() == [True, False, True]
+    assert watermark.any_above(pd.Series(['1']))
+    assert watermark.new_value == '3'
+
+
+def test_csv_parts_are_only_rewritten_when_partly_kept():
+    watermark = Watermark('id', 0, 'LONG', '5')
+    names = ['id', 'name']
+    kept = b'6,"six"\n7,"seven"\n'
+    assert watermark.filter_csv(kept, names) is kept
+    assert watermark.filter_csv(b'1,one\n2,two\n', names) == b''
+    assert watermark.filter_csv(b'4,four\n8,eight\n', names) == b'8,eight\n'
+    assert watermark.new_value == '8'
+
+
+def test_files_are_scanned_for_new_rows(tmp_path):
+    file_path = tmp_path / 'rows.csv'
+    file_path.write_text('id,name\n1,one\n2,two\n')
+    assert not Watermark('id', 0, 'LONG', '2').has_rows_above(str(file_path))
+    assert Watermark('id', 0, 'LONG', '1').has_rows_above(str(file_path))
+
+
+def test_the_dataset_is_the_record_of_what_was_uploaded(store):
+    Watermark('id', 0, 'LONG', '50').save(store, 'dataset')
+    datasets = Datasets(40)
+    watermark = Watermark.load(store, 'dataset', 'id', 0, 'LONG', datasets)
+    assert watermark.value == '40'
+    assert datasets.queries == ['SELECT MAX(`id`) FROM table']
+
+
+def test_the_recorded_watermark_is_used_when_the_dataset_cannot_be_queried(store):
+    Watermark('id', 0, 'LONG', '50').save(store, 'dataset')
+    watermark = Watermark.load(store, 'dataset', 'id', 0, 'LONG', Datasets(error=Exception('timed out')))
+    assert watermark.value == '50'
+    # a watermark recorded for another type of column is ignored
+    assert Watermark.load(store, 'dataset', 'id', 0, 'DATETIME').value is None
+
+
+def test_an_empty_dataset_has_no_watermark(store):
+    watermark = Watermark.load(store, 'dataset', 'id', 0, 'LONG', Datasets(None))
+    assert watermark.value is None
+    watermark.save(store, 'dataset')
+    assert store.get(Watermark.store_key('dataset', 'id')) is None